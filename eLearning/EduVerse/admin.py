@@ -8,6 +8,7 @@ admin.site.register(User)
 admin.site.register(Address)
 admin.site.register(Course)
 admin.site.register(Student)
+admin.site.register(StudentDashboard)
 admin.site.register(Teacher)
 admin.site.register(Enrollment)
 admin.site.register(Message)
\ No newline at end of file
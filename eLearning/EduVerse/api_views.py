@@ -3,16 +3,104 @@ Class views to fetch all objects from the database (queryset),
 defines which serializer should be used to convert the model instances to and from JSON format,
 set the permissions required to access the actions.
 Perform_create customises the create action.
+Each queryset joins (select_related) the relations nested by its serializer,
+so listing does a constant number of queries whatever the number of rows.
+The lists are cursor paginated on the primary key (see pagination.py).
+With ?fields= or ?expand= only the relations still nested in the response are joined.
+RoomHistoryView returns the chat history of a room backwards from a message id, RoomPresenceView its online count.
+Courses, enrollments and feedbacks answer conditional GETs (ETag / If-None-Match) from their version stamps.
 
 Reference: https://www.django-rest-framework.org/api-guide/viewsets/ and 
 https://www.django-rest-framework.org/api-guide/generic-views/
 '''
 
-from rest_framework import viewsets, permissions
+import hashlib
+from collections import Counter
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .notifications import publish_many
+from .presence import get_presence
 from .serializers import *
 from .models import *
 
-class UserViewSet(viewsets.ModelViewSet):
+# Conditional GET for the list and retrieve actions. The ETag is computed from the version stamps listed
+# in 'etag_version_fields' (the rows and the nested rows that change the response) of the rows of the page
+# only: the list reads the requested cursor window as values, with the keyset query of the page, so a request
+# with a matching If-None-Match gets a 304 before anything is serialized, whatever the size of the table
+class ConditionalGetMixin:
+    etag_version_fields = ['updated_at']
+
+    # Version stamps of the rows still nested in the response, ?fields= and ?expand= may leave some out
+    def get_etag_version_fields(self):
+        params = self.request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return self.etag_version_fields
+        paths = [f'{path}__' for path in related_paths(self.get_serializer())]
+        return [
+            field for field in self.etag_version_fields
+            if '__' not in field or any(path.startswith(field.rsplit('__', 1)[0] + '__') for path in paths)
+        ]
+
+    # Return the ETag of the rows of the queryset as returned for this request: the primary keys and
+    # version stamps of the rows of the page, and whether there are pages before and after it
+    def get_etag(self, queryset, paginate=False):
+        fields = ['pk', *self.get_etag_version_fields()]
+        key = [self.request.get_full_path(), self.request.accepted_media_type]
+        if paginate and self.pagination_class is not None:
+            # A paginator of its own, the one of the view paginates the response
+            paginator = self.pagination_class()
+            ordering = [field.lstrip('-') for field in paginator.get_ordering(self.request, queryset, self)]
+            rows = paginator.paginate_queryset(queryset.values(*dict.fromkeys(ordering + fields)), self.request, view=self)
+            key += [str(paginator.has_previous), str(paginator.has_next)]
+        else:
+            rows = queryset.values(*fields)
+        key += [str(tuple(row.values())) for row in rows]
+        return quote_etag(hashlib.sha1('|'.join(key).encode()).hexdigest())
+
+    # Answer with a 304 if the client already has this version, otherwise run the action and tag the response
+    def conditional_response(self, queryset, action, *args, paginate=False, **kwargs):
+        etag = self.get_etag(queryset, paginate)
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = action(self.request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, super().list, *args, paginate=True, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup]})
+        return self.conditional_response(queryset, super().retrieve, *args, **kwargs)
+
+# Viewset that joins only the relations of the nested serializers
+# still returned when the request uses ?fields= or ?expand=
+class SparseFieldsViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if 'fields' in params or 'expand' in params:
+            queryset = queryset.select_related(None)
+            # select_related() without paths would follow every foreign key
+            paths = related_paths(self.get_serializer())
+            if paths:
+                queryset = queryset.select_related(*paths)
+        return queryset
+
+class UserViewSet(SparseFieldsViewSet):
     # Queryset containing all User objects
     queryset = User.objects.all()
     # Serializer class to convert User instances to/from JSON
@@ -20,7 +108,7 @@ class UserViewSet(viewsets.ModelViewSet):
     # Only admin users can manage users
     permission_classes = [permissions.IsAdminUser]  
 
-class AddressViewSet(viewsets.ModelViewSet):
+class AddressViewSet(SparseFieldsViewSet):
     # Queryset containing all Address objects
     queryset = Address.objects.all()
     # Serializer class to convert Address instances to/from JSON
@@ -28,25 +116,27 @@ class AddressViewSet(viewsets.ModelViewSet):
     # Users must be authenticated
     permission_classes = [permissions.IsAuthenticated]  
 
-class StudentViewSet(viewsets.ModelViewSet):
-    # Queryset containing all Student objects
-    queryset = Student.objects.all()
+class StudentViewSet(SparseFieldsViewSet):
+    # Queryset containing all Student objects, joined with the nested user
+    queryset = Student.objects.select_related('user')
     # Serializer class to convert Stuident instances to/from JSON
     serializer_class = StudentSerializer
     # Only authenticated users can access student profiles
     permission_classes = [permissions.IsAuthenticated]  
 
-class TeacherViewSet(viewsets.ModelViewSet):
-    # Queryset containing all Teacher objects
-    queryset = Teacher.objects.all()
+class TeacherViewSet(SparseFieldsViewSet):
+    # Queryset containing all Teacher objects, joined with the nested user
+    queryset = Teacher.objects.select_related('user')
     # Serializer class to convert Teacher instances to/from JSON
     serializer_class = TeacherSerializer
     # Only authenticated users can access teacher profiles
     permission_classes = [permissions.IsAuthenticated]  
 
-class CourseViewSet(viewsets.ModelViewSet):
-    # Queryset containing all Course objects
-    queryset = Course.objects.all()
+class CourseViewSet(ConditionalGetMixin, SparseFieldsViewSet):
+    # Queryset containing all Course objects, joined with the nested teacher and user
+    queryset = Course.objects.select_related('teacher__user')
+    # The nested teacher and user change the response too
+    etag_version_fields = ['updated_at', 'teacher__updated_at', 'teacher__user__updated_at']
     # Serializer class to convert Course instances to/from JSON
     serializer_class = CourseSerializer
     # Only authenticated users can access the courses
@@ -61,8 +151,14 @@ class CourseViewSet(viewsets.ModelViewSet):
              # Raise a permission error if the user is not a teacher
             raise permissions.PermissionDenied("Only teachers can create courses.")
 
-class EnrollmentViewSet(viewsets.ModelViewSet):
-    queryset = Enrollment.objects.all()
+class EnrollmentViewSet(ConditionalGetMixin, SparseFieldsViewSet):
+    # Queryset joined with the nested student and course trees of the serializer
+    queryset = Enrollment.objects.select_related('student__user', 'course__teacher__user')
+    # The nested student, course, teacher and users change the response too
+    etag_version_fields = [
+        'updated_at', 'student__updated_at', 'student__user__updated_at',
+        'course__updated_at', 'course__teacher__updated_at', 'course__teacher__user__updated_at',
+    ]
     # Serializer class to convert Enrollment instances to/from JSON
     serializer_class = EnrollmentSerializer
     # Only authenticated users can access the enrollment
@@ -78,8 +174,68 @@ class EnrollmentViewSet(viewsets.ModelViewSet):
             # Raise a permission error if the user is not a student
             raise permissions.PermissionDenied("Only students can enroll in courses.")
 
-class FeedbackViewSet(viewsets.ModelViewSet):
-    queryset = Feedback.objects.all()
+    # Enroll many students at once (POST /api/enrollments/bulk/), only for admin users.
+    # The courses are locked first, as a single enrollment does, then the pairs not enrolled yet are inserted
+    # with one INSERT: the counters, dashboards and notifications are derived from the rows inserted,
+    # updated once, and each teacher gets a single notification
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        serializer = BulkEnrollmentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pairs = {(pair['student'], pair['course']) for pair in serializer.validated_data['enrollments']}
+        student_ids = {student_id for student_id, course_id in pairs}
+        course_ids = {course_id for student_id, course_id in pairs}
+
+        with transaction.atomic():
+            # No enrollment of these courses can be written by another request until the commit
+            Course.lock(course_ids)
+            enrolled = set(
+                Enrollment.objects.filter(student_id__in=student_ids, course_id__in=course_ids)
+                .values_list('student_id', 'course_id')
+            )
+            inserted = sorted(pairs - enrolled)
+            Enrollment.objects.bulk_create([Enrollment(student_id=student_id, course_id=course_id) for student_id, course_id in inserted])
+            added = Counter(course_id for student_id, course_id in inserted)
+
+            # bulk_create does not send signals, so update the counters with one UPDATE
+            # and rebuild the dashboards of the students enrolled
+            if added:
+                Course.objects.filter(pk__in=added).update(
+                    enrolled_count=F('enrolled_count') + Case(*[When(pk=pk, then=Value(n)) for pk, n in added.items()]),
+                    updated_at=timezone.now(),
+                )
+                StudentDashboard.rebuild_many({student_id for student_id, course_id in inserted})
+                # Logged in the same transaction, sent after the commit
+                self.notify_teachers(added)
+
+        return Response({'created': len(inserted), 'skipped': len(pairs) - len(inserted)}, status=status.HTTP_201_CREATED)
+
+    # Send one 'students_enrolled' message per teacher group with the courses that got new students
+    def notify_teachers(self, added):
+        notifications = {}
+        for course in Course.objects.filter(pk__in=added):
+            notifications.setdefault(course.teacher_id, []).append({
+                'course_id': course.pk,
+                'course_name': course.course_name,
+                'new_students': added[course.pk],
+                'enrolled_student_count': course.enrolled_count,
+            })
+        # Logged with one INSERT, sent to the teachers by the dispatcher (see notifications.py)
+        publish_many([
+            (f"teacher_{teacher_id}", {'type': 'students_enrolled', 'courses': courses})
+            for teacher_id, courses in notifications.items()
+        ])
+
+class FeedbackViewSet(ConditionalGetMixin, SparseFieldsViewSet):
+    # Queryset joined with the nested enrollment tree of the serializer
+    queryset = Feedback.objects.select_related('enrollment__student__user', 'enrollment__course__teacher__user')
+    # The nested enrollment, student, course, teacher and users change the response too
+    etag_version_fields = [
+        'updated_at', 'enrollment__updated_at', 'enrollment__student__updated_at', 'enrollment__student__user__updated_at',
+        'enrollment__course__updated_at', 'enrollment__course__teacher__updated_at', 'enrollment__course__teacher__user__updated_at',
+    ]
+    # Newest feedbacks first
+    cursor_ordering = '-pk'
     # Serializer class to convert Feedback instances to/from JSON
     serializer_class = FeedbackSerializer
     # Only authenticated users can access the feedback
@@ -96,8 +252,11 @@ class FeedbackViewSet(viewsets.ModelViewSet):
         # Save the feedback with the enrollment
         serializer.save(enrollment=enrollment)
 
-class MessageViewSet(viewsets.ModelViewSet):
-    queryset = Message.objects.all()
+class MessageViewSet(SparseFieldsViewSet):
+    # Queryset joined with the nested author
+    queryset = Message.objects.select_related('author')
+    # Newest messages first
+    cursor_ordering = '-pk'
     # Serializer class to convert Message instances to/from JSON
     serializer_class = MessageSerializer
     # Only authenticated users can access the message
@@ -106,3 +265,39 @@ class MessageViewSet(viewsets.ModelViewSet):
     # Overriding the default create behavior to set the author of the message as the current authenticated user
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+
+# Chat history of a room (GET /api/rooms/<room_id>/history/?before=<message id>&limit=<n>).
+# Returns the last 'limit' messages sent before the cursor, oldest first, and the cursor of the previous page.
+# The page is read backwards on the (room, id) index, so its cost does not depend on the size of the history
+class RoomHistoryView(APIView):
+    # Only authenticated users can read the chat history
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, room_id):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), settings.API_MAX_PAGE_SIZE))
+            before = request.query_params.get('before')
+            before = int(before) if before else None
+        except ValueError:
+            return Response({'detail': 'Invalid limit or cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        messages = Message.objects.filter(room_id=room_id)
+        if before is not None:
+            messages = messages.filter(pk__lt=before)
+        page = list(messages.order_by('-pk')[:limit])
+        page.reverse()
+
+        return Response({
+            'results': ChatHistorySerializer(page, many=True).data,
+            # Cursor of the older messages, None when the start of the history is reached
+            'before': page[0].pk if len(page) == limit else None,
+        })
+
+# Number of clients connected to a chat room (GET /api/rooms/<room_id>/presence/), read in O(1) from its presence set
+class RoomPresenceView(APIView):
+    # Only authenticated users can read the presence
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, room_id):
+        online = async_to_sync(get_presence(get_channel_layer()).count)(room_id)
+        return Response({'room': room_id, 'online': online})
@@ -6,3 +6,7 @@ from django.apps import AppConfig
 class EduverseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'EduVerse'
+
+    # Connect the signal receivers once the models are loaded
+    def ready(self):
+        from . import signals
@@ -0,0 +1,86 @@
+'''
+Asynchronous verification of the login credentials, through the backends of AUTHENTICATION_BACKENDS
+as django.contrib.auth.authenticate does (including the user_login_failed signal when they all refuse).
+For ModelBackend the user is fetched together with its Student or Teacher profile in one query, and only
+the password hashing runs in a bounded thread pool (settings.LOGIN_HASH_WORKERS), so it never blocks the
+event loop and a burst of logins cannot start more hashing threads than the pool size. The other backends
+run in a thread with sync_to_async.
+An unknown email is hashed with LOGIN_DUMMY_HASHER, the hasher of the stored passwords, so it takes as long
+as a wrong password. When the stored hash was made by a hasher other than the preferred one (or with other
+parameters), the password is rehashed and saved, as ModelBackend does.
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/async/,
+https://docs.djangoproject.com/en/5.1/topics/auth/customizing/#authentication-backends,
+https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.loop.run_in_executor
+'''
+
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import load_backend
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import PermissionDenied
+from .models import *
+
+# Thread pool for the password hashing
+hash_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'LOGIN_HASH_WORKERS', 4),
+    thread_name_prefix='login-hash',
+)
+
+
+# Run a hashing function in the pool
+async def run_hasher(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(hash_executor, lambda: function(*args, **kwargs))
+
+# True if the password has to be rehashed with the preferred hasher
+def must_rehash(encoded):
+    preferred = get_hasher('default')
+    hasher = identify_hasher(encoded)
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+# ModelBackend.authenticate with the profile fetched with the user and the hashing in the pool
+async def amodel_authenticate(backend, email, password):
+    user = await User.objects.select_related('student_profile', 'teacher_profile').filter(email=email).afirst()
+    if user is None:
+        # Hash the password anyway with the hasher of the stored passwords,
+        # so an unknown email takes as long as a wrong password
+        await run_hasher(make_password, password, hasher=getattr(settings, 'LOGIN_DUMMY_HASHER', 'default'))
+        return None
+    if not await run_hasher(check_password, password, user.password) or not backend.user_can_authenticate(user):
+        return None
+    if must_rehash(user.password):
+        user.password = await run_hasher(make_password, password)
+        await user.asave(update_fields=['password'])
+    return user
+
+# Return the user with the given email and password, with its profile already fetched, or None
+async def aauthenticate_with_profile(request, email, password):
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        try:
+            if type(backend).authenticate is ModelBackend.authenticate:
+                user = await amodel_authenticate(backend, email, password)
+            else:
+                try:
+                    inspect.signature(backend.authenticate).bind(request, email=email, password=password)
+                except TypeError:
+                    # This backend does not take an email and a password
+                    continue
+                user = await sync_to_async(backend.authenticate)(request, email=email, password=password)
+        except PermissionDenied:
+            # The backend refuses this user outright
+            break
+        if user is not None:
+            # The backend is needed by login()
+            user.backend = backend_path
+            return user
+    # Sent as by django.contrib.auth.authenticate, with the password hidden
+    await user_login_failed.asend(
+        sender='django.contrib.auth', credentials={'email': email, 'password': '********************'}, request=request,
+    )
+    return None
@@ -0,0 +1,124 @@
+'''
+Write-behind buffer persisting the chat messages.
+ChatConsumer only appends the messages to the buffer, so the database is never in the latency path of a message.
+The buffer is written with one bulk_create when it reaches CHAT_HISTORY_BATCH_SIZE messages
+or every CHAT_HISTORY_FLUSH_INTERVAL seconds, in the database thread of Channels.
+A batch that fails is put back in the buffer and written with the next flush. After CHAT_HISTORY_MAX_ATTEMPTS
+failures in a row the messages are written one at a time, so a message that cannot be stored does not hold
+back the others, and only the messages that still fail are logged and dropped.
+The messages still buffered when the process exits are written by an atexit handler
+(Daphne stops the reactor on SIGTERM/SIGINT, so the interpreter exits normally and runs it).
+
+Reference: https://docs.djangoproject.com/en/5.1/ref/models/querysets/#bulk-create,
+https://docs.python.org/3/library/atexit.html
+'''
+
+import asyncio
+import atexit
+import logging
+import threading
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from .models import *
+
+logger = logging.getLogger('EduVerse.chat_history')
+
+# Values of Message.type
+CHAT_MESSAGE = 0
+CHAT_NOTIFICATION = 1
+
+
+class MessageBuffer:
+    def __init__(self, batch_size, flush_interval, max_attempts):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.pending = []
+        # Failed writes in a row
+        self.failures = 0
+        # The buffer is filled on the event loop and emptied at exit from the main thread
+        self.lock = threading.Lock()
+        self.timer = None
+        # Flushes started by add(), kept until they are done so they are not garbage collected while running
+        self.flushes = set()
+
+    # Append a message, without touching the database
+    def add(self, message):
+        with self.lock:
+            self.pending.append(message)
+            full = len(self.pending) >= self.batch_size
+        if full:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+        self.start_timer()
+
+    # Start the periodic flush on the running event loop if it is not running there yet
+    def start_timer(self):
+        loop = asyncio.get_running_loop()
+        if self.timer is None or self.timer.done() or self.timer.get_loop() is not loop:
+            self.timer = loop.create_task(self.flush_periodically())
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # Take all the buffered messages
+    def take(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        return batch
+
+    # Put a batch that could not be written back in front of the buffer
+    def put_back(self, batch):
+        with self.lock:
+            self.pending[:0] = batch
+
+    # Write the buffered messages in the database thread (which closes the stale connections)
+    async def flush(self):
+        batch = self.take()
+        if batch:
+            await database_sync_to_async(self.write)(batch)
+
+    # Write the buffered messages from a sync context (used at exit), retrying until they are written or dropped
+    def flush_sync(self):
+        batch = self.take()
+        while batch:
+            self.write(batch)
+            batch = self.take()
+
+    # Insert a batch of messages in one transaction, so a failed batch can be written again without duplicates
+    def write(self, batch):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            self.failures += 1
+            if self.failures < self.max_attempts:
+                logger.warning(f'Could not write {len(batch)} chat messages, retried with the next flush', exc_info=True)
+                self.put_back(batch)
+                return
+            logger.exception(f'Could not write {len(batch)} chat messages {self.failures} times, writing them one at a time')
+            self.write_each(batch)
+        self.failures = 0
+
+    # Insert the messages one at a time, dropping the ones that cannot be stored
+    def write_each(self, batch):
+        for message in batch:
+            try:
+                message.save()
+            except Exception:
+                logger.exception(f'Chat message of user {message.author_id} in room {message.room_id} dropped')
+
+    def __len__(self):
+        return len(self.pending)
+
+
+message_buffer = MessageBuffer(
+    batch_size=getattr(settings, 'CHAT_HISTORY_BATCH_SIZE', 100),
+    flush_interval=getattr(settings, 'CHAT_HISTORY_FLUSH_INTERVAL', 0.5),
+    max_attempts=getattr(settings, 'CHAT_HISTORY_MAX_ATTEMPTS', 3),
+)
+atexit.register(message_buffer.flush_sync)
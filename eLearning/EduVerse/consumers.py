@@ -2,16 +2,33 @@
 These classes allow handling the WebSocket connections asynchronously.
 Each class calls methods for the client to connect and disconnect to a websocket,
 send and receive the messages about the author, message type, course name and so on.
+The chat messages are stored in the Message table through the write-behind buffer of chat_history.py.
+Each chat message is sent to the room as one event, and the frames sent to a client can be
+batched over CHAT_BATCH_WINDOW seconds into one JSON array.
+ChatConsumer keeps the presence of the room (see presence.py) and sends the join/leave deltas to the teachers.
+MultiplexConsumer carries the remove-student and notification frames of the contexts a user can follow over
+one connection, and replays the notifications missed by a client that reconnects (see notifications.py).
+The frames are JSON text, or MessagePack for the clients asking for the 'msgpack' subprotocol (see wire.py).
+All the consumers are rate limited and send through a bounded outbound queue (see throttling.py).
 
 Reference: https://channels.readthedocs.io/en/stable/tutorial/part_3.html,
 https://medium.com/atomic-loops/django-channels-is-all-you-need-94628dd6815c,
 https://github.com/twtrubiks/django-channels2-tutorial/blob/master/chat/consumers.py
 '''
 
+import asyncio
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Q
 from .models import *
+from .chat_history import CHAT_MESSAGE, CHAT_NOTIFICATION, message_buffer
+from .notifications import current_seq, missed_notifications
+from .presence import get_presence, presence_member
+from .throttling import ThrottledConsumerMixin
+from .wire import WireFormatMixin, decode, encode, encode_batch, with_encoded_frame
 import logging
 
 logger = logging.getLogger('EduVerse.NotificationConsumer')
@@ -20,13 +37,19 @@ logger = logging.getLogger('EduVerse.NotificationConsumer')
 User = get_user_model()
 
 # Class chat for asynchronous websocket
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(ThrottledConsumerMixin, WireFormatMixin, AsyncWebsocketConsumer):
 
     # Asynchronously called when the WebSocket connection is opened
     async def connect(self):
         # Extract room ID from the URL route and set the room group name
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'  # Group name for the chat room
+        # The messages are stored in the history only for the room of an existing course
+        self.room_exists = await database_sync_to_async(Course.objects.filter(pk=self.room_id).exists)()
+        # Outbound frames waiting for the batch window (see send_frame)
+        self.batch_window = getattr(settings, 'CHAT_BATCH_WINDOW', 0)
+        self.pending_frames = []
+        self.flush_task = None
 
         # Add the current channel to the group associated with the room_id
         await self.channel_layer.group_add(
@@ -35,15 +58,60 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         # Accept the WebSocket connection
         await self.accept()
+        await self.join_presence()
 
     # Asynchronously called when the WebSocket connection is closed
     async def disconnect(self, close_code):
+        # Drop the frames of a batch that can no longer be sent
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.leave_presence()
         # Remove the current channel from the group
         await self.channel_layer.group_discard(
             self.room_group_name, 
             self.channel_name     
         )
 
+    # Join the presence set of the room. Only teachers follow the presence:
+    # they get the members once, then the join/leave deltas through the presence group of the room
+    async def join_presence(self):
+        user = self.scope.get('user')
+        authenticated = user is not None and user.is_authenticated
+        name = user.get_full_name() if authenticated else 'Guest'
+        self.presence_store = get_presence(self.channel_layer)
+        self.presence_name = name
+        self.presence_member = presence_member(self.channel_name, name)
+        self.presence_group_name = f'presence_{self.room_id}'
+        self.follows_presence = authenticated and user.user_type == 'teacher'
+        online = await self.presence_store.join(self.room_id, self.presence_member)
+        # The delta is sent before following the presence, a teacher does not get its own join
+        await self.channel_layer.group_send(self.presence_group_name, {
+            'type': 'presence', 'action': 'join', 'name': name, 'online': online,
+        })
+        if self.follows_presence:
+            await self.channel_layer.group_add(self.presence_group_name, self.channel_name)
+            members = await self.presence_store.members(self.room_id)
+            await self.send_frame(encode({'presence': 'members', 'members': members, 'online': online}, self.wire_format))
+        self.heartbeat_task = asyncio.ensure_future(self.send_heartbeats())
+
+    # Keep the member of this connection from expiring
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT)
+            await self.presence_store.heartbeat(self.room_id, self.presence_member)
+
+    # Leave the presence set of the room and tell the teachers
+    async def leave_presence(self):
+        if not hasattr(self, 'heartbeat_task'):
+            return
+        self.heartbeat_task.cancel()
+        online = await self.presence_store.leave(self.room_id, self.presence_member)
+        if self.follows_presence:
+            await self.channel_layer.group_discard(self.presence_group_name, self.channel_name)
+        await self.channel_layer.group_send(self.presence_group_name, {
+            'type': 'presence', 'action': 'leave', 'name': self.presence_name, 'online': online,
+        })
+
     # Asynchronously called when a message is received from the WebSocket
     async def receive(self, text_data):
         # Parse the JSON data received from WebSocket and 
@@ -53,56 +121,96 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Extract course name from the data if provided
         course_name = data.get('course_name', '')
-        if course_name:
-            # Send the course name to the group, 
+        if message_type == 'course_name':
+            # Send only the course name to the group, 
             # which will be handled by the 'course_name' handler
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                with_encoded_frame({
                     'type': 'course_name',   
                     'course_name': course_name,  
-                }
-            )
-
-        # If the received message is not of type 'course_name', 
-        # treat it as a normal chat message
-        if message_type != 'course_name':
-            message = data.get('message', '')  
-            author = data.get('author', 'System')  
-
-            # Send the chat message to the group, 
-            # which will be handled by the 'chat_message' handler
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',  
-                    'message': message,    
-                    'author': author,    
-                }
+                })
             )
+            return
+
+        # Any other message is a normal chat message, sent to the group as one event
+        # carrying the course name and its encoded frame, which will be handled by the 'chat_message' handler
+        message = data.get('message', '')  
+        author = data.get('author', 'System')  
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            with_encoded_frame({
+                'type': 'chat_message',  
+                'message': message,    
+                'author': author,    
+                'course_name': course_name,
+            })
+        )
+        # Store the message through the write-behind buffer
+        self.store_message(message, author, message_type)
+
+    # Queue the message for the chat history, only for logged-in users
+    def store_message(self, message, author, message_type):
+        user = self.scope.get('user')
+        if not message or not self.room_exists or user is None or not user.is_authenticated:
+            return
+        message_buffer.add(Message(
+            reference_id=self.room_id,
+            room_id=int(self.room_id),
+            message=message,
+            author_id=user.pk,
+            type=CHAT_NOTIFICATION if message_type == 'notification' else CHAT_MESSAGE,
+            extraData=json.dumps({'author_name': author}),
+        ))
+
+    # Send an encoded frame to the WebSocket. With CHAT_BATCH_WINDOW set, the frames are collected
+    # for that many seconds and sent together as an array (a single frame is sent as is).
+    # A frame with a coalesce key replaces the collected frame with the same key, and a batch of one
+    # frame keeps its key in the outbound queue (see throttling.py)
+    async def send_frame(self, encoded, coalesce_key=None):
+        if not self.batch_window:
+            await self.send_encoded(encoded, coalesce_key=coalesce_key)
+            return
+        keys = [key for key, _ in self.pending_frames]
+        if coalesce_key is not None and coalesce_key in keys:
+            self.pending_frames[keys.index(coalesce_key)] = (coalesce_key, encoded)
+        else:
+            self.pending_frames.append((coalesce_key, encoded))
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_frames_later())
+
+    # Wait for the batch window to close, then send the collected frames
+    async def flush_frames_later(self):
+        await asyncio.sleep(self.batch_window)
+        self.flush_task = None
+        frames, self.pending_frames = self.pending_frames, []
+        if len(frames) == 1:
+            await self.send_encoded(frames[0][1], coalesce_key=frames[0][0])
+        elif frames:
+            await self.send_encoded(encode_batch([encoded for key, encoded in frames], self.wire_format))
 
     # Handler for chat messages sent to the group
     async def chat_message(self, event):
         # Send the chat message, author and course name (if available) to the WebSocket
-        await self.send(text_data=json.dumps({
-            'message': event.get('message', ''), 
-            'author': event.get('author', ''),  
-            'course_name': event.get('course_name', ''), 
-        }))
+        await self.send_frame(self.encoded_frame(event))
+
+    # Handler for the presence deltas, sent to the teachers in the room
+    async def presence(self, event):
+        await self.send_frame(encode({
+            'presence': event['action'],
+            'name': event['name'],
+            'online': event['online'],
+        }, self.wire_format))
 
     # Handler for course name messages sent to the group
     async def course_name(self, event):
-        # Extract the course name from the event data
-        course_name = event['course_name']
         # Send the course name to the WebSocket
-        await self.send(text_data=json.dumps({
-            'course_name': course_name, 
-        }))
+        await self.send_frame(self.encoded_frame(event), coalesce_key='course_name')
 
 
 
 # Class remove student for asynchronous websocket
-class RemoveStudentConsumer(AsyncWebsocketConsumer):
+class RemoveStudentConsumer(ThrottledConsumerMixin, WireFormatMixin, AsyncWebsocketConsumer):
 
     # Asynchronously called when the WebSocket connection is opened
     async def connect(self):
@@ -146,11 +254,11 @@ class RemoveStudentConsumer(AsyncWebsocketConsumer):
                 # Send a message to the group indicating a student removal
                 await self.channel_layer.group_send(
                     self.group_name,
-                    {
+                    with_encoded_frame({
                         'type': 'student_removed', 
                         'student_id': student_id, 
                         'course_id': course_id   
-                    }
+                    })
                 )
             else:
                 # invalid data
@@ -163,14 +271,10 @@ class RemoveStudentConsumer(AsyncWebsocketConsumer):
     # Handler for student removed messages
     async def student_removed(self, event):
         # Send the student removal details to the WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'student_removed',        
-            'student_id': event.get('student_id'), 
-            'course_id': event.get('course_id')   
-        }))
+        await self.send_event(event)
 
 # Class notifications for asynchronous websocket
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(ThrottledConsumerMixin, WireFormatMixin, AsyncWebsocketConsumer):
 
     async def connect(self):
         # Extract context ID and type from URL
@@ -213,13 +317,13 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             # Send a message to the group indicating a student has been enrolled
             await self.channel_layer.group_send(
                 self.group_name,
-                {
+                with_encoded_frame({
                     'type': 'student_enrolled',
                     'student_name': student_name,
                     'course_name': course_name,
                     'enrolled_student_count': enrolled_student_count,
                     'course_id': course_id,
-                }
+                })
             )
 
         # If the message type is 'update_material'
@@ -230,11 +334,11 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             # Send a message to the group indicating course materials have been updated
             await self.channel_layer.group_send(
             self.group_name, 
-            {
+            with_encoded_frame({
                 'type': 'update_material',
                 'course_name': data.get('course_name'),
                 'course_id': data.get('course_id'),
-            }
+            })
             )
 
         else:
@@ -244,20 +348,128 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     # This method is a handler for 'update_material' messages sent to the group
     async def update_material(self, event):
         # Send the update material details back to the WebSocket client
-        await self.send(text_data=json.dumps({
-            'type': 'update_material',
-            'course_name': event.get('course_name'),
-            'course_id': event.get('course_id')
-        }))
+        await self.send_event(event, coalesce_key=f"update_material_{event.get('course_id')}")
 
 
+    # This method is a handler for 'students_enrolled' messages, sent once per teacher by the bulk enrollment
+    async def students_enrolled(self, event):
+        # Send the courses with their new students back to the WebSocket client
+        await self.send_event(event)
+
     # This method is a handler for 'student_enrolled' messages sent to the group
     async def student_enrolled(self, event):
         # Send the student enrollment details back to the WebSocket client
-        await self.send(text_data=json.dumps({
-            'type': 'student_enrolled',
-            'student_name': event.get('student_name', 'Unknown'),
-            'course_name': event.get('course_name', 'Unknown'),
-            'enrolled_student_count': event.get('enrolled_student_count', 0),
-            'course_id': event.get('course_id', 0),
-        }))
\ No newline at end of file
+        await self.send_event(event)
+
+# True if the user may follow the notifications of a context: its own teacher or student profile,
+# and the courses it teaches or is enrolled in
+def can_follow(user, context_type, context_id):
+    if context_type == 'teacher':
+        return Teacher.objects.filter(pk=context_id, user=user).exists()
+    if context_type == 'student':
+        return Student.objects.filter(pk=context_id, user=user).exists()
+    return Course.objects.filter(Q(teacher__user=user) | Q(enrollment__student__user=user), pk=context_id).exists()
+
+# Class multiplexed websocket: one connection per page, subscribed to the groups of several contexts.
+# The frames are typed like the ones of RemoveStudentConsumer and NotificationConsumer, so both
+# streams share the connection and a single membership of the context group.
+# A logged in user can only subscribe to the contexts it can follow (see can_follow), and the connection only
+# receives from the server: the notifications are sent by the views through the notification log
+class MultiplexConsumer(ThrottledConsumerMixin, WireFormatMixin, AsyncWebsocketConsumer):
+    # Contexts a connection can subscribe to; how many at most is settings.MULTIPLEX_MAX_SUBSCRIPTIONS
+    CONTEXT_TYPES = ('teacher', 'student', 'course')
+    # Frames of the client managing its subscriptions, bounded by the subscription limit and never rate limited:
+    # a page subscribes to all its courses at once, and a subscription dropped would miss its notifications
+    CONTROL_TYPES = ('subscribe', 'unsubscribe')
+    # Events of the notification log replayed on subscribe
+    REPLAYED_TYPES = ('student_removed', 'student_enrolled', 'students_enrolled', 'update_material')
+    # Asynchronously called when the WebSocket connection is opened, only for a logged in user
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.subscriptions = set()
+        # A student page joins the groups of its courses too
+        self.max_subscriptions = getattr(settings, 'MULTIPLEX_MAX_SUBSCRIPTIONS', 200)
+        await self.accept()
+
+    # The subscribe and unsubscribe frames are left out of the rate limit (see throttling.py)
+    def exempt_from_rate_limit(self, message):
+        data = decode(message, self.wire_format)
+        return isinstance(data, dict) and data.get('type') in self.CONTROL_TYPES
+
+    # Asynchronously called when the WebSocket connection is closed
+    async def disconnect(self, close_code):
+        # Leave every group subscribed to
+        for group_name in getattr(self, 'subscriptions', ()):
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+
+    # Group of the context named by a frame, None if the context is not valid
+    def context_group(self, data):
+        context_type = data.get('context_type')
+        context_id = str(data.get('context_id', ''))
+        if context_type not in self.CONTEXT_TYPES or not context_id.isdigit():
+            return None
+        return f'{context_type}_{context_id}'
+
+    # Asynchronously called when a message is received from the WebSocket
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        message_type = data.get('type')
+        group_name = self.context_group(data)
+        if group_name is None:
+            logger.warning(f"Invalid context in MultiplexConsumer: {data}")
+            return
+
+        if message_type == 'subscribe':
+            if group_name in self.subscriptions:
+                return
+            context = {'context_type': data['context_type'], 'context_id': data['context_id']}
+            if len(self.subscriptions) >= self.max_subscriptions:
+                # Tell the client which context gets no notifications instead of dropping it silently
+                logger.warning(f"Subscription limit of {self.max_subscriptions} reached by {self.channel_name}, {group_name} refused")
+                await self.send_encoded(encode({'type': 'subscribe_refused', **context, 'group': group_name, 'reason': 'limit', 'limit': self.max_subscriptions}, self.wire_format))
+                return
+            if not await database_sync_to_async(can_follow)(self.scope['user'], data['context_type'], int(data['context_id'])):
+                logger.warning(f"{self.scope['user']} is not allowed to follow {group_name}")
+                await self.send_encoded(encode({'type': 'subscribe_refused', **context, 'group': group_name, 'reason': 'forbidden'}, self.wire_format))
+                return
+            self.subscriptions.add(group_name)
+            await self.channel_layer.group_add(group_name, self.channel_name)
+            await self.resume(group_name, data)
+        elif message_type == 'unsubscribe':
+            if group_name in self.subscriptions:
+                self.subscriptions.discard(group_name)
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+        else:
+            # The notifications come from the server only (see notifications.py), a client sends none
+            logger.warning(f"Unsupported message type in MultiplexConsumer: {message_type}")
+
+    # Replay the notifications missed by a client that subscribes again with the last seq it received.
+    # The group is joined first, so a notification sent meanwhile can arrive twice but is never lost
+    # (the client skips the seqs it already has). Without last_seq the client gets the current seq
+    async def resume(self, group_name, data):
+        context = {'context_type': data['context_type'], 'context_id': data['context_id']}
+        try:
+            last_seq = int(data['last_seq']) if data.get('last_seq') is not None else None
+        except (TypeError, ValueError):
+            last_seq = None
+        if last_seq is None:
+            seq = await database_sync_to_async(current_seq)()
+            await self.send_encoded(encode({'type': 'subscribed', **context, 'group': group_name, 'seq': seq}, self.wire_format))
+            return
+        missed, complete = await database_sync_to_async(missed_notifications)(group_name, last_seq)
+        if not complete:
+            # The missed notifications are no longer in the log, the client has to reload
+            await self.send_encoded(encode({'type': 'resync', **context, 'group': group_name}, self.wire_format))
+            return
+        for event in missed:
+            if event['type'] in self.REPLAYED_TYPES:
+                await getattr(self, event['type'])(event)
+
+    # Handlers of the group events, the same frames as the single-purpose consumers
+    student_removed = RemoveStudentConsumer.student_removed
+    student_enrolled = NotificationConsumer.student_enrolled
+    students_enrolled = NotificationConsumer.students_enrolled
+    update_material = NotificationConsumer.update_material
@@ -0,0 +1,19 @@
+'''
+Password hasher used by default for new and updated passwords (see PASSWORD_HASHERS in settings.py).
+It is Django's argon2 hasher with the cost parameters taken from the settings, so they can be tuned
+for the login latency of the server. Passwords hashed with another hasher (the PBKDF2 ones of the existing users)
+or with other parameters are rehashed transparently at the next successful login.
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/auth/passwords/#using-argon2-with-django,
+https://cheatsheetseries.owasp.org/cheatsheets/Password_Storage_Cheat_Sheet.html#argon2id
+'''
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    # Number of iterations, memory in KiB and number of lanes
+    time_cost = getattr(settings, 'ARGON2_TIME_COST', 2)
+    memory_cost = getattr(settings, 'ARGON2_MEMORY_COST', 19456)
+    parallelism = getattr(settings, 'ARGON2_PARALLELISM', 1)
@@ -0,0 +1,194 @@
+'''
+Channel layer delivering the messages to the channels of its own process in memory, and through Redis to the others.
+The channels of the consumers of a process share one Redis key (specific.<client prefix>!), so the channel name
+tells whether a member of a group is local. The layer keeps the groups of its local channels next to their Redis
+membership: group_send puts the message in the receive buffer of each local member directly, and only the members
+of other processes, read from the group in Redis with one round trip, get it through Redis.
+A group whose members are all in the process costs one round trip instead of the ZADD script, its pipeline and the
+BZPOPMIN and cleanup of the receiving side, and the message is never serialized.
+The messages sent through Redis to the process are moved into the receive buffers by one task per process
+(instead of the receive lock of RedisChannelLayer), so a local delivery is never stuck behind a BZPOPMIN.
+A message sent from another thread (the notification dispatcher, see notifications.py) is handed to the event loop
+of the receivers.
+ShardedChannelLayer spreads the groups, the process channels and the presence sets (see presence.py) over
+its Redis hosts with a consistent-hash ring: each host has RING_REPLICAS points on the ring and a key belongs to
+the first point after its own hash. channels_redis splits the hash range in equal slices instead, so adding a
+host moves about half of the keys; with the ring only the keys taken by the new host move (about 1/N of them),
+and the rebalance_channel_layer command moves them from their previous host.
+
+Usage: CHANNEL_LAYERS = {'default': {'BACKEND': 'EduVerse.layers.ShardedChannelLayer', 'CONFIG': {'hosts': [...]}}}
+
+Reference: https://github.com/django/channels_redis/blob/main/channels_redis/core.py,
+https://channels.readthedocs.io/en/stable/topics/channel_layers.html#single-channels,
+https://docs.python.org/3/library/asyncio-eventloop.html#asyncio.loop.call_soon_threadsafe,
+https://en.wikipedia.org/wiki/Consistent_hashing
+'''
+
+import asyncio
+import bisect
+import hashlib
+import logging
+from channels_redis.core import RedisChannelLayer
+from .multicast import redis_group_channels, redis_send_to_channels
+
+logger = logging.getLogger('EduVerse.layers')
+
+
+class HybridChannelLayer(RedisChannelLayer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Local channels of each group, as added in Redis
+        self.local_groups = {}
+        # Tasks receiving the messages sent through Redis to the process, by process channel, and their event loop
+        self.receivers = {}
+        self.receive_loop = None
+
+    # True for the channels of the consumers of this process
+    def is_local(self, channel):
+        return '!' in channel and self.non_local_name(channel).endswith(self.client_prefix + '!')
+
+    # Put a message in the buffer of a local channel, on the event loop of the receivers
+    def deliver(self, channel, message):
+        loop = self.receive_loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or loop is running or loop.is_closed():
+            self.put_local(channel, dict(message))
+        else:
+            # The buffer is looked up on the loop: receive() may drop the one there is now before the call runs
+            loop.call_soon_threadsafe(self.put_local, channel, dict(message))
+
+    def put_local(self, channel, message):
+        self.receive_buffer[channel].put_nowait(message)
+
+    async def send(self, channel, message):
+        if self.is_local(channel):
+            assert isinstance(message, dict), 'message is not a dict'
+            self.deliver(channel, message)
+        else:
+            await super().send(channel, message)
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        if self.is_local(channel):
+            self.local_groups.setdefault(group, set()).add(channel)
+
+    async def group_discard(self, group, channel):
+        members = self.local_groups.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del self.local_groups[group]
+        await super().group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        await self.group_send_many([group], message)
+
+    # Send a message to the channels of the groups, once per channel (see multicast.py)
+    async def group_send_many(self, groups, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        local = set()
+        for group in groups:
+            assert self.valid_group_name(group), 'Group name not valid'
+            local.update(self.local_groups.get(group, ()))
+        for channel in local:
+            self.deliver(channel, message)
+        remote = [channel for channel in await redis_group_channels(self, groups) if not self.is_local(channel)]
+        if remote:
+            await redis_send_to_channels(self, remote, message, groups)
+
+    async def receive(self, channel):
+        if not self.is_local(channel):
+            return await super().receive(channel)
+        self.start_receiver(self.non_local_name(channel))
+        buffer = self.receive_buffer[channel]
+        try:
+            return await buffer.get()
+        finally:
+            # Drop the buffer of a channel with nothing left, like RedisChannelLayer
+            if buffer.empty() and self.receive_buffer.get(channel) is buffer:
+                del self.receive_buffer[channel]
+
+    # Start the task receiving the messages of a process channel, once per event loop
+    def start_receiver(self, process_channel):
+        loop = asyncio.get_running_loop()
+        if self.receive_loop is not loop:
+            if self.receive_loop is not None and not self.receive_loop.is_closed() and self.receive_loop.is_running():
+                raise RuntimeError('Two event loops are trying to receive() on one channel layer at once!')
+            self.receive_loop = loop
+            self.receivers = {}
+        task = self.receivers.get(process_channel)
+        if task is None or task.done():
+            self.receivers[process_channel] = loop.create_task(self.receive_remote(process_channel))
+
+    # Move the messages sent through Redis to the process into the buffers of their channels
+    async def receive_remote(self, process_channel):
+        while True:
+            try:
+                message_channel, message = await self.receive_single(process_channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Receiving from Redis failed, retrying')
+                await asyncio.sleep(1)
+                continue
+            for channel in message_channel if isinstance(message_channel, list) else [message_channel]:
+                self.receive_buffer[channel].put_nowait(message)
+
+    # Stop the receiving tasks of the running event loop before the connections are closed
+    async def close_pools(self):
+        if self.receive_loop is asyncio.get_running_loop():
+            for task in self.receivers.values():
+                task.cancel()
+            self.receivers = {}
+        await super().close_pools()
+
+    async def flush(self):
+        self.local_groups.clear()
+        await super().flush()
+
+
+# Name of a Redis host of the layer configuration, its position on the ring does not depend on the order of the hosts
+def node_name(host):
+    if 'address' in host:
+        return host['address']
+    if 'master_name' in host:
+        return host['master_name']
+    return f"{host.get('host', 'localhost')}:{host.get('port', 6379)}/{host.get('db', 0)}"
+
+
+# Position of a value on the ring, the same in every process
+def ring_position(value):
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+
+# Consistent-hash ring of the hosts, by index in the host list
+class HashRing:
+    def __init__(self, names, replicas):
+        self.size = len(names)
+        points = sorted((ring_position(f'{name}#{replica}'), index) for index, name in enumerate(names) for replica in range(replicas))
+        self.positions = [position for position, index in points]
+        self.indexes = [index for position, index in points]
+
+    def index(self, value):
+        if self.size == 1:
+            return 0
+        point = bisect.bisect(self.positions, ring_position(value))
+        return self.indexes[point % len(self.positions)]
+
+
+class ShardedChannelLayer(HybridChannelLayer):
+    # Points of each host on the ring, more points spread the keys more evenly
+    RING_REPLICAS = 160
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ring = HashRing([node_name(host) for host in self.hosts], self.RING_REPLICAS)
+
+    # Index of the host of a group or channel
+    def consistent_hash(self, value):
+        return self.ring.index(value)
@@ -0,0 +1,79 @@
+'''
+Benchmark of the stock RedisChannelLayer against HybridChannelLayer (see layers.py) for group messages.
+A group has --clients channels in the process of the sender and --remote channels of a second layer instance,
+which stands for another Daphne worker (it has its own client prefix, so its channels are remote).
+The sender sends --messages group messages at --rate messages per second (0: as fast as it can) and every channel
+receives all of them; the latency from group_send to receive, the messages per second and the Redis commands
+(per message and per second) are measured.
+Each run uses its own key prefix, deleted at the end.
+
+Usage: python manage.py benchmark_channel_layer --clients 10 --remote 0 --messages 500 --rate 100 --redis redis://127.0.0.1:6379
+
+Reference: https://channels.readthedocs.io/en/stable/topics/channel_layers.html,
+https://redis.readthedocs.io/en/stable/examples/asyncio_examples.html
+'''
+
+import asyncio
+import statistics
+import time
+import uuid
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from EduVerse.layers import HybridChannelLayer
+from .benchmark_chat_fanout import RedisCounter
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency and Redis traffic of RedisChannelLayer and HybridChannelLayer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help='Channels of the group in the sending process')
+        parser.add_argument('--remote', type=int, default=0, help='Channels of the group in another process')
+        parser.add_argument('--messages', type=int, default=500, help='Group messages sent')
+        parser.add_argument('--rate', type=float, default=100, help='Messages sent per second, 0 for no limit')
+        parser.add_argument('--redis', help='Redis URL (default: the hosts of the CHANNEL_LAYERS setting)')
+
+    def handle(self, *args, **options):
+        hosts = [options['redis']] if options['redis'] else settings.CHANNEL_LAYERS['default']['CONFIG']['hosts']
+        for label, layer_class in [('RedisChannelLayer', RedisChannelLayer), ('HybridChannelLayer', HybridChannelLayer)]:
+            result = asyncio.run(self.run(layer_class, hosts, options['clients'], options['remote'], options['messages'], options['rate']))
+            self.stdout.write(f'{label}: ' + ', '.join(f'{value:.2f} {name}' for name, value in result.items()))
+
+    async def run(self, layer_class, hosts, clients, remote, messages, rate):
+        prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+        layer = layer_class(hosts=hosts, prefix=prefix, capacity=100000)
+        other = layer_class(hosts=hosts, prefix=prefix, capacity=100000)
+        members = []
+        for member_layer, count in [(layer, clients), (other, remote)]:
+            for _ in range(count):
+                channel = await member_layer.new_channel()
+                await member_layer.group_add('benchmark', channel)
+                members.append((member_layer, channel))
+
+        latencies = []
+        async def receive_all(member_layer, channel):
+            for _ in range(messages):
+                message = await member_layer.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+
+        with RedisCounter() as counter:
+            start = time.perf_counter()
+            receivers = [asyncio.create_task(receive_all(member_layer, channel)) for member_layer, channel in members]
+            for i in range(messages):
+                await layer.group_send('benchmark', {'type': 'chat_message', 'message': f'message {i}', 'sent': time.perf_counter()})
+                # Let the receivers run between the messages, as the consumers of a server would
+                await asyncio.sleep(max(0, start + (i + 1) / rate - time.perf_counter()) if rate else 0)
+            await asyncio.wait_for(asyncio.gather(*receivers), timeout=120)
+            elapsed = time.perf_counter() - start
+        await layer.flush()
+        await other.flush()
+
+        latencies.sort()
+        return {
+            'ms mean latency': statistics.mean(latencies) * 1000,
+            'ms p95 latency': latencies[int(len(latencies) * 0.95)] * 1000,
+            'messages/sec': messages / elapsed,
+            'redis commands/msg': counter.commands / messages,
+            'redis ops/sec': counter.commands / elapsed,
+        }
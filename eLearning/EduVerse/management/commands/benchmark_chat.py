@@ -0,0 +1,94 @@
+'''
+Benchmark of the sustained chat throughput of one room with the chat history enabled.
+A number of clients join the same room through ChatConsumer (in-process, in-memory channel layer),
+one of them sends the messages as fast as possible and the time until every client has received
+all of them is measured. The messages are persisted by the write-behind buffer, the number of
+INSERT batches is reported. The benchmark users, course and messages are deleted at the end.
+
+Usage: python manage.py benchmark_chat --clients 10 --messages 2000
+
+Reference: https://channels.readthedocs.io/en/stable/topics/testing.html
+'''
+
+import asyncio
+import time
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from EduVerse.chat_history import message_buffer
+from EduVerse.models import *
+from EduVerse.routing import websocket_urlpatterns
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 1000000}}}
+
+
+class Command(BaseCommand):
+    help = 'Measure the messages/sec of one chat room with the chat history enabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help='Clients in the room')
+        parser.add_argument('--messages', type=int, default=2000, help='Messages sent')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(email='chat-benchmark@example.com', user_type='student')
+        teacher = User.objects.create(email='chat-benchmark-teacher@example.com', user_type='teacher')
+        # The chat room of a temporary course
+        course = Course.objects.create(
+            course_name='Chat benchmark', course_start_date='2024-01-01', course_length=1,
+            midterm_deadline='2024-01-01', final_deadline='2024-01-01', teacher=teacher.teacher_profile,
+        )
+        try:
+            # The sender is not rate limited
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, WEBSOCKET_RATE_LIMIT=0):
+                elapsed, batches = asyncio.run(self.run(user, course.pk, options['clients'], options['messages']))
+            stored = Message.objects.filter(room=course).count()
+            rate = options['messages'] / elapsed
+            self.stdout.write(
+                f"{options['messages']} messages to {options['clients']} clients in {elapsed:.2f}s: "
+                f"{rate:.0f} messages/sec, {stored} stored in {batches} INSERT batches"
+            )
+        finally:
+            # Deleting the course deletes its messages
+            course.delete()
+            user.delete()
+            teacher.delete()
+
+    async def run(self, user, room_id, clients, messages):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for _ in range(clients):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/')
+            communicator.scope['user'] = user
+            await communicator.connect()
+            communicators.append(communicator)
+
+        # Count the INSERT batches written by the buffer
+        batches = 0
+        write = message_buffer.write
+        def counting_write(batch):
+            nonlocal batches
+            batches += 1
+            write(batch)
+        message_buffer.write = counting_write
+
+        async def receive_all(communicator):
+            received = 0
+            while received < messages:
+                frame = await communicator.receive_json_from(timeout=30)
+                # Frames batched by the consumer arrive as an array
+                received += len(frame) if isinstance(frame, list) else 1
+
+        start = time.perf_counter()
+        receivers = [asyncio.create_task(receive_all(c)) for c in communicators]
+        for i in range(messages):
+            await communicators[0].send_json_to({'message': f'message {i}', 'author': 'Benchmark'})
+        await asyncio.gather(*receivers)
+        elapsed = time.perf_counter() - start
+
+        await message_buffer.flush()
+        message_buffer.write = write
+        for communicator in communicators:
+            await communicator.disconnect()
+        return elapsed, batches
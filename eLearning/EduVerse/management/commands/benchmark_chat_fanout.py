@@ -0,0 +1,143 @@
+'''
+Benchmark of the channel layer traffic of one chat room, per inbound chat message.
+A number of clients join the same room through ChatConsumer (in-process, Redis channel layer),
+one of them sends messages carrying the course name, as chat.js does, and the Redis commands,
+Redis round trips, group_sends and WebSocket frames are counted until every client has received
+all of them. It runs three times:
+- two events: the previous protocol, one 'course_name' and one 'chat_message' event per message
+- one event: the course name carried by the 'chat_message' event
+- one event, batched: the same with the frames collected over --window seconds
+The room is not the room of a course, so no message is stored.
+
+Usage: python manage.py benchmark_chat_fanout --clients 10 --messages 500 --redis redis://127.0.0.1:6379
+
+Reference: https://channels.readthedocs.io/en/stable/topics/channel_layers.html,
+https://redis.readthedocs.io/en/stable/examples/asyncio_examples.html
+'''
+
+import asyncio
+import json
+import time
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.test import override_settings
+from django.urls import re_path
+from redis.asyncio.client import Pipeline, Redis
+from EduVerse.consumers import ChatConsumer
+from EduVerse.models import *
+
+# ChatConsumer with the previous protocol: the course name is sent to the group as a separate event
+class TwoEventChatConsumer(ChatConsumer):
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        course_name = data.get('course_name', '')
+        if course_name:
+            await self.channel_layer.group_send(self.room_group_name, {'type': 'course_name', 'course_name': course_name})
+        if data.get('type') != 'course_name':
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_message', 'message': data.get('message', ''), 'author': data.get('author', 'System'),
+            })
+
+
+# Count the Redis commands and round trips of every client while it is active
+class RedisCounter:
+
+    def __enter__(self):
+        self.commands = self.round_trips = 0
+        self.execute_command, self.execute = Redis.execute_command, Pipeline.execute
+        counter = self
+
+        async def execute_command(redis, *args, **options):
+            counter.commands += 1
+            counter.round_trips += 1
+            return await counter.execute_command(redis, *args, **options)
+
+        async def execute(pipeline, *args, **options):
+            counter.commands += len(pipeline.command_stack)
+            counter.round_trips += 1
+            return await counter.execute(pipeline, *args, **options)
+
+        Redis.execute_command, Pipeline.execute = execute_command, execute
+        return self
+
+    def __exit__(self, *exc):
+        Redis.execute_command, Pipeline.execute = self.execute_command, self.execute
+
+
+class Command(BaseCommand):
+    help = 'Measure the Redis commands and WebSocket frames per chat message of one room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10, help='Clients in the room')
+        parser.add_argument('--messages', type=int, default=500, help='Messages sent')
+        parser.add_argument('--window', type=float, default=0.005, help='CHAT_BATCH_WINDOW of the batched run')
+        parser.add_argument('--redis', help='Redis URL of the channel layer (default: the CHANNEL_LAYERS setting)')
+
+    def handle(self, *args, **options):
+        layers = settings.CHANNEL_LAYERS
+        if options['redis']:
+            layers = {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [options['redis']], 'capacity': 100000}}}
+        room_id = (Course.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        runs = [
+            ('two events', TwoEventChatConsumer, 0),
+            ('one event', ChatConsumer, 0),
+            ('one event, batched', ChatConsumer, options['window']),
+        ]
+        for label, consumer, window in runs:
+            # The sender is not rate limited
+            with override_settings(CHANNEL_LAYERS=layers, CHAT_BATCH_WINDOW=window, WEBSOCKET_RATE_LIMIT=0):
+                result = asyncio.run(self.run(consumer, room_id, options['clients'], options['messages']))
+            self.stdout.write(f'{label}: ' + ', '.join(f'{value:.2f} {name}' for name, value in result.items()))
+
+    async def run(self, consumer, room_id, clients, messages):
+        application = URLRouter([re_path(r'ws/chat/(?P<room_id>\d+)/$', consumer.as_asgi())])
+        layer = get_channel_layer()
+        communicators = []
+        for _ in range(clients):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/')
+            await communicator.connect()
+            communicators.append(communicator)
+
+        # Count the group_sends of the consumers
+        group_sends = 0
+        group_send = layer.group_send
+        async def counting_group_send(*args, **kwargs):
+            nonlocal group_sends
+            group_sends += 1
+            await group_send(*args, **kwargs)
+        layer.group_send = counting_group_send
+
+        frames = 0
+        async def receive_all(communicator):
+            nonlocal frames
+            received = 0
+            while received < messages:
+                frame = await communicator.receive_json_from(timeout=30)
+                frames += 1
+                # Frames batched by the consumer arrive as an array
+                received += len([item for item in (frame if isinstance(frame, list) else [frame]) if 'message' in item])
+
+        with RedisCounter() as counter:
+            start = time.perf_counter()
+            receivers = [asyncio.create_task(receive_all(c)) for c in communicators]
+            for i in range(messages):
+                await communicators[0].send_json_to({'message': f'message {i}', 'author': 'Benchmark', 'course_name': 'Benchmark'})
+            await asyncio.gather(*receivers)
+            elapsed = time.perf_counter() - start
+
+        del layer.group_send
+        for communicator in communicators:
+            await communicator.disconnect()
+        await layer.flush()
+        return {
+            'group_sends/msg': group_sends / messages,
+            'redis commands/msg': counter.commands / messages,
+            'redis round trips/msg': counter.round_trips / messages,
+            'frames/client/msg': frames / clients / messages,
+            'messages/sec': messages / elapsed,
+        }
@@ -0,0 +1,70 @@
+'''
+Benchmark of the login credential check under a burst of concurrent logins.
+For each hasher a set of temporary users is created, then all of them log in at the same time:
+  - sync: Django's authenticate() through sync_to_async, as the previous sync login view ran under Daphne
+    (all the sync views share one thread, so the logins are checked one after the other)
+  - async: aauthenticate_with_profile, hashing in the LOGIN_HASH_WORKERS thread pool
+The p50 and p99 latency of the burst are printed. The temporary users are deleted at the end.
+
+Usage: python manage.py benchmark_login --burst 50
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/async/#sync-to-async
+'''
+
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from EduVerse.authentication import aauthenticate_with_profile
+from EduVerse.models import *
+
+HASHERS = {
+    'pbkdf2_sha256': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'EduVerse.hashers.TunedArgon2PasswordHasher',
+}
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Measure the login latency under a burst of concurrent logins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', type=int, default=50, help='Concurrent logins')
+
+    def handle(self, *args, **options):
+        for algorithm, hasher in HASHERS.items():
+            # The measured hasher is the preferred one, so no rehash happens during the run
+            with override_settings(PASSWORD_HASHERS=[hasher]):
+                emails = self.create_users(algorithm, options['burst'])
+                try:
+                    for mode, check in [('sync', self.sync_check), ('async', aauthenticate_with_profile)]:
+                        p50, p99 = asyncio.run(self.burst(check, emails))
+                        self.stdout.write(f'{algorithm:14} {mode:5}  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms')
+                finally:
+                    User.objects.filter(email__in=emails).delete()
+
+    # Create the temporary users, all with the same password hashed by the current hasher
+    def create_users(self, algorithm, count):
+        password = make_password(PASSWORD)
+        emails = [f'login-benchmark-{algorithm}-{i}@example.com' for i in range(count)]
+        for email in emails:
+            User.objects.create(email=email, password=password, user_type='student')
+        return emails
+
+    # The check done by the previous login view
+    @staticmethod
+    async def sync_check(email, password):
+        return await sync_to_async(authenticate)(None, username=email, password=password)
+
+    # Run all the logins at once and return the p50 and p99 latency in milliseconds
+    async def burst(self, check, emails):
+        async def timed(email):
+            start = time.perf_counter()
+            assert await check(email, PASSWORD) is not None
+            return (time.perf_counter() - start) * 1000
+
+        timings = sorted(await asyncio.gather(*(timed(email) for email in emails)))
+        return timings[len(timings) // 2], timings[max(int(len(timings) * 0.99) - 1, 0)]
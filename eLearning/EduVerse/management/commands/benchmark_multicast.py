@@ -0,0 +1,115 @@
+'''
+Benchmark of the material update notification of a course, with the Redis channel layer.
+Each student of the course has a channel in its student group, and every --sends updates are sent:
+- per group: one group_send to the course group and one per student group, in the request,
+  as course_detail did
+- multicast: one group_send_many to all the groups (see multicast.py)
+The Redis commands and round trips per update are counted, and every channel must receive every update once.
+Then the time a request spends notifying the course is measured for courses of growing size:
+one group_send per group in the request, against publish() with the dispatch thread (see notifications.py).
+The notifications written by the benchmark are deleted at the end.
+
+Usage: python manage.py benchmark_multicast --students 500 --sends 20 --redis redis://127.0.0.1:6379
+
+Reference: https://channels.readthedocs.io/en/stable/topics/channel_layers.html,
+https://redis.readthedocs.io/en/stable/examples/asyncio_examples.html
+'''
+
+import asyncio
+import time
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from EduVerse.models import *
+from EduVerse.multicast import group_send_many
+from EduVerse.notifications import publish
+from .benchmark_chat_fanout import RedisCounter
+
+
+class Command(BaseCommand):
+    help = 'Measure the Redis traffic and the request time of the material update notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=500, help='Students of the course')
+        parser.add_argument('--sends', type=int, default=20, help='Updates sent per run')
+        parser.add_argument('--sizes', default='10,100,500,1000', help='Course sizes of the request time runs')
+        parser.add_argument('--redis', help='Redis URL of the channel layer (default: the CHANNEL_LAYERS setting)')
+
+    def handle(self, *args, **options):
+        layers = settings.CHANNEL_LAYERS
+        if options['redis']:
+            layers = {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [options['redis']], 'capacity': 100000}}}
+        first = Notification.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        with override_settings(CHANNEL_LAYERS=layers, NOTIFICATION_DISPATCH_THREAD=True):
+            for label, multicast in [('per group', False), ('multicast', True)]:
+                result = async_to_sync(self.run)(multicast, options['students'], options['sends'])
+                self.stdout.write(f'{label}: ' + ', '.join(f'{value:.2f} {name}' for name, value in result.items()))
+            for size in [int(size) for size in options['sizes'].split(',')]:
+                inline, dispatched = self.request_times(size, options['sends'])
+                self.stdout.write(f'request time, {size} students: {inline:.2f} ms per group, {dispatched:.2f} ms dispatched')
+        Notification.objects.filter(pk__gt=first).delete()
+
+    async def join(self, students):
+        layer = get_channel_layer()
+        channels = []
+        for student in range(students):
+            channel = await layer.new_channel()
+            await layer.group_add(f'student_{student}', channel)
+            channels.append(channel)
+        return layer, channels
+
+    async def run(self, multicast, students, sends):
+        layer, channels = await self.join(students)
+        groups = ['course_0'] + [f'student_{student}' for student in range(students)]
+        event = {'type': 'update_material', 'course_name': 'Benchmark', 'course_id': 0}
+
+        with RedisCounter() as counter:
+            start = time.perf_counter()
+            for _ in range(sends):
+                if multicast:
+                    await group_send_many(layer, groups, event)
+                else:
+                    for group in groups:
+                        await layer.group_send(group, event)
+            elapsed = time.perf_counter() - start
+
+        # Every channel got every update once
+        received = [len(await asyncio.gather(*[layer.receive(channel) for channel in channels])) for _ in range(sends)]
+        assert sum(received) == students * sends
+        for channel in channels:
+            assert not layer.receive_buffer.get(channel), 'update received twice'
+        await layer.flush()
+        return {
+            'redis commands/update': counter.commands / sends,
+            'redis round trips/update': counter.round_trips / sends,
+            'ms/update': elapsed * 1000 / sends,
+        }
+
+    # Mean time of the notification in the request, sending to each group or through the dispatch thread
+    def request_times(self, students, sends):
+        layer, channels = async_to_sync(self.join)(students)
+        event = {'type': 'update_material', 'course_name': 'Benchmark', 'course_id': 0}
+        fanout = [f'student_{student}' for student in range(students)]
+
+        async def send_per_group():
+            for group in ['course_0'] + fanout:
+                await layer.group_send(group, event)
+
+        start = time.perf_counter()
+        for _ in range(sends):
+            async_to_sync(send_per_group)()
+        inline = (time.perf_counter() - start) * 1000 / sends
+
+        start = time.perf_counter()
+        for _ in range(sends):
+            publish('course_0', event, fanout=fanout)
+        dispatched = (time.perf_counter() - start) * 1000 / sends
+
+        # Wait for the dispatch thread before the next size
+        async def receive_all():
+            for _ in range(2 * sends):
+                await asyncio.gather(*[layer.receive(channel) for channel in channels])
+        async_to_sync(receive_all)()
+        return inline, dispatched
@@ -0,0 +1,73 @@
+'''
+Benchmark of the pending-room queues with many chats set up at the same time.
+Every chat pushes its room to the queue of its teacher concurrently, then every teacher pops its
+queue concurrently until it is empty. The latency of the pushes and pops is reported, and each teacher
+must get back exactly the rooms pushed for it. The benchmark queues end up empty, so nothing is left behind.
+
+Usage: python manage.py benchmark_pending_rooms --teachers 100 --chats 500 --redis redis://127.0.0.1:6379/0
+
+Reference: https://redis.readthedocs.io/en/stable/examples/asyncio_examples.html
+'''
+
+import asyncio
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from EduVerse.pending_rooms import get_pending_rooms
+
+# Teacher ids of the benchmark, far from the ids of the real teachers
+FIRST_TEACHER = 10 ** 9
+
+
+class Command(BaseCommand):
+    help = 'Measure the pending-room queues with many concurrent chats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--teachers', type=int, default=100, help='Teachers with chats waiting')
+        parser.add_argument('--chats', type=int, default=500, help='Chats set up at the same time')
+        parser.add_argument('--redis', help='Redis URL of the queues (default: the PENDING_ROOMS_REDIS_URL setting)')
+
+    def handle(self, *args, **options):
+        overrides = {'PENDING_ROOMS_REDIS_URL': options['redis']} if options['redis'] else {}
+        with override_settings(**overrides):
+            result = asyncio.run(self.run(get_pending_rooms(), options['teachers'], options['chats']))
+        for label, value in result.items():
+            self.stdout.write(f'{label}: {value}')
+
+    async def run(self, queues, teachers, chats):
+        rooms = {FIRST_TEACHER + teacher: set() for teacher in range(teachers)}
+        for room in range(chats):
+            rooms[FIRST_TEACHER + room % teachers].add(room)
+
+        async def timed(call, *args):
+            start = time.perf_counter()
+            result = await call(*args)
+            return time.perf_counter() - start, result
+
+        start = time.perf_counter()
+        pushes = await asyncio.gather(*[
+            timed(queues.push, teacher, room) for teacher, teacher_rooms in rooms.items() for room in teacher_rooms
+        ])
+
+        async def pop_all(teacher):
+            latencies, popped = [], set()
+            while True:
+                latency, room = await timed(queues.pop, teacher)
+                latencies.append(latency)
+                if room is None:
+                    return latencies, popped
+                popped.add(room)
+
+        pops = await asyncio.gather(*[pop_all(teacher) for teacher in rooms])
+        elapsed = time.perf_counter() - start
+        await queues.close()
+        push_latencies = sorted(latency for latency, _ in pushes)
+        pop_latencies = sorted(latency for latencies, _ in pops for latency in latencies)
+        misrouted = sum(len(popped ^ rooms[teacher]) for teacher, (_, popped) in zip(rooms, pops))
+        return {
+            'chats': f'{chats} for {teachers} teachers in {elapsed:.2f}s',
+            'push p50/p99 ms': f'{statistics.median(push_latencies) * 1000:.1f} / {push_latencies[int(len(push_latencies) * 0.99)] * 1000:.1f}',
+            'pop p50/p99 ms': f'{statistics.median(pop_latencies) * 1000:.1f} / {pop_latencies[int(len(pop_latencies) * 0.99)] * 1000:.1f}',
+            'rooms missing or misrouted': misrouted,
+        }
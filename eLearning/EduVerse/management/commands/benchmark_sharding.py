@@ -0,0 +1,113 @@
+'''
+Benchmark of the sharded channel layer (see layers.py) on 1 to N Redis hosts.
+For each number of hosts, --groups groups each have one channel in one of --workers other layer instances (the other
+workers, each with its own process channel), so every message goes through Redis; --senders tasks send --messages
+group messages each to random groups and the receivers take all of them. The messages per second and the share of
+the Redis commands taken by each host are measured.
+It also prints the share of 10000 group names that change host when a host is added, with the ring and with the
+hash slices of channels_redis.
+Each run uses its own key prefix, deleted at the end.
+
+Usage: python manage.py benchmark_sharding --hosts redis://127.0.0.1:6380,redis://127.0.0.1:6381 --groups 200
+
+Reference: https://channels.readthedocs.io/en/stable/topics/channel_layers.html,
+https://en.wikipedia.org/wiki/Consistent_hashing
+'''
+
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+from channels_redis.utils import _consistent_hash
+from django.core.management.base import BaseCommand
+from redis.asyncio.client import Pipeline, Redis
+from EduVerse.layers import HashRing, ShardedChannelLayer
+
+
+# Count the Redis commands sent to each host
+class HostCounter:
+
+    def __enter__(self):
+        self.commands = Counter()
+        self.execute_command, self.execute = Redis.execute_command, Pipeline.execute
+        counter = self
+
+        def host(client):
+            kwargs = client.connection_pool.connection_kwargs
+            return f"{kwargs.get('host')}:{kwargs.get('port')}/{kwargs.get('db', 0)}"
+
+        async def execute_command(redis, *args, **options):
+            counter.commands[host(redis)] += 1
+            return await counter.execute_command(redis, *args, **options)
+
+        async def execute(pipeline, *args, **options):
+            counter.commands[host(pipeline)] += len(pipeline.command_stack)
+            return await counter.execute(pipeline, *args, **options)
+
+        Redis.execute_command, Pipeline.execute = execute_command, execute
+        return self
+
+    def __exit__(self, *exc):
+        Redis.execute_command, Pipeline.execute = self.execute_command, self.execute
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput of the sharded channel layer from 1 to N Redis hosts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hosts', required=True, help='Comma-separated Redis URLs, used 1 to N at a time')
+        parser.add_argument('--groups', type=int, default=200, help='Groups, each with one remote channel')
+        parser.add_argument('--workers', type=int, default=8, help='Receiving workers')
+        parser.add_argument('--senders', type=int, default=20, help='Concurrent senders')
+        parser.add_argument('--messages', type=int, default=100, help='Messages per sender')
+
+    def handle(self, *args, **options):
+        hosts = options['hosts'].split(',')
+        for count in range(1, len(hosts) + 1):
+            result, shares = asyncio.run(self.run(hosts[:count], options['groups'], options['workers'], options['senders'], options['messages']))
+            self.stdout.write(f'{count} hosts: {result:.0f} messages/sec, commands per host: '
+                              + ', '.join(f'{share:.0%}' for share in shares))
+        self.stdout.write(self.moved_keys(len(hosts)))
+
+    async def run(self, hosts, groups, workers, senders, messages):
+        prefix = f'benchmark-{uuid.uuid4().hex[:8]}'
+        layer = ShardedChannelLayer(hosts=hosts, prefix=prefix, capacity=100000)
+        others = [ShardedChannelLayer(hosts=hosts, prefix=prefix, capacity=100000) for _ in range(workers)]
+        channels = {}
+        for group in range(groups):
+            other = others[group % workers]
+            channels[group] = (other, await other.new_channel())
+            await other.group_add(f'room_{group}', channels[group][1])
+
+        plan = [[random.randrange(groups) for _ in range(messages)] for _ in range(senders)]
+        expected = Counter(group for sends in plan for group in sends)
+
+        async def send_all(sends):
+            for group in sends:
+                await layer.group_send(f'room_{group}', {'type': 'chat_message', 'message': 'benchmark'})
+
+        async def receive_all(group):
+            other, channel = channels[group]
+            for _ in range(expected[group]):
+                await other.receive(channel)
+
+        with HostCounter() as counter:
+            start = time.perf_counter()
+            receivers = [asyncio.create_task(receive_all(group)) for group in expected]
+            await asyncio.gather(*[send_all(sends) for sends in plan])
+            await asyncio.wait_for(asyncio.gather(*receivers), timeout=300)
+            elapsed = time.perf_counter() - start
+        for flushed in [layer, *others]:
+            await flushed.flush()
+        total = sum(counter.commands.values())
+        return senders * messages / elapsed, [commands / total for commands in counter.commands.values()]
+
+    # Share of the group names placed on another host when a host is added to N - 1
+    def moved_keys(self, count):
+        names = [f'room_{i}' for i in range(10000)]
+        hosts = [f'redis://10.0.0.{i}:6379' for i in range(count)]
+        before, after = HashRing(hosts[:-1], ShardedChannelLayer.RING_REPLICAS), HashRing(hosts, ShardedChannelLayer.RING_REPLICAS)
+        ring = sum(before.index(name) != after.index(name) for name in names) / len(names)
+        slices = sum(_consistent_hash(name, count - 1) != _consistent_hash(name, count) for name in names) / len(names)
+        return f'keys moved from {count - 1} to {count} hosts: {ring:.0%} with the ring, {slices:.0%} with the hash slices'
@@ -0,0 +1,91 @@
+'''
+Benchmark of the teacher user search: the previous icontains (LIKE) lookups against the FTS5 index.
+A scratch SQLite database is filled with synthetic users for every requested size,
+so the project database is never touched, and the median and p95 latency of both queries are printed.
+
+Usage: python manage.py benchmark_user_search --users 100000 1000000
+
+Reference: https://www.sqlite.org/fts5.html
+'''
+
+import importlib
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from EduVerse.search import SEARCH_RESULT_LIMIT, build_match_query
+
+# The FTS5 table and triggers are created exactly as in the migration
+user_fts = importlib.import_module('EduVerse.migrations.0004_user_fts')
+
+FIRST_NAMES = ['john', 'mary', 'leonardo', 'donatello', 'april', 'casey', 'splinter', 'irma', 'karai', 'baxter',
+               'oliver', 'amelia', 'noah', 'isla', 'jack', 'ava', 'harry', 'mia', 'george', 'grace']
+LAST_NAMES = ['smith', 'jones', 'oneil', 'jones', 'stockman', 'hamato', 'langinstein', 'brown', 'taylor', 'wilson',
+              'davies', 'evans', 'thomas', 'johnson', 'roberts', 'walker', 'wright', 'robinson', 'thompson', 'white']
+QUERIES = ['jo', 'smith', 'mary jo', 'leo hamato', 'user123', 'april oneil', 'gr wh', 'zzz']
+
+# Same lookups as the previous teacher_home query, which had no limit
+LIKE_SQL = '''
+    SELECT id FROM EduVerse_user
+    WHERE first_name LIKE :q OR last_name LIKE :q OR email LIKE :q
+       OR (first_name LIKE :first AND last_name LIKE :last)
+'''
+FTS_SQL = '''
+    SELECT rowid FROM EduVerse_user_fts WHERE EduVerse_user_fts MATCH ?
+    ORDER BY bm25(EduVerse_user_fts, 10.0, 10.0, 1.0) LIMIT ?
+'''
+
+
+class Command(BaseCommand):
+    help = 'Compare the latency of the LIKE and FTS5 user searches on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[100000, 1000000], help='Table sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query')
+
+    def handle(self, *args, **options):
+        for size in options['users']:
+            with tempfile.TemporaryDirectory() as directory:
+                db = sqlite3.connect(os.path.join(directory, 'bench.sqlite3'))
+                self.populate(db, size)
+                like = self.measure(db, options['repeat'], self.like_search)
+                fts = self.measure(db, options['repeat'], self.fts_search)
+                db.close()
+            self.stdout.write(f'{size} users')
+            self.stdout.write(f'  LIKE  median {like[0]:8.2f} ms  p95 {like[1]:8.2f} ms')
+            self.stdout.write(f'  FTS5  median {fts[0]:8.2f} ms  p95 {fts[1]:8.2f} ms')
+
+    # Create the user table with the FTS5 index and insert the synthetic users
+    def populate(self, db, size):
+        db.execute('CREATE TABLE EduVerse_user (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, email TEXT)')
+        for statement in user_fts.CREATE_SQL:
+            db.execute(statement)
+        rng = random.Random(size)
+        rows = (
+            (i, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f'user{i}@example.com')
+            for i in range(1, size + 1)
+        )
+        with db:
+            db.executemany('INSERT INTO EduVerse_user VALUES (?, ?, ?, ?)', rows)
+
+    def like_search(self, db, query):
+        words = query.split(' ')
+        params = {'q': f'%{query}%', 'first': f'%{words[0]}%', 'last': f'%{words[-1]}%'}
+        return db.execute(LIKE_SQL, params).fetchall()
+
+    def fts_search(self, db, query):
+        return db.execute(FTS_SQL, (build_match_query(query), SEARCH_RESULT_LIMIT)).fetchall()
+
+    # Return the median and p95 latency in milliseconds over all the queries
+    def measure(self, db, repeat, search):
+        timings = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                start = time.perf_counter()
+                search(db, query)
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
@@ -0,0 +1,83 @@
+'''
+Benchmark of the CPU spent per broadcast to encode the frames of a group event for every socket of the group.
+For each socket the event goes through what the consumer does with it: the channels_redis deserialization
+of the message and the handler (update_material or chat_message) up to the outbound queue. It runs:
+- json per socket: the event without encoded frame, encoded by every consumer (the previous path)
+- json encoded once: the frame encoded once by the sender, each consumer sends it as it is
+- msgpack from json: the clients of the 'msgpack' subprotocol, each consumer encodes the frame from the JSON one
+  (the consumers of a process share the encoding when the event is delivered in memory)
+It also prints the size of the message serialized for the channel layer.
+No connection is opened, the consumers are driven in-process.
+
+Usage: python manage.py benchmark_wire_format --sockets 1000 --events 100
+
+Reference: https://docs.python.org/3/library/time.html#time.process_time
+'''
+
+import asyncio
+import time
+from channels_redis.core import RedisChannelLayer
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from EduVerse.consumers import ChatConsumer, NotificationConsumer
+from EduVerse.wire import JSON, MSGPACK, with_encoded_frame
+
+EVENTS = {
+    'update_material': {
+        'type': 'update_material', 'course_name': 'Introduction to Distributed Systems', 'course_id': 42,
+        'seq': 123456, 'group': 'course_42',
+    },
+    'chat_message': {
+        'type': 'chat_message', 'message': 'Could you go over the second part of the assignment again? ' * 3,
+        'author': 'April Oneil', 'course_name': 'Introduction to Distributed Systems',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure the CPU per broadcast of the JSON and MessagePack frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=1000, help='Sockets in the group')
+        parser.add_argument('--events', type=int, default=100, help='Events broadcast')
+
+    def handle(self, *args, **options):
+        # Serializer of the channel layer, no connection is opened
+        layer = RedisChannelLayer()
+        runs = [
+            ('json per socket', JSON, False),
+            ('json encoded once', JSON, True),
+            ('msgpack from json', MSGPACK, True),
+        ]
+        with override_settings(CHAT_BATCH_WINDOW=0):
+            for event_type, event in EVENTS.items():
+                self.stdout.write(
+                    f'{event_type}: {len(layer.serialize(event))} bytes in the channel layer, '
+                    f'{len(layer.serialize(with_encoded_frame(event)))} bytes with the encoded frame'
+                )
+                for label, wire_format, encoded_once in runs:
+                    cpu = asyncio.run(self.run(layer, event_type, event, wire_format, encoded_once, options['sockets'], options['events']))
+                    per_broadcast = cpu / options['events']
+                    self.stdout.write(
+                        f'{event_type}, {label}: {per_broadcast * 1000:.2f} ms CPU per broadcast, '
+                        f'{per_broadcast / options["sockets"] * 1e6:.2f} us per socket'
+                    )
+
+    async def run(self, layer, event_type, event, wire_format, encoded_once, sockets, events):
+        consumer_class = ChatConsumer if event_type == 'chat_message' else NotificationConsumer
+        consumers = []
+        for _ in range(sockets):
+            consumer = consumer_class()
+            consumer.wire_format = wire_format
+            consumer.batch_window = 0
+            consumer.open_outbox()
+            consumers.append(consumer)
+
+        start = time.process_time()
+        for _ in range(events):
+            # Encoded by the sender, serialized once by the channel layer
+            message = layer.serialize(with_encoded_frame(event) if encoded_once else event)
+            for consumer in consumers:
+                await getattr(consumer, event_type)(layer.deserialize(message))
+                consumer.outbox.clear()
+        return time.process_time() - start
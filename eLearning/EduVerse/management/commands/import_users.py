@@ -0,0 +1,114 @@
+'''
+Import users from a CSV or NDJSON file (one JSON object per line).
+Every row has the columns email, password, first_name, last_name, user_type (student or teacher)
+and optionally date_of_birth, street_address, post_code, city and country.
+
+The file is streamed in chunks. The passwords of a chunk are hashed in a process pool
+while the previous chunk is written, and every chunk is written in one transaction with bulk_create
+for the users, their addresses and their Student/Teacher profiles
+(User.save, and its get_or_create of the profile, is not called).
+Emails already in the database or repeated in the file are skipped.
+
+Usage: python manage.py import_users users.csv [--format ndjson] [--batch-size 1000] [--workers 4]
+
+Reference: https://docs.djangoproject.com/en/5.1/ref/models/querysets/#bulk-create,
+https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+'''
+
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from EduVerse.models import *
+
+PROFILE_MODELS = {'student': Student, 'teacher': Teacher}
+
+
+# Make sure Django is set up in the worker processes (needed when they are spawned instead of forked)
+def init_worker():
+    import django
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Import users with their addresses and profiles from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file to import')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='File format, by default from the extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows hashed and written per chunk')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes hashing the passwords')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        self.seen = set()
+        self.imported = self.skipped = 0
+        start = time.perf_counter()
+
+        with open(path, newline='') as file, ProcessPoolExecutor(options['workers'], initializer=init_worker) as executor:
+            rows = csv.DictReader(file) if file_format == 'csv' else (json.loads(line) for line in file if line.strip())
+            pending = None
+            while chunk := list(islice(rows, options['batch_size'])):
+                # Start hashing this chunk, then write the previous one while the workers run
+                hashes = executor.map(make_password, [row['password'] for row in chunk], chunksize=50)
+                if pending:
+                    self.write_chunk(*pending)
+                pending = (chunk, hashes)
+            if pending:
+                self.write_chunk(*pending)
+
+        elapsed = time.perf_counter() - start
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} users, skipped {self.skipped}, in {elapsed:.1f}s ({rate:.0f} rows/sec)'
+        ))
+
+    # Write the users of a chunk with their addresses and profiles in one transaction
+    def write_chunk(self, chunk, hashes):
+        hashes = list(hashes)
+        emails = [User.objects.normalize_email(row['email']) for row in chunk]
+        existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+
+        users, rows = [], []
+        for row, email, password in zip(chunk, emails, hashes):
+            if row.get('user_type') not in PROFILE_MODELS:
+                raise CommandError(f"Invalid user_type for {email}: {row.get('user_type')!r}")
+            if email in existing or email in self.seen:
+                self.skipped += 1
+                continue
+            self.seen.add(email)
+            users.append(User(
+                email=email,
+                username=email,
+                password=password,
+                first_name=row.get('first_name', ''),
+                last_name=row.get('last_name', ''),
+                user_type=row['user_type'],
+                date_of_birth=row.get('date_of_birth') or None,
+            ))
+            rows.append(row)
+
+        with transaction.atomic():
+            # The primary keys are returned by the INSERT and used for the related rows
+            User.objects.bulk_create(users)
+            Address.objects.bulk_create([
+                Address(
+                    user=user,
+                    street_address=row.get('street_address', ''),
+                    post_code=row.get('post_code', ''),
+                    city=row.get('city', ''),
+                    country=row.get('country', ''),
+                )
+                for user, row in zip(users, rows)
+            ])
+            for user_type, model in PROFILE_MODELS.items():
+                model.objects.bulk_create([model(user=user) for user in users if user.user_type == user_type])
+
+        self.imported += len(users)
+        self.stdout.write(f'{self.imported} users imported')
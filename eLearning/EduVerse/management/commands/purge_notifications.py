@@ -0,0 +1,30 @@
+'''
+Delete the notifications older than NOTIFICATION_RETENTION_DAYS from the notification log, in small chunks,
+each in its own short transaction (see management/purge.py). Only the oldest notifications are deleted, which is
+what the replay of missed notifications relies on (see notifications.py), and the newest one is always kept: the
+replay tells a client it missed notifications from the first seq of the log, so the log is never left empty.
+With --every the command keeps running in the background and purges periodically.
+
+Usage: python manage.py purge_notifications [--chunk-size 500] [--pause 0.05] [--every 3600]
+
+Reference: https://docs.djangoproject.com/en/5.1/ref/models/querysets/#delete
+'''
+
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from EduVerse.management.purge import ChunkedPurgeCommand
+from EduVerse.models import Notification
+
+
+class Command(ChunkedPurgeCommand):
+    help = 'Delete the notifications older than the retention window, once or periodically'
+    rows_name = 'notifications'
+
+    # The notifications before the first one still in the retention window (or the newest one)
+    def expired(self):
+        cutoff = timezone.now() - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+        first_kept = Notification.objects.filter(created_at__gte=cutoff).order_by('pk').values_list('pk', flat=True).first()
+        if first_kept is None:
+            first_kept = Notification.objects.order_by('-pk').values_list('pk', flat=True).first()
+        return Notification.objects.filter(pk__lt=first_kept or 0)
@@ -0,0 +1,22 @@
+'''
+Delete the expired sessions in small chunks, each in its own short transaction,
+instead of the single DELETE of clearsessions that holds the write lock until every expired row is gone.
+With --every the command keeps running in the background and purges periodically (see management/purge.py).
+
+Usage: python manage.py purge_sessions [--chunk-size 500] [--pause 0.05] [--every 3600]
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/http/sessions/#clearing-the-session-store
+'''
+
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+from EduVerse.management.purge import ChunkedPurgeCommand
+
+
+class Command(ChunkedPurgeCommand):
+    help = 'Delete the expired sessions in chunks, once or periodically'
+    rows_name = 'expired sessions'
+
+    # The sessions expired before now
+    def expired(self):
+        return Session.objects.filter(expire_date__lt=timezone.now())
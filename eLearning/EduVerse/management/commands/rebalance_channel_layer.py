@@ -0,0 +1,81 @@
+'''
+Move the keys of the sharded channel layer (see layers.py) to their host on the ring of the CHANNEL_LAYERS hosts.
+Run it after a Redis host was added to the hosts, once the workers use the new list: only the keys taken by the
+new host are moved. The hosts removed from the list are given with --drain, all their keys are moved.
+The groups, the presence sets and the queues of the process channels are moved; each key is read and deleted in
+one transaction on its previous host and merged into the key of its new host, so running the command again
+(while the last workers with the previous list stop) only moves what they added since.
+
+Usage: python manage.py rebalance_channel_layer [--drain redis://10.0.0.4:6379] [--count 500]
+
+Reference: https://redis.io/docs/latest/commands/scan/,
+https://redis.io/docs/latest/develop/interact/transactions/
+'''
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from redis.asyncio import Redis
+
+
+class Command(BaseCommand):
+    help = 'Move the keys of the sharded channel layer to their host on the consistent-hash ring'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drain', action='append', default=[], help='URL of a removed Redis host to empty')
+        parser.add_argument('--count', type=int, default=500, help='Keys read per SCAN')
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer()
+        if not hasattr(layer, 'ring'):
+            raise CommandError('The channel layer is not sharded with a consistent-hash ring')
+        moved = async_to_sync(self.rebalance)(layer, options['drain'], options['count'])
+        for host, count in moved.items():
+            self.stdout.write(f'{host}: moved {count} keys')
+
+    # Value hashed to place a key of the layer, None for the keys that are not moved
+    def hashed_value(self, layer, key):
+        if key.startswith(f'{layer.prefix}:group:'):
+            return key[len(f'{layer.prefix}:group:'):]
+        if key.startswith(f'{layer.prefix}:presence:'):
+            # The presence set of a room lives with the group of the room
+            return f"chat_{key[len(f'{layer.prefix}:presence:'):]}"
+        if key.startswith(f'{layer.prefix}specific.') and key.endswith('!'):
+            return key[len(layer.prefix):]
+        return None
+
+    async def rebalance(self, layer, drain, count):
+        sources = [(index, f'host {index}', layer.connection(index)) for index in range(layer.ring_size)]
+        sources += [(None, url, Redis.from_url(url)) for url in drain]
+        moved = {}
+        try:
+            for index, host, connection in sources:
+                moved[host] = 0
+                async for key in connection.scan_iter(match=f'{layer.prefix}*', count=count):
+                    value = self.hashed_value(layer, key.decode('utf8'))
+                    if value is None:
+                        continue
+                    owner = layer.consistent_hash(value)
+                    if owner != index:
+                        await self.move(connection, layer.connection(owner), key)
+                        moved[host] += 1
+        finally:
+            for index, host, connection in sources:
+                if index is None:
+                    await connection.aclose()
+        return moved
+
+    # Move a sorted set: read and delete it in one transaction, then merge it into the new host
+    async def move(self, source, target, key):
+        async with source.pipeline(transaction=True) as pipe:
+            pipe.zrange(key, 0, -1, withscores=True)
+            pipe.pttl(key)
+            pipe.delete(key)
+            members, ttl, deleted = await pipe.execute()
+        if not members:
+            return
+        async with target.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, dict(members))
+            if ttl > 0:
+                pipe.pexpire(key, ttl)
+            await pipe.execute()
@@ -0,0 +1,32 @@
+'''
+Rebuild the student dashboard read model from scratch.
+Every dashboard row is dropped and recreated from the enrollment table
+in a single transaction, reading the enrollments of each batch of students with one query.
+
+Usage: python manage.py rebuild_student_dashboards
+
+Reference: https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from EduVerse.models import *
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized student dashboards from the enrollment table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Students rebuilt per batch')
+
+    def handle(self, *args, **options):
+        # Students without enrollments still get an (empty) dashboard
+        student_ids = list(Student.objects.values_list('pk', flat=True))
+
+        with transaction.atomic():
+            StudentDashboard.objects.all().delete()
+            # Rebuild in chunks to keep the IN lists and the memory bounded
+            for start in range(0, len(student_ids), options['batch_size']):
+                StudentDashboard.rebuild_many(student_ids[start:start + options['batch_size']], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(student_ids)} student dashboards'))
@@ -0,0 +1,35 @@
+'''
+Reconcile the enrolled_count counter of every course with the enrollment table.
+The counters can drift if enrollments are written without the signals
+(raw SQL, queryset.delete() on a database restore and so on).
+The drifted counters are recomputed with a single UPDATE.
+
+Usage: python manage.py reconcile_enrollment_counts
+
+Reference: https://docs.djangoproject.com/en/5.1/ref/models/expressions/#subquery-expressions
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from EduVerse.models import *
+
+
+class Command(BaseCommand):
+    help = 'Recompute the enrolled_count of every course from the enrollment table'
+
+    def handle(self, *args, **options):
+        # Number of enrollments of the outer course
+        actual = Coalesce(Subquery(
+            Enrollment.objects.filter(course=OuterRef('pk'))
+            .order_by().values('course').annotate(total=Count('pk')).values('total')
+        ), Value(0))
+
+        with transaction.atomic():
+            # Only the drifted courses are updated, so the version stamp of the others is kept
+            drifted = Course.objects.alias(actual=actual).exclude(enrolled_count=F('actual'))
+            updated = drifted.update(enrolled_count=actual, updated_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciled enrollment counts, {updated} courses were out of date'))
@@ -0,0 +1,44 @@
+'''
+Base class of the commands deleting old rows in small chunks, each in its own short transaction, instead of
+one DELETE holding the write lock until every row is gone (see purge_sessions and purge_notifications).
+With --every a command keeps running in the background and purges periodically.
+
+Reference: https://docs.djangoproject.com/en/5.1/howto/custom-management-commands/
+'''
+
+import time
+from django.core.management.base import BaseCommand
+
+
+class ChunkedPurgeCommand(BaseCommand):
+    # What the deleted rows are, in the options help and the output
+    rows_name = 'rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help=f'{self.rows_name.capitalize()} deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between chunks')
+        parser.add_argument('--every', type=float, help='Keep running and purge every given number of seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = self.purge(options['chunk_size'], options['pause'])
+            self.stdout.write(f'Deleted {deleted} {self.rows_name}')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    # Queryset of the rows to delete, defined by each command
+    def expired(self):
+        raise NotImplementedError
+
+    # Delete the expired rows one chunk of primary keys at a time, in the order of the keys
+    def purge(self, chunk_size, pause):
+        expired = self.expired()
+        deleted = 0
+        while True:
+            keys = list(expired.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not keys:
+                return deleted
+            deleted += expired.model.objects.filter(pk__in=keys).delete()[0]
+            # Let the other writers take the lock between the chunks
+            time.sleep(pause)
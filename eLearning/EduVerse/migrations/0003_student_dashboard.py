@@ -0,0 +1,25 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0002_course_materials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentDashboard',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dashboard', serialize=False, to='EduVerse.student')),
+                ('data', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'EduVerse_student_dashboard',
+            },
+        ),
+    ]
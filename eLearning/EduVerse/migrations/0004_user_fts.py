@@ -0,0 +1,54 @@
+# Full-text index of the users for the teacher search (see search.py)
+
+from django.db import migrations
+
+CREATE_SQL = [
+    '''CREATE VIRTUAL TABLE EduVerse_user_fts USING fts5(
+        first_name, last_name, email,
+        content='EduVerse_user', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''',
+    '''CREATE TRIGGER EduVerse_user_fts_insert AFTER INSERT ON EduVerse_user BEGIN
+        INSERT INTO EduVerse_user_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END''',
+    '''CREATE TRIGGER EduVerse_user_fts_delete AFTER DELETE ON EduVerse_user BEGIN
+        INSERT INTO EduVerse_user_fts(EduVerse_user_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+    END''',
+    '''CREATE TRIGGER EduVerse_user_fts_update AFTER UPDATE OF first_name, last_name, email ON EduVerse_user BEGIN
+        INSERT INTO EduVerse_user_fts(EduVerse_user_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+        INSERT INTO EduVerse_user_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END''',
+    # Index the users that already exist
+    "INSERT INTO EduVerse_user_fts(EduVerse_user_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS EduVerse_user_fts_update',
+    'DROP TRIGGER IF EXISTS EduVerse_user_fts_delete',
+    'DROP TRIGGER IF EXISTS EduVerse_user_fts_insert',
+    'DROP TABLE IF EXISTS EduVerse_user_fts',
+]
+
+
+# FTS5 is only available on SQLite, the other backends use the icontains fallback
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0003_student_dashboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(CREATE_SQL), run_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:09
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Initialise the counter of the existing courses
+def count_enrollments(apps, schema_editor):
+    Course = apps.get_model('EduVerse', 'Course')
+    for course in Course.objects.annotate(total=Count('enrollment')):
+        Course.objects.filter(pk=course.pk).update(enrolled_count=course.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0004_user_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='enrolled_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_enrollments, migrations.RunPython.noop),
+    ]
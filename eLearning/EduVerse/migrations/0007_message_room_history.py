@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0006_version_stamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='room',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='EduVerse.course'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-id'], name='message_room_history_idx'),
+        ),
+    ]
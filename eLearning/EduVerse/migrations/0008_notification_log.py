@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0007_message_room_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'EduVerse_notification',
+                'indexes': [models.Index(fields=['group', 'id'], name='notification_group_seq_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+# The notifications logged before the outbox were sent by their request
+def mark_sent(apps, schema_editor):
+    Notification = apps.get_model('EduVerse', 'Notification')
+    Notification.objects.update(dispatched=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0008_notification_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='dispatched',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_sent, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='notification',
+            name='fanout',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('dispatched', False)), fields=['id'], name='notification_unsent_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:16
+
+import importlib
+from django.db import migrations, models
+
+# SQLite rebuilds EduVerse_user to add the column, which drops the triggers of the full-text index
+user_fts = importlib.import_module('EduVerse.migrations.0004_user_fts')
+TRIGGERS_SQL = [statement for statement in user_fts.CREATE_SQL if statement.startswith('CREATE TRIGGER')]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('EduVerse', '0009_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='teacher',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(user_fts.run_sqlite(user_fts.DROP_SQL[:3] + TRIGGERS_SQL), migrations.RunPython.noop),
+    ]
@@ -4,8 +4,9 @@ https://learndjango.com/tutorials/django-best-practices-referencing-user-model
 '''
 
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils.dateparse import parse_date
 
 # Custom User Manager to handle user creation and superuser creation
 class UserManager(BaseUserManager):
@@ -40,6 +41,8 @@ class User(AbstractUser):
     date_of_birth = models.DateField(null=True, blank=True)
     # Use email as the unique identifier instead of username
     email = models.EmailField(unique=True)
+    # Version stamp of the row, used for the ETags of the API responses that nest the user
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     # Use email to log in
     USERNAME_FIELD = 'email'
     # Additional required fields
@@ -95,12 +98,49 @@ class Course(models.Model):
     students = models.ManyToManyField('Student', through='Enrollment', related_name='enrolled_courses', limit_choices_to={'user_type': 'student'})
     # uploaded course materials
     materials = models.FileField(upload_to='course_materials/', null=True, blank=True)
+    # Number of enrolled students, kept up to date by the Enrollment signals (see signals.py)
+    enrolled_count = models.PositiveIntegerField(default=0, editable=False)
+    # Version stamp of the row, used for the ETags of the API
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Columns copied into the student dashboards (see StudentDashboard.build_data)
+    DASHBOARD_FIELDS = ('course_name', 'midterm_deadline', 'final_deadline')
+
     # Return the course name as the string representation
     def __str__(self):
         return self.course_name
-    # Count and return the number of enrolled students
+
+    # Keep the dashboard columns as loaded, so a save that does not change them skips the dashboard rebuild
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields().intersection(cls.DASHBOARD_FIELDS):
+            instance._dashboard_values = instance.dashboard_values()
+        return instance
+
+    # Dashboard columns as stored in the dashboards (the views assign the dates as strings)
+    def dashboard_values(self):
+        return tuple(str(getattr(self, field)) for field in self.DASHBOARD_FIELDS)
+
+    def save(self, *args, **kwargs):
+        # The counter is only changed with F() updates, so saving an existing course
+        # never writes back a value that may be stale in this instance
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'enrolled_count'
+            ]
+        super().save(*args, **kwargs)
+
+    # Lock the rows of the courses until the end of the transaction, before their enrollments are written.
+    # A no-op UPDATE rather than select_for_update, which SQLite ignores: it takes the write lock of SQLite
+    # and the row locks of the other databases
+    @classmethod
+    def lock(cls, pks):
+        cls.objects.filter(pk__in=pks).update(enrolled_count=models.F('enrolled_count'))
+
+    # Return the number of enrolled students
     def enrolled_student_count(self):
-        return Enrollment.objects.filter(course=self).count()
+        return self.enrolled_count
     # Specify the database table name
     class Meta:
         db_table = 'EduVerse_course'
@@ -111,6 +151,8 @@ class Student(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='student_profile')
     # Profile picture with a default placeholder
     profile_picture = models.ImageField(upload_to='picture_profile/', null=True, blank=True, default='images/placeholder.png')
+    # Version stamp of the row, used for the ETags of the API responses that nest the profile
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     # Return the full name and 'Student' as the string representation
     def __str__(self):
         return f"{self.user.get_full_name()} (Student)"
@@ -118,12 +160,97 @@ class Student(models.Model):
     class Meta:
         db_table = 'EduVerse_student'
 
+# Denormalized read model for the student home page, one row per student.
+# It is kept up to date by the Enrollment and Course signals (see signals.py)
+# so the page renders from a single keyed lookup.
+class StudentDashboard(models.Model):
+    # Link to the Student model, also used as primary key
+    student = models.OneToOneField('Student', on_delete=models.CASCADE, primary_key=True, related_name='dashboard')
+    # Enrolled courses and status updates, stored ready to render
+    data = models.JSONField(default=dict)
+    # Timestamp of the last rebuild
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Build the dashboard document from the enrollments of a student
+    # (each enrollment must have its course selected)
+    @staticmethod
+    def build_data(enrollments):
+        enrollments = sorted(enrollments, key=lambda e: e.enrollment_date, reverse=True)
+        courses = sorted((e.course for e in enrollments), key=lambda c: c.pk)
+        return {
+            'enrolled_courses': [
+                {
+                    'pk': course.pk,
+                    'course_name': course.course_name,
+                    'midterm_deadline': str(course.midterm_deadline),
+                    'final_deadline': str(course.final_deadline),
+                }
+                for course in courses
+            ],
+            'enrollments': [
+                {
+                    'course': {'pk': e.course.pk, 'course_name': e.course.course_name},
+                    'status_update': e.status_update,
+                }
+                for e in enrollments
+            ],
+        }
+
+    # Rebuild the dashboard of a student from the enrollment table.
+    # With create=False an existing row is updated but a missing one is not created,
+    # which is what the delete signals need while a student is being deleted
+    @classmethod
+    def rebuild(cls, student_id, create=True):
+        enrollments = Enrollment.objects.filter(student_id=student_id).select_related('course')
+        data = cls.build_data(enrollments)
+        if create:
+            return cls.objects.update_or_create(student_id=student_id, defaults={'data': data})[0]
+        cls.objects.filter(student_id=student_id).update(data=data)
+
+    # Rebuild the dashboards of many students at once, reading their enrollments with one query.
+    # Used where enrollments are written in bulk without signals. The rows are upserted, so a dashboard
+    # rebuilt meanwhile by rebuild() (outside any transaction of the caller) is updated, not inserted twice
+    @classmethod
+    def rebuild_many(cls, student_ids, batch_size=500):
+        enrollments = {student_id: [] for student_id in student_ids}
+        for enrollment in Enrollment.objects.filter(student_id__in=enrollments).select_related('course').iterator(chunk_size=2000):
+            enrollments[enrollment.student_id].append(enrollment)
+        cls.objects.bulk_create(
+            [cls(student_id=student_id, data=cls.build_data(rows)) for student_id, rows in enrollments.items()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['student'],
+            update_fields=['data', 'updated_at'],
+        )
+
+    # Return the stored courses with their deadlines converted back to dates
+    @property
+    def enrolled_courses(self):
+        courses = []
+        for course in self.data.get('enrolled_courses', []):
+            course = dict(course)
+            course['midterm_deadline'] = parse_date(course['midterm_deadline'])
+            course['final_deadline'] = parse_date(course['final_deadline'])
+            courses.append(course)
+        return courses
+
+    # Return the stored status updates
+    @property
+    def enrollments(self):
+        return self.data.get('enrollments', [])
+
+    # Specify the database table name
+    class Meta:
+        db_table = 'EduVerse_student_dashboard'
+
 # Teacher model representing a teacher profile
 class Teacher(models.Model):
     # Link to the User model
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='teacher_profile')
     # Profile picture with a default placeholder
     profile_picture = models.ImageField(upload_to='picture_profile/', null=True, blank=True, default='images/placeholder.png')
+    # Version stamp of the row, used for the ETags of the API responses that nest the profile
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     # Return the full name and 'Teacher' as the string representation
     def __str__(self):
         return f"{self.user.get_full_name()} (Teacher)"
@@ -138,6 +265,22 @@ class Enrollment(models.Model):
     status_update = models.TextField(blank=True)
     # Timestamp of when the enrollment was created
     enrollment_date = models.DateTimeField(auto_now_add=True)
+    # Version stamp of the row, used for the ETags of the API
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # The row and the enrolled_count of its course (updated by the signals) are written in one transaction,
+    # also outside an atomic block (the API views, the admin and a bare Enrollment.objects.create())
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            if self._state.adding:
+                # The course first, in the same order as the bulk enrollment (see EnrollmentViewSet.bulk)
+                Course.lock([self.course_id])
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
     # Return a string representation of the enrollment
     def __str__(self):
         return f"{self.student.user.get_full_name()} enrolled in {self.course.course_name}"
@@ -152,6 +295,8 @@ class Feedback(models.Model):
     feedback_text = models.TextField()
     # Timestamp of when the feedback was created
     created_at = models.DateTimeField(auto_now_add=True)
+    # Version stamp of the row, used for the ETags of the API
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     # Return a string representation of the feedback
     def __str__(self):
         return f"Feedback for {self.enrollment.course.course_name} by {self.enrollment.student.user.get_full_name()}"
@@ -168,6 +313,37 @@ class Message(models.Model):
     isRead = models.BooleanField(default=False)
     type = models.IntegerField()
     extraData = models.TextField()
+    # Chat room (the course) the message was sent in, indexed by message_room_history_idx
+    room = models.ForeignKey('Course', on_delete=models.CASCADE, related_name='messages', null=True, blank=True, db_index=False)
+    # Timestamp of when the message was sent, the primary key gives the order within a room
+    created_at = models.DateTimeField(auto_now_add=True)
     # Return the message content as the string representation
     def __str__(self):
-        return self.message
\ No newline at end of file
+        return self.message
+    # Index for the history of a room read backwards from a message id
+    class Meta:
+        indexes = [models.Index(fields=['room', '-id'], name='message_room_history_idx')]
+# Append-only log of the notifications sent to the WebSocket groups, replayed to the clients that reconnect.
+# The primary key is the sequence number: it only grows, so it also orders the notifications of each group
+class Notification(models.Model):
+    # Group the notification was sent to, like 'student_3'
+    group = models.CharField(max_length=100)
+    # Event sent to the group, with its handler type
+    payload = models.JSONField()
+    # Other groups the notification is sent to without being logged in them
+    fanout = models.JSONField(default=list, blank=True)
+    # Timestamp of when the notification was written, used for the retention
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Whether the notification was sent to its groups (the log is also the outbox, see notifications.py)
+    dispatched = models.BooleanField(default=False)
+    # Return a string representation of the notification
+    def __str__(self):
+        return f"{self.payload.get('type')} #{self.pk} to {self.group}"
+    # Specify the database table name, index the log of a group read forwards from a sequence number,
+    # and the few notifications not dispatched yet
+    class Meta:
+        db_table = 'EduVerse_notification'
+        indexes = [
+            models.Index(fields=['group', 'id'], name='notification_group_seq_idx'),
+            models.Index(fields=['id'], condition=models.Q(dispatched=False), name='notification_unsent_idx'),
+        ]
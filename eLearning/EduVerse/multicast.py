@@ -0,0 +1,115 @@
+'''
+Multicast of one event to many groups of the channel layer.
+A channel in several of the groups gets the event once (a student page joined to its student group and to
+the groups of its courses gets one update_material, not one per group).
+With channels_redis the members of every group are read with one pipeline per Redis shard, and the event is
+added to every channel with one pipeline per shard (the ZADD Lua script of RedisChannelLayer.group_send),
+so the round trips do not grow with the number of groups: a course of 500 students is a few round trips
+instead of 3 per student group.
+With the in-memory layer the event is put in the queue of each channel, a layer with its own group_send_many
+(see layers.py) uses it, other layers get one group_send per group.
+
+Reference: https://github.com/django/channels_redis/blob/main/channels_redis/core.py,
+https://redis.io/docs/latest/develop/use/pipelining/,
+https://channels.readthedocs.io/en/stable/topics/channel_layers.html#groups
+'''
+
+import collections
+import logging
+import time
+from channels.exceptions import ChannelFull
+
+logger = logging.getLogger('EduVerse.multicast')
+
+# Script of RedisChannelLayer.group_send: add the message to each channel below its capacity
+GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+
+# Send a message to every channel of the groups, once per channel
+async def group_send_many(layer, groups, message):
+    groups = list(dict.fromkeys(groups))
+    if hasattr(layer, 'group_send_many'):
+        # The layer has its own (see layers.py)
+        await layer.group_send_many(groups, message)
+    elif hasattr(layer, '_map_channel_keys_to_connection'):
+        await redis_group_send_many(layer, groups, message)
+    elif hasattr(layer, 'groups'):
+        await memory_group_send_many(layer, groups, message)
+    else:
+        for group in groups:
+            await layer.group_send(group, message)
+
+
+# Channels of the groups of a channels_redis layer, one pipeline per shard
+async def redis_group_channels(layer, groups):
+    groups_by_shard = collections.defaultdict(list)
+    for group in groups:
+        assert layer.valid_group_name(group), 'Group name not valid'
+        groups_by_shard[layer.consistent_hash(group)].append(group)
+
+    channels = {}
+    for index, shard_groups in groups_by_shard.items():
+        async with layer.connection(index).pipeline(transaction=False) as pipe:
+            for group in shard_groups:
+                key = layer._group_key(group)
+                # Discard the channels that left without group_discard
+                pipe.zremrangebyscore(key, min=0, max=int(time.time()) - layer.group_expiry)
+                pipe.zrange(key, 0, -1)
+            results = await pipe.execute()
+        # The members are every second result
+        for members in results[1::2]:
+            channels.update(dict.fromkeys(member.decode('utf8') for member in members))
+    return list(channels)
+
+
+async def redis_group_send_many(layer, groups, message):
+    await redis_send_to_channels(layer, await redis_group_channels(layer, groups), message, groups)
+
+
+# Add a message to channels of a channels_redis layer, one pipeline per shard
+async def redis_send_to_channels(layer, channel_names, message, groups):
+    # One serialized message per channel key, the channels of a process sharing one key
+    (
+        connection_to_channel_keys,
+        channel_keys_to_message,
+        channel_keys_to_capacity,
+    ) = layer._map_channel_keys_to_connection(channel_names, message)
+
+    for index, channel_keys in connection_to_channel_keys.items():
+        args = [channel_keys_to_message[key] for key in channel_keys]
+        args += [channel_keys_to_capacity[key] for key in channel_keys]
+        args += [time.time(), layer.expiry]
+        # Discard the expired messages and add the new one in the same round trip
+        async with layer.connection(index).pipeline(transaction=False) as pipe:
+            for key in channel_keys:
+                pipe.zremrangebyscore(key, min=0, max=int(time.time()) - int(layer.expiry))
+            pipe.eval(GROUP_SEND_LUA, len(channel_keys), *channel_keys, *args)
+            over_capacity = (await pipe.execute())[-1]
+        if over_capacity > 0:
+            logger.info('%s of %s channels over capacity in groups %s', over_capacity, len(channel_names), groups)
+
+
+async def memory_group_send_many(layer, groups, message):
+    layer._clean_expired()
+    channels = {}
+    for group in groups:
+        assert layer.valid_group_name(group), 'Invalid group name'
+        channels.update(dict.fromkeys(layer.groups.get(group, ())))
+    for channel in channels:
+        try:
+            await layer.send(channel, message)
+        except ChannelFull:
+            pass
@@ -0,0 +1,211 @@
+'''
+Notifications sent to the WebSocket groups through the append-only Notification log.
+Every notification is written to the log before it is sent, and is sent with its sequence number (seq),
+and its group, so a client that reconnects with the last seq it received gets back only the notifications it missed
+(see MultiplexConsumer).
+The log is also the outbox of the notifications: a view writes them in its own transaction and does nothing
+else, so a rollback sends nothing and a slow channel layer never holds a response. Once committed they are
+handed to the dispatcher of the process, a task of the dispatch thread that keeps one event loop (and its
+connections to the channel layer) for all of them. It sends what was queued while it was busy as one batch,
+in order within a group and the groups in parallel, encodes each frame once (see wire.py) and marks the batch
+dispatched with one UPDATE. The dispatcher starts with the server, and every NOTIFICATION_SWEEP_INTERVAL
+seconds (the first time at startup) it also sends the notifications left undispatched by a process that
+stopped before sending them; a client skips the seqs it already has, so a notification sent twice is harmless.
+A notification can also be sent to other groups than its own (fanout) in one multicast (see multicast.py):
+it is logged once, in its group, and arrives once on a connection in several of the groups.
+The log is kept NOTIFICATION_RETENTION_DAYS days (see the purge_notifications command):
+a client whose last seq is older than the log is told to reload instead.
+
+Reference: https://microservices.io/patterns/data/transactional-outbox.html,
+https://docs.djangoproject.com/en/5.1/topics/db/transactions/#performing-actions-after-commit,
+https://docs.djangoproject.com/en/5.1/ref/models/querysets/#bulk-create,
+https://channels.readthedocs.io/en/stable/topics/channel_layers.html#using-outside-of-consumers
+'''
+
+import asyncio
+import logging
+import threading
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from .models import *
+from .multicast import group_send_many
+from .wire import with_encoded_frame
+
+logger = logging.getLogger('EduVerse.notifications')
+
+
+# Notification to send: its seq, the groups it goes to (its own group first) and the event
+def outgoing(notification):
+    event = {**notification.payload, 'seq': notification.pk, 'group': notification.group}
+    return notification.pk, [notification.group, *notification.fanout], event
+
+
+# Send a batch of notifications and mark the ones sent as dispatched
+async def send_batch(batch):
+    channel_layer = get_channel_layer()
+    by_group = {}
+    for notification in batch:
+        by_group.setdefault(notification[1][0], []).append(notification)
+
+    # The notifications of a group are sent in the order of their seqs, a client skips a seq older than its last one
+    async def send_in_order(notifications):
+        sent = []
+        for seq, groups, event in notifications:
+            await group_send_many(channel_layer, groups, with_encoded_frame(event))
+            sent.append(seq)
+        return sent
+
+    results = await asyncio.gather(*[send_in_order(notifications) for notifications in by_group.values()], return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error('Notifications not sent, they are retried by the sweep', exc_info=result)
+    sent = [seq for result in results if not isinstance(result, BaseException) for seq in result]
+    if sent:
+        await database_sync_to_async(mark_dispatched)(sent)
+
+
+def mark_dispatched(seqs):
+    Notification.objects.filter(pk__in=seqs).update(dispatched=True)
+
+
+# Notifications still undispatched a sweep interval after they were written, oldest first
+def unsent_notifications():
+    cutoff = timezone.now() - timedelta(seconds=settings.NOTIFICATION_SWEEP_INTERVAL)
+    unsent = Notification.objects.filter(dispatched=False, created_at__lt=cutoff).order_by('pk')
+    return [outgoing(notification) for notification in unsent[:settings.NOTIFICATION_DISPATCH_BATCH]]
+
+
+# Dispatcher of the committed notifications, running on the dispatch thread
+class Dispatcher:
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+        self.sending = None
+        # Seqs queued or being sent in this process, left to the queue by the sweep
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    # Start the dispatch thread with its task and its sweep, at server startup (see asgi.py) or on first use
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.queue = asyncio.Queue()
+                self.sending = asyncio.Lock()
+                self.pending = set()
+                threading.Thread(target=self.serve, args=(self.loop,), name='notifications', daemon=True).start()
+                for coroutine in (self.run(), self.sweep()):
+                    asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return self.loop
+
+    def serve(self, loop):
+        loop.run_forever()
+        loop.close()
+
+    # Cancel the tasks and stop the dispatch thread, from another thread
+    def stop(self, timeout=5):
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), loop).result(timeout)
+            loop.call_soon_threadsafe(loop.stop)
+
+    async def shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Queue committed notifications, from any thread
+    def submit(self, batch):
+        self.start().call_soon_threadsafe(self.enqueue, batch)
+
+    def enqueue(self, batch):
+        self.pending.update(seq for seq, groups, event in batch)
+        self.queue.put_nowait(batch)
+
+    async def run(self):
+        while True:
+            batch = await self.queue.get()
+            # What was queued while the last batch was sent goes in this one
+            while not self.queue.empty():
+                batch += self.queue.get_nowait()
+            await self.send(batch)
+            self.pending.difference_update(seq for seq, groups, event in batch)
+
+    # Every NOTIFICATION_SWEEP_INTERVAL seconds, however busy the queue, send the notifications left
+    # undispatched by a process that stopped before sending them (the first sweep runs at startup)
+    async def sweep(self):
+        while True:
+            try:
+                while True:
+                    unsent = await database_sync_to_async(unsent_notifications)()
+                    await self.send([notification for notification in unsent if notification[0] not in self.pending])
+                    if len(unsent) < settings.NOTIFICATION_DISPATCH_BATCH:
+                        break
+            except Exception:
+                logger.exception('Sweep of the undispatched notifications failed')
+            await asyncio.sleep(settings.NOTIFICATION_SWEEP_INTERVAL)
+
+    # One batch at a time, so the notifications of a group leave in the order of their seqs
+    async def send(self, batch):
+        if not batch:
+            return
+        async with self.sending:
+            try:
+                await send_batch(batch)
+            except Exception:
+                logger.exception('Notification batch not dispatched')
+
+
+dispatcher = Dispatcher()
+
+
+# Hand notifications to the dispatcher once the transaction is committed,
+# or send them in the committing thread with NOTIFICATION_DISPATCH_THREAD False (tests)
+def dispatch(batch):
+    def run():
+        if settings.NOTIFICATION_DISPATCH_THREAD:
+            dispatcher.submit(batch)
+        else:
+            async_to_sync(send_batch)(batch)
+    transaction.on_commit(run)
+
+
+# Log a notification to send to its group, and to the fanout groups without logging it again
+def publish(group, event, fanout=()):
+    notification = Notification.objects.create(group=group, payload=event, fanout=list(fanout))
+    dispatch([outgoing(notification)])
+
+
+# Log notifications to send to their groups with one INSERT
+def publish_many(events):
+    notifications = Notification.objects.bulk_create([Notification(group=group, payload=event) for group, event in events])
+    dispatch([outgoing(notification) for notification in notifications])
+
+
+# Last sequence number of the log, 0 when it is empty. The numbers are shared by the groups,
+# so it is also the position of a client that has every notification of its groups so far
+def current_seq():
+    return Notification.objects.aggregate(seq=Max('pk'))['seq'] or 0
+
+
+# Notifications of a group sent after last_seq, oldest first, and whether they are complete.
+# The purge only deletes the oldest notifications and keeps the newest one, so nothing after last_seq
+# is missing while the log still starts right after it (or before); an empty log with a last_seq
+# is a log emptied since. More than NOTIFICATION_REPLAY_LIMIT missed notifications are not replayed either
+def missed_notifications(group, last_seq):
+    oldest = Notification.objects.aggregate(seq=Min('pk'))['seq']
+    if (oldest is None and last_seq > 0) or (oldest is not None and oldest > last_seq + 1):
+        return [], False
+    limit = settings.NOTIFICATION_REPLAY_LIMIT
+    missed = list(Notification.objects.filter(group=group, pk__gt=last_seq).order_by('pk')[:limit + 1])
+    if len(missed) > limit:
+        return [], False
+    return [{**notification.payload, 'seq': notification.pk, 'group': group} for notification in missed], True
@@ -0,0 +1,31 @@
+'''
+Cursor pagination used by every API endpoint (see REST_FRAMEWORK in settings.py).
+Pages are read with a keyset condition on a stable, unique ordering key (the primary key by default),
+so the cost of a page does not depend on how deep the client has paged or on the size of the table.
+Clients can ask for a smaller or bigger page with ?page_size=, capped by settings.API_MAX_PAGE_SIZE.
+A viewset can change the ordering key with the 'cursor_ordering' attribute.
+
+Reference: https://www.django-rest-framework.org/api-guide/pagination/#cursorpagination
+'''
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class StableCursorPagination(CursorPagination):
+    # Default ordering key, unique and never changing
+    ordering = 'pk'
+    # Allow the client to choose the page size up to the configured maximum
+    page_size_query_param = 'page_size'
+
+    # Read on each request, so the setting can be changed without reloading the class
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+
+    # Use the ordering declared on the viewset if there is one
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
@@ -0,0 +1,101 @@
+'''
+Queues of the chat rooms waiting for a teacher.
+A student opening the chat of a course pushes the room to the queue of the teacher of the course,
+the teacher page pops the oldest room of its own queue, so concurrent chats never overwrite each other.
+Each queue is a Redis sorted set of room ids scored by their expiry time: a room not taken within
+PENDING_ROOMS_TTL seconds is dropped, and a room pushed again only has its expiry moved.
+The async Redis client is created on first use, one per event loop, over a blocking connection pool of
+PENDING_ROOMS_POOL_SIZE connections: when all of them are busy the requests wait for one instead of failing.
+With PENDING_ROOMS_REDIS_URL set to None the queues are kept in the process (tests, development).
+
+Reference: https://redis.readthedocs.io/en/stable/examples/asyncio_examples.html,
+https://redis.readthedocs.io/en/stable/connections.html#connectionpool-async,
+https://redis.io/docs/latest/commands/zpopmin/
+'''
+
+import asyncio
+import time
+import weakref
+from django.conf import settings
+from redis.asyncio import BlockingConnectionPool, Redis
+
+
+# Queues stored in Redis
+class RedisPendingRooms:
+    def __init__(self, url):
+        self.url = url
+        # Connections can only be used on the event loop that opened them
+        self.clients = weakref.WeakKeyDictionary()
+
+    # Client of the running event loop, created on first use
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            pool = BlockingConnectionPool.from_url(self.url, max_connections=settings.PENDING_ROOMS_POOL_SIZE)
+            self.clients[loop] = Redis(connection_pool=pool)
+        return self.clients[loop]
+
+    # Close the connections of the running event loop
+    async def close(self):
+        client = self.clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.connection_pool.disconnect()
+
+    def key(self, teacher_id):
+        return f'pending_rooms:teacher:{teacher_id}'
+
+    # Add a room to the queue of a teacher
+    async def push(self, teacher_id, room_id):
+        expires = time.time() + settings.PENDING_ROOMS_TTL
+        key = self.key(teacher_id)
+        async with self.client().pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {room_id: expires})
+            pipe.expire(key, settings.PENDING_ROOMS_TTL)
+            await pipe.execute()
+
+    # Take the oldest room of the queue of a teacher that has not expired, None if there is none
+    async def pop(self, teacher_id):
+        key = self.key(teacher_id)
+        async with self.client().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, '-inf', time.time())
+            pipe.zpopmin(key)
+            popped = (await pipe.execute())[-1]
+        return int(popped[0][0]) if popped else None
+
+
+# Queues kept in the process
+class MemoryPendingRooms:
+    def __init__(self):
+        # Queues by teacher, each a dictionary of the room ids and their expiry
+        self.queues = {}
+
+    async def push(self, teacher_id, room_id):
+        self.queues.setdefault(teacher_id, {})[room_id] = time.time() + settings.PENDING_ROOMS_TTL
+
+    async def pop(self, teacher_id):
+        queue = self.queues.get(teacher_id, {})
+        now = time.time()
+        for room_id in [room for room, expires in queue.items() if expires <= now]:
+            del queue[room_id]
+        if not queue:
+            return None
+        room_id = min(queue, key=queue.get)
+        del queue[room_id]
+        return room_id
+
+    async def close(self):
+        pass
+
+
+memory_pending_rooms = MemoryPendingRooms()
+redis_pending_rooms = {}
+
+
+# Queues of the PENDING_ROOMS_REDIS_URL setting
+def get_pending_rooms():
+    url = settings.PENDING_ROOMS_REDIS_URL
+    if url is None:
+        return memory_pending_rooms
+    if url not in redis_pending_rooms:
+        redis_pending_rooms[url] = RedisPendingRooms(url)
+    return redis_pending_rooms[url]
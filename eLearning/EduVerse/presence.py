@@ -0,0 +1,132 @@
+'''
+Presence of the clients in the chat rooms.
+Each room has one set of members scored by the time of their last heartbeat: a sorted set in the Redis
+of the channel layer, or a dictionary of the process with the in-memory channel layer (tests, development).
+ChatConsumer joins the room on connect, refreshes its member every PRESENCE_HEARTBEAT seconds and leaves on
+disconnect; the members of a worker that died stop being refreshed and expire after PRESENCE_TTL seconds.
+The online count is the size of the set (ZCARD / len, O(1)); the expired members are removed first, in the
+same round trip, by every read and write of the set, so the count drops without waiting for a new join.
+
+Reference: https://redis.io/docs/latest/commands/zadd/,
+https://redis.io/docs/latest/commands/zcard/,
+https://redis.io/glossary/redis-presence/
+'''
+
+import json
+import time
+from django.conf import settings
+
+
+# Member of a room: the channel of the connection and the name shown to the other clients
+def presence_member(channel_name, name):
+    return json.dumps([channel_name, name])
+
+
+# Presence stored in the Redis of a channels_redis layer
+class RedisPresence:
+    def __init__(self, layer):
+        self.layer = layer
+
+    # The set of a room lives on the same Redis shard as the group of the room
+    def connection(self, room):
+        return self.layer.connection(self.layer.consistent_hash(f'chat_{room}'))
+
+    def key(self, room):
+        return f'{self.layer.prefix}:presence:{room}'
+
+    # Drop the expired members of a room in a pipeline, before the command that reads or writes the set
+    def prune(self, pipe, key, now):
+        pipe.zremrangebyscore(key, '-inf', now - settings.PRESENCE_TTL)
+
+    # Add a member, drop the expired ones and return the online count, in one round trip
+    async def join(self, room, member):
+        now = time.time()
+        key = self.key(room)
+        async with self.connection(room).pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {member: now})
+            self.prune(pipe, key, now)
+            pipe.expire(key, settings.PRESENCE_TTL)
+            pipe.zcard(key)
+            return (await pipe.execute())[-1]
+
+    # Refresh a member that is still connected
+    async def heartbeat(self, room, member):
+        now = time.time()
+        key = self.key(room)
+        async with self.connection(room).pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {member: now})
+            self.prune(pipe, key, now)
+            pipe.expire(key, settings.PRESENCE_TTL)
+            await pipe.execute()
+
+    # Remove a member and return the online count
+    async def leave(self, room, member):
+        key = self.key(room)
+        async with self.connection(room).pipeline(transaction=False) as pipe:
+            pipe.zrem(key, member)
+            self.prune(pipe, key, time.time())
+            pipe.zcard(key)
+            return (await pipe.execute())[-1]
+
+    async def count(self, room):
+        key = self.key(room)
+        async with self.connection(room).pipeline(transaction=False) as pipe:
+            self.prune(pipe, key, time.time())
+            pipe.zcard(key)
+            return (await pipe.execute())[-1]
+
+    # Names of the members, only sent once to a client that joins
+    async def members(self, room):
+        key = self.key(room)
+        async with self.connection(room).pipeline(transaction=False) as pipe:
+            self.prune(pipe, key, time.time())
+            pipe.zrange(key, 0, -1)
+            members = (await pipe.execute())[-1]
+        return [json.loads(member)[1] for member in members]
+
+
+# Presence kept in the process, for the in-memory channel layer
+class MemoryPresence:
+    # Rooms by id (as in the URL), each a dictionary of the members and their last heartbeat
+    def __init__(self):
+        self.rooms = {}
+
+    # Members of a room without the expired ones, a room left empty is dropped
+    def live(self, room, now):
+        members = self.rooms.get(str(room), {})
+        for expired in [m for m, seen in members.items() if seen < now - settings.PRESENCE_TTL]:
+            del members[expired]
+        if not members:
+            self.rooms.pop(str(room), None)
+        return members
+
+    async def join(self, room, member):
+        now = time.monotonic()
+        members = self.rooms.setdefault(str(room), {})
+        members[member] = now
+        return len(self.live(room, now))
+
+    async def heartbeat(self, room, member):
+        now = time.monotonic()
+        self.rooms.setdefault(str(room), {})[member] = now
+        self.live(room, now)
+
+    async def leave(self, room, member):
+        self.rooms.get(str(room), {}).pop(member, None)
+        return len(self.live(room, time.monotonic()))
+
+    async def count(self, room):
+        return len(self.live(room, time.monotonic()))
+
+    async def members(self, room):
+        return [json.loads(member)[1] for member in self.live(room, time.monotonic())]
+
+
+memory_presence = MemoryPresence()
+
+
+# Presence store of a channel layer: its Redis for the channels_redis layers, the process otherwise
+def get_presence(layer):
+    if hasattr(layer, 'consistent_hash'):
+        return RedisPresence(layer)
+    return memory_presence
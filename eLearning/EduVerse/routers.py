@@ -0,0 +1,30 @@
+'''
+Database router keeping the sessions in their own SQLite file (the 'sessions' database in settings.py),
+so the session writes done on most requests do not take the write lock of the application database.
+The session table is created with: python manage.py migrate --database sessions
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/db/multi-db/#automatic-database-routing
+'''
+
+
+class SessionRouter:
+    app_label = 'sessions'
+    database = 'sessions'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return self.database
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return self.database
+        return None
+
+    # The sessions are only migrated in their database, and nothing else is
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label:
+            return db == self.database
+        if db == self.database:
+            return False
+        return None
@@ -6,6 +6,8 @@ required for handling WebSocket connections.
 The following two URL (remove-student and notification-changes) capture both
 the context type and context ID and convert the RemoveStudentConsumer and NotificationConsumer 
 classes into the ASGI applications.
+The multiplex URL serves one connection per page, subscribed to the contexts it needs
+(MultiplexConsumer), and is the one used by notifications.js and remove_student.js.
 
 Reference: https://forum.djangoproject.com/t/websocket-connection-to-django-channels/28824
 '''
@@ -18,4 +20,5 @@ websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/remove-student/(?P<context_type>\w+)/(?P<context_id>\d+)/$', consumers.RemoveStudentConsumer.as_asgi()),
     re_path(r'ws/notifications-change/(?P<context_type>\w+)/(?P<context_id>\d+)/$', consumers.NotificationConsumer.as_asgi()),
+    re_path(r'ws/multiplex/$', consumers.MultiplexConsumer.as_asgi()),
 ]
@@ -0,0 +1,54 @@
+'''
+Full-text search of the users for the search bar of the teacher home.
+
+On SQLite the users are indexed by the EduVerse_user_fts FTS5 table (see migration 0004),
+an external content table over EduVerse_user kept in sync by triggers on insert, update and delete.
+Every word of the query is matched as a prefix of a first name, last name or email token,
+so 'jo sm' finds 'John Smith', and the results are ranked with bm25 giving the names more weight than the email.
+Other database backends fall back to the icontains lookups.
+
+Reference: https://www.sqlite.org/fts5.html,
+https://docs.djangoproject.com/en/5.1/topics/db/sql/#performing-raw-queries
+'''
+
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import *
+
+# Maximum number of users returned by a search
+SEARCH_RESULT_LIMIT = 50
+# Maximum number of words of the query used for the match
+SEARCH_MAX_TOKENS = 5
+
+# Weights of first_name, last_name and email in the bm25 ranking
+SEARCH_SQL = '''
+    SELECT u.* FROM EduVerse_user AS u
+    JOIN EduVerse_user_fts AS f ON f.rowid = u.id
+    WHERE EduVerse_user_fts MATCH %s
+    ORDER BY bm25(EduVerse_user_fts, 10.0, 10.0, 1.0)
+    LIMIT %s
+'''
+
+
+# Turn the text typed in the search bar into an FTS5 query,
+# every word is quoted (so FTS5 operators are not interpreted) and matched as a prefix
+def build_match_query(query):
+    tokens = re.findall(r'\w+', query)[:SEARCH_MAX_TOKENS]
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+# Return the users matching the query, best matches first
+def search_users(query, limit=SEARCH_RESULT_LIMIT):
+    if connection.vendor != 'sqlite':
+        words = query.split(' ')
+        return list(User.objects.filter(
+            Q(first_name__icontains=query) |
+            Q(last_name__icontains=query) |
+            Q(email__icontains=query) |
+            Q(first_name__icontains=words[0]) & Q(last_name__icontains=words[-1])
+        )[:limit])
+
+    match = build_match_query(query)
+    if not match:
+        return []
+    return list(User.objects.raw(SEARCH_SQL, [match, limit]))
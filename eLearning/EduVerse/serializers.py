@@ -1,17 +1,62 @@
 '''
 The serializers convert the models into JSON data types. Some serializers call
 other serializers output.
+The query parameters ?fields= and ?expand= restrict the fields and the nested serializers returned (see SparseFieldsMixin).
 
 References: https://www.django-rest-framework.org/api-guide/serializers/,
 https://www.geeksforgeeks.org/modelserializer-in-serializers-django-rest-framework/,
 https://medium.com/@vivekpemawat/the-choice-between-serializers-modelserializer-and-serializers-serializer-django-60d11ec96904
 '''
 
+import json
 from rest_framework import serializers
 from .models import *
 
+
+# Split a comma separated query parameter, None if the parameter is not in the request
+def query_param_list(request, name):
+    if request is None or name not in request.query_params:
+        return None
+    return [item for item in request.query_params[name].split(',') if item]
+
+# Restrict a serializer to the given fields and expand only the given nested serializers.
+# 'expand' holds dotted paths relative to the serializer (e.g. 'course.teacher'),
+# the nested serializers that are not expanded are replaced by their primary key
+def restrict_fields(serializer, fields=None, expand=None):
+    if fields is not None:
+        for name in set(serializer.fields) - set(fields):
+            serializer.fields.pop(name)
+    if expand is None:
+        return
+    for name, field in list(serializer.fields.items()):
+        if not isinstance(field, serializers.ModelSerializer):
+            continue
+        if name in {path.split('.')[0] for path in expand}:
+            nested = [path.split('.', 1)[1] for path in expand if path.startswith(name + '.')]
+            restrict_fields(field, expand=nested)
+        else:
+            serializer.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+# Return the select_related paths needed by the nested serializers of a serializer
+def related_paths(serializer, prefix=''):
+    paths = []
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.ModelSerializer):
+            path = prefix + field.source
+            paths += related_paths(field, path + '__') or [path]
+    return paths
+
+# Serializer supporting ?fields= (the fields to return) and ?expand= (the nested objects to include).
+# Without the parameters the full nested representation is returned
+class SparseFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the serializer created by the view gets the request, the nested ones are left as declared
+        request = self.context.get('request')
+        restrict_fields(self, query_param_list(request, 'fields'), query_param_list(request, 'expand'))
+
 # Serializer for the User model
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'first_name', 'last_name', 'user_type', 'date_of_birth']
@@ -24,13 +69,13 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 # Serializer for the Address model
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = ['id', 'street_address', 'post_code', 'city', 'country', 'user']
 
 # Serializer for the Student model
-class StudentSerializer(serializers.ModelSerializer):
+class StudentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Using the UserSerializer to include user details
     user = UserSerializer()
 
@@ -39,7 +84,7 @@ class StudentSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'profile_picture']
 
 # Serializer for the Teacher model (similar to StudentSerializer)
-class TeacherSerializer(serializers.ModelSerializer):
+class TeacherSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Nesting the UserSerializer to include user details
     user = UserSerializer()
 
@@ -48,7 +93,7 @@ class TeacherSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'profile_picture']
 
 # Serializer for the Course model
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Nesting the TeacherSerializer to include teacher details
     teacher = TeacherSerializer()
     # Custom field to count enrolled students
@@ -59,11 +104,11 @@ class CourseSerializer(serializers.ModelSerializer):
         fields = ['course_id', 'course_name', 'course_start_date', 'course_length', 'midterm_deadline', 'final_deadline', 'teacher', 'enrolled_students']
 
     def get_enrolled_students(self, obj):
-        # Custom method to get the number of enrolled students
-        return obj.enrolled_student_count()
+        # Custom method to get the number of enrolled students (counter column, no query)
+        return obj.enrolled_count
 
 # Serializer for the Enrollment model
-class EnrollmentSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Using the StudentSerializer and the CourseSerializer 
     # to include student and course details
     student = StudentSerializer()
@@ -74,7 +119,7 @@ class EnrollmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'student', 'course', 'status_update', 'enrollment_date']
 
 # Serializer for the Feedback model
-class FeedbackSerializer(serializers.ModelSerializer):
+class FeedbackSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Using the EnrollmentSerializer to include enrollment details
     enrollment = EnrollmentSerializer()
 
@@ -83,10 +128,46 @@ class FeedbackSerializer(serializers.ModelSerializer):
         fields = ['id', 'enrollment', 'feedback_text', 'created_at']
 
 # Serializer for the Message model
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Using the UserSerializer to include author details
     author = UserSerializer()
 
     class Meta:
         model = Message
-        fields = ['id', 'reference_id', 'message', 'author', 'isRead', 'type', 'extraData']
+        fields = ['id', 'reference_id', 'message', 'author', 'isRead', 'type', 'extraData', 'room', 'created_at']
+
+# Serializer for the messages of the chat history of a room
+class ChatHistorySerializer(serializers.ModelSerializer):
+    # Name shown in the chat, stored with the message
+    author_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ['id', 'message', 'author', 'author_name', 'type', 'created_at']
+
+    def get_author_name(self, obj):
+        try:
+            return json.loads(obj.extraData).get('author_name', '')
+        except (ValueError, AttributeError):
+            return ''
+
+# Serializer for one (student, course) pair of a bulk enrollment
+class EnrollmentPairSerializer(serializers.Serializer):
+    student = serializers.IntegerField()
+    course = serializers.IntegerField()
+
+# Serializer for the bulk enrollment of many students
+class BulkEnrollmentSerializer(serializers.Serializer):
+    enrollments = serializers.ListField(child=EnrollmentPairSerializer(), allow_empty=False, max_length=5000)
+
+    # Check that all the students and courses exist, with one query per model
+    def validate_enrollments(self, value):
+        student_ids = {pair['student'] for pair in value}
+        course_ids = {pair['course'] for pair in value}
+        missing_students = student_ids - set(Student.objects.filter(pk__in=student_ids).values_list('pk', flat=True))
+        missing_courses = course_ids - set(Course.objects.filter(pk__in=course_ids).values_list('pk', flat=True))
+        if missing_students or missing_courses:
+            raise serializers.ValidationError(
+                f'Unknown students {sorted(missing_students)} or courses {sorted(missing_courses)}.'
+            )
+        return value
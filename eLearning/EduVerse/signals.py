@@ -0,0 +1,48 @@
+'''
+Signal receivers that keep the denormalized read models in sync with the tables
+they are built from.
+
+The enrolled_count of a course is incremented and decremented in the same transaction as the enrollment
+insert or delete (Enrollment.save and delete open one when the caller has not), with F() expressions so concurrent enrollments are not lost, and its version stamp is bumped.
+The student dashboard is rebuilt whenever an enrollment is saved or deleted, and in bulk for
+every enrolled student when the name or the deadlines of a course change (not on a material upload).
+
+Reference: https://docs.djangoproject.com/en/5.1/topics/signals/,
+https://docs.djangoproject.com/en/5.1/ref/signals/#post-save
+'''
+
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import *
+
+
+# Rebuild the dashboard of the student whose enrollment changed
+# and count a new enrollment in the course
+@receiver(post_save, sender=Enrollment)
+def enrollment_saved(sender, instance, created, **kwargs):
+    if created:
+        Course.objects.filter(pk=instance.course_id).update(enrolled_count=F('enrolled_count') + 1, updated_at=timezone.now())
+    StudentDashboard.rebuild(instance.student_id)
+
+# On delete only refresh an existing row, the student itself may be being deleted
+@receiver(post_delete, sender=Enrollment)
+def enrollment_deleted(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.course_id).update(enrolled_count=F('enrolled_count') - 1, updated_at=timezone.now())
+    StudentDashboard.rebuild(instance.student_id, create=False)
+
+# Rebuild the dashboards of all the students enrolled in the saved course
+# when the columns they show changed
+@receiver(post_save, sender=Course)
+def course_saved(sender, instance, created, update_fields, **kwargs):
+    if update_fields is not None and not set(update_fields).intersection(Course.DASHBOARD_FIELDS):
+        return
+    values = instance.dashboard_values()
+    previous = getattr(instance, '_dashboard_values', None)
+    instance._dashboard_values = values
+    # A new course has no enrollments yet
+    if created or values == previous:
+        return
+    student_ids = list(Enrollment.objects.filter(course=instance).values_list('student_id', flat=True))
+    StudentDashboard.rebuild_many(student_ids)
@@ -3,7 +3,8 @@
  * If the user_type is a student, it sends a POST request to store the room ID, while if it's a
  * teacher, it sends a GET request to retrieve the room ID. Once student and teacher have the same room ID,
  * the websocket connection is enstablished with ws/chat/roomId.
- * onmessage: it handles incoming messages and it updates the course name displayed in the chat if the user is a teacher.
+ * onmessage: it handles incoming messages (one frame or an array of batched frames) and it updates the course name displayed in the chat if the user is a teacher.
+ * Teachers also receive the presence frames (members on join, then join/leave deltas) and show who is in the room.
  * onclose: it handles the closing of the WebSocket connection.
  * 
  * Reference: https://stackoverflow.com/questions/73354115/how-do-i-add-a-csrf-token-to-a-json-fetch-in-js,
@@ -87,6 +88,38 @@ else if (roomId) {
       // Handle WebSocket events onmessage
       chatSocket.onmessage = function (e) {
           const data = JSON.parse(e.data);
+          // Frames batched by the server arrive as an array
+          const frames = Array.isArray(data) ? data : [data];
+          frames.forEach(handleFrame);
+        };
+
+      // Names of the clients in the room, only kept for teachers
+      var members = [];
+
+      // Update the online count and the member list from a presence frame
+      function handlePresence(data) {
+          if (data.presence === 'members') {
+              members = data.members;
+          } else if (data.presence === 'join') {
+              members.push(data.name);
+          } else if (data.presence === 'leave' && members.indexOf(data.name) !== -1) {
+              members.splice(members.indexOf(data.name), 1);
+          }
+          document.querySelector('#chat-online').textContent = `${data.online} online`;
+          document.querySelector('#chat-members').innerHTML = '';
+          members.forEach(function (name) {
+              const item = document.createElement('li');
+              item.textContent = name;
+              document.querySelector('#chat-members').appendChild(item);
+          });
+      }
+
+      // Handle one chat frame
+      function handleFrame(data) {
+          if (data.presence) {
+              handlePresence(data);
+              return;
+          }
           const message = data.message;
           const author = data.author;
           const courseNameFromWebSocket = data.course_name;
@@ -102,7 +135,7 @@ else if (roomId) {
                 document.querySelector('#chat-room-name').textContent = courseNameFromWebSocket.trim();
               }
           }
-        };
+      }
       
       // Handle WebSocket closure
       chatSocket.onclose = function (e) {
@@ -0,0 +1,47 @@
+/** The 'Load more' button of the course catalog in the student home page fetches the next page of courses
+ *  from the catalog endpoint, passing the cursor (the last course_id shown) received with the previous page.
+ *  The courses are appended to the list and the button is removed when there are no more pages.
+ *
+ * Reference: https://developer.mozilla.org/en-US/docs/Web/API/Fetch_API/Using_Fetch
+ */
+
+document.addEventListener("DOMContentLoaded", function() {
+    const catalog = document.getElementById('course-catalog');
+    const loadMoreButton = document.getElementById('load-more-courses');
+
+    // Nothing to do if the catalog fits in the first page
+    if (!catalog || !loadMoreButton) {
+        return;
+    }
+
+    loadMoreButton.addEventListener('click', function() {
+        const url = `${loadMoreButton.dataset.url}?after=${loadMoreButton.dataset.nextCursor}`;
+        loadMoreButton.disabled = true;
+
+        fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                // Append a list item for each course of the page
+                data.courses.forEach(function(course) {
+                    const item = document.createElement('li');
+                    item.className = 'list-group-item';
+                    const link = document.createElement('a');
+                    link.href = `/course/${course.course_id}/`;
+                    link.textContent = course.course_name;
+                    item.appendChild(link);
+                    catalog.appendChild(item);
+                });
+                // Keep the cursor for the next page or remove the button after the last one
+                if (data.next_cursor) {
+                    loadMoreButton.dataset.nextCursor = data.next_cursor;
+                    loadMoreButton.disabled = false;
+                } else {
+                    loadMoreButton.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading courses:', error);
+                loadMoreButton.disabled = false;
+            });
+    });
+});
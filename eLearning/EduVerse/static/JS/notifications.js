@@ -7,6 +7,10 @@
  * updateNotificationMessage: it updates the notification for a new student enrollment; 
  * updateStudentCount: it adjusts the student count for a specific course; 
  * updateMaterialsNotification: it notifies the user about new materials uploaded for a course.
+ * students_enrolled messages (bulk enrollments) carry every course with new students and its new count.
+ * The messages arrive on the WebSocket shared by the scripts of the page (socket.js).
+ * A student page subscribes to its student group and to the groups of its courses, an update_material
+ * sent to both arrives once.
  * 
  * Reference: https://medium.com/geekculture/designing-a-websocket-client-with-notifications-in-reactjs-reformers-reactjs-implementation-c669daf27d46,
  * https://dev.to/novu/building-a-chat-browser-notifications-with-react-websockets-and-web-push-1h1j
@@ -54,32 +58,32 @@ document.addEventListener("DOMContentLoaded", function() {
         return;
     }
 
-        // Initialize WebSocket connection only if the page is relevant for notifications
-        const socketUrl = `ws://${window.location.host}/ws/notifications-change/${context.type}/${context.id}/`;
-        const notificationSocket = new WebSocket(socketUrl);
-
-        // Handle incoming WebSocket messages
-        notificationSocket.onmessage = function(event) {
-            console.log('Raw WebSocket message:', event.data)
-            try {
-                const data = JSON.parse(event.data);
-                // if message is student_enrolled
-                if (data.type === 'student_enrolled') {
-                    // Update notification for a new student enrollment
-                    updateNotificationMessage(data.student_name, data.course_name);
-                    // Update the student count in the course
-                    updateStudentCount(data.enrolled_student_count, data.course_id);
-                    // if message is update_material
-                } else if (data.type === 'update_material') {
-                    //Update notification for new course materials
-                    updateMaterialsNotification(data.course_name);
-                } else {
-                    console.error('Unsupported message type:', data.type);  
-                }
-            } catch (error) {
-                console.error('Error handling WebSocket message:', error);
-            }
-        };
+    // Subscribe the shared WebSocket of the page (socket.js) to the context
+    EduVerseSocket.subscribe(context.type, context.id);
+    // A student page also follows its courses: the material updates are logged in the course group,
+    // so they are replayed from there after a reconnection
+    if (context.type === 'student') {
+        document.querySelectorAll('[data-course-id]').forEach(function(courseElement) {
+            EduVerseSocket.subscribe('course', courseElement.dataset.courseId);
+        });
+    }
+
+    // Update notification for a new student enrollment and the student count in the course
+    EduVerseSocket.on('student_enrolled', function(data) {
+        updateNotificationMessage(data.student_name, data.course_name);
+        updateStudentCount(data.enrolled_student_count, data.course_id);
+    });
+    // Bulk enrollment, one message for all the courses
+    EduVerseSocket.on('students_enrolled', function(data) {
+        data.courses.forEach(function(course) {
+            updateBulkEnrollmentMessage(course.new_students, course.course_name);
+            setStudentCount(course.enrolled_student_count, course.course_id);
+        });
+    });
+    // Update notification for new course materials
+    EduVerseSocket.on('update_material', function(data) {
+        updateMaterialsNotification(data.course_name);
+    });
 
     // Function to update the notification message for a new student enrollment
     function updateNotificationMessage(studentName, courseName) {
@@ -105,6 +109,22 @@ document.addEventListener("DOMContentLoaded", function() {
         }
     }
 
+    // Function to update the notification message for a bulk enrollment
+    function updateBulkEnrollmentMessage(newStudents, courseName) {
+        if (notificationContainer && notificationMessage) {
+            notificationMessage.textContent = `${newStudents} students have enrolled in the course ${courseName}.`;
+            notificationContainer.style.display = 'block';
+        }
+    }
+
+    // Function to set the student count of a course to the value received
+    function setStudentCount(count, courseId) {
+        const courseElement = document.querySelector(`#course-${courseId} .enrolled-student-count`);
+        if (courseElement) {
+            courseElement.textContent = count;
+        }
+    }
+
     // Function to update the notification message for new course materials
     function updateMaterialsNotification(courseName) {
         if (notificationContainer && studentNotificationMessage) {
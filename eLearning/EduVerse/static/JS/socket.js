@@ -0,0 +1,97 @@
+/**
+ * One WebSocket shared by the scripts of a page, opened on ws/multiplex/ when the first context is subscribed.
+ * subscribe: it joins the group of a context (teacher, student or course) once, whatever the number of scripts asking;
+ * on: it registers a handler for a frame type (student_removed, student_enrolled, students_enrolled, update_material).
+ * The subscriptions made before the connection is open are sent when it opens.
+ * The notifications carry the sequence number (seq) of their group: the last one of each group is kept,
+ * so after a reconnection only the missed notifications are replayed and the ones already received are skipped.
+ * When the missed notifications are no longer kept by the server (resync), the page is reloaded.
+ * A subscription over the limit of the server (MULTIPLEX_MAX_SUBSCRIPTIONS), or to a context the user cannot follow,
+ * is refused with subscribe_refused.
+ *
+ * Reference: https://developer.mozilla.org/en-US/docs/Web/API/WebSocket,
+ * https://channels.readthedocs.io/en/stable/topics/consumers.html#websocketconsumer
+ */
+
+window.EduVerseSocket = (function () {
+    var socket = null;
+    var subscriptions = {};
+    var lastSeq = {};
+    var handlers = {};
+
+    // Subscribe frame of a context, with the last seq received once there is one
+    function subscribeFrame(key) {
+        const frame = { type: 'subscribe', context_type: subscriptions[key].type, context_id: subscriptions[key].id };
+        if (lastSeq[key] !== undefined) {
+            frame.last_seq = lastSeq[key];
+        }
+        return frame;
+    }
+
+    // Keep the last seq of each group and skip the notifications already received
+    function isNew(data) {
+        if (!data.group || data.seq === undefined) {
+            return true;
+        }
+        if (lastSeq[data.group] !== undefined && data.seq <= lastSeq[data.group]) {
+            return false;
+        }
+        lastSeq[data.group] = data.seq;
+        return true;
+    }
+
+    // Open the connection, subscribe to every context and dispatch the frames by type
+    function connect() {
+        socket = new WebSocket(`ws://${window.location.host}/ws/multiplex/`);
+        socket.onopen = function () {
+            Object.keys(subscriptions).forEach(function (key) {
+                socket.send(JSON.stringify(subscribeFrame(key)));
+            });
+        };
+        socket.onmessage = function (event) {
+            try {
+                const data = JSON.parse(event.data);
+                if (data.type === 'subscribed') {
+                    isNew(data);
+                } else if (data.type === 'resync') {
+                    window.location.reload();
+                } else if (data.type === 'subscribe_refused') {
+                    if (data.reason === 'limit') {
+                        console.error(`Subscription to ${data.group} refused, the limit is ${data.limit} per page`);
+                    } else {
+                        console.error(`Subscription to ${data.group} refused, the user cannot follow it`);
+                    }
+                } else if (isNew(data)) {
+                    (handlers[data.type] || []).forEach(function (handler) {
+                        handler(data);
+                    });
+                }
+            } catch (error) {
+                console.error('Error handling WebSocket message:', error);
+            }
+        };
+        // Reconnect, the missed notifications are replayed on subscribe
+        socket.onclose = function () {
+            console.error('Socket closed unexpectedly, reconnecting');
+            setTimeout(connect, 1000);
+        };
+    }
+
+    return {
+        subscribe: function (contextType, contextId) {
+            const key = `${contextType}_${contextId}`;
+            if (subscriptions[key]) {
+                return;
+            }
+            subscriptions[key] = { type: contextType, id: contextId };
+            if (!socket) {
+                connect();
+            } else if (socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify(subscribeFrame(key)));
+            }
+        },
+        on: function (type, handler) {
+            (handlers[type] = handlers[type] || []).push(handler);
+        },
+    };
+})();
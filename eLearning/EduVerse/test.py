@@ -6,7 +6,35 @@ Reference: https://factoryboy.readthedocs.io/en/stable/examples.html,
 https://medium.com/analytics-vidhya/factoryboy-usage-cd0398fd11d2
 '''
 
-from django.test import TestCase
+import json
+import asyncio
+import functools
+import msgpack
+import os
+import redis
+import uuid
+import tempfile
+import threading
+import time
+from collections import Counter
+from io import StringIO
+from unittest import mock, skipUnless
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.sessions.models import Session
+from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
 from rest_framework import status
@@ -14,6 +42,29 @@ from .model_factories import *
 from .models import *
 from .forms import *
 from .serializers import *
+from .search import search_users
+from .chat_history import message_buffer
+from .consumers import ChatConsumer, NotificationConsumer
+from .layers import HashRing, HybridChannelLayer, ShardedChannelLayer
+from .multicast import group_send_many
+from .notifications import dispatcher, missed_notifications, publish, publish_many, send_batch, unsent_notifications
+from .presence import memory_presence, presence_member
+from .throttling import CLOSE_RATE_LIMITED, TokenBucket, server_transport
+from .wire import JSON, MSGPACK, encode, encode_batch, with_encoded_frame
+from .routing import websocket_urlpatterns
+
+# Redis server of the tests of the Redis channel layers, they are skipped when it is not running
+TEST_REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6379')
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
+
+# Frame of the next group event received on a channel, as encoded by the sender (see wire.py)
+def received_frame(layer, channel):
+    return json.loads(async_to_sync(layer.receive)(channel)['encoded'][JSON])
 
 # Test class for models
 class ModelTests(TestCase):
@@ -154,3 +205,1230 @@ class APIViewTests(APITestCase):
         # This test verifies the GET request to the enrollments API endpoint
         response = self.client.get(f'/api/enrollments/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+# Test class for the student dashboard read model
+class StudentDashboardTests(TestCase):
+    def setUp(self):
+        # Create a student and a course taught by a teacher
+        self.student = UserFactory.create(user_type='student').student_profile
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.course = CourseFactory.create(teacher=teacher)
+
+    def test_dashboard_follows_enrollments(self):
+        # Enrolling, renaming the course and unenrolling keep the dashboard in sync
+        enrollment = Enrollment.objects.create(student=self.student, course=self.course, status_update='Started')
+        dashboard = StudentDashboard.objects.get(student=self.student)
+        self.assertEqual([c['pk'] for c in dashboard.enrolled_courses], [self.course.pk])
+        self.assertEqual(dashboard.enrollments[0]['status_update'], 'Started')
+
+        self.course.course_name = 'Renamed course'
+        self.course.save()
+        dashboard.refresh_from_db()
+        self.assertEqual(dashboard.enrolled_courses[0]['course_name'], 'Renamed course')
+
+        enrollment.delete()
+        dashboard.refresh_from_db()
+        self.assertEqual(dashboard.enrolled_courses, [])
+
+    def test_student_home_reads_dashboard(self):
+        # The enrolled courses are rendered from the dashboard in a constant number of queries
+        AddressFactory.create(user=self.student.user)
+        Enrollment.objects.create(student=self.student, course=self.course)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/student/{self.student.pk}/')
+        self.assertContains(response, self.course.course_name)
+
+    def test_course_save_rebuilds_in_bulk(self):
+        # A save that keeps the name and deadlines skips the rebuild, a rename rebuilds every dashboard
+        # in a number of queries that does not grow with the students
+        for user in UserFactory.create_batch(10, user_type='student'):
+            Enrollment.objects.create(student=user.student_profile, course=self.course)
+        course = Course.objects.get(pk=self.course.pk)
+        course.midterm_deadline = str(course.midterm_deadline)
+        with CaptureQueriesContext(connection) as unchanged:
+            course.save()
+        course.course_name = 'Renamed course'
+        with CaptureQueriesContext(connection) as renamed:
+            course.save()
+        self.assertEqual(len(unchanged), 1)
+        self.assertLess(len(renamed), 10)
+        names = {dashboard.enrolled_courses[0]['course_name'] for dashboard in StudentDashboard.objects.all()}
+        self.assertEqual(names, {'Renamed course'})
+
+    def test_bulk_rebuild_upserts_the_dashboards(self):
+        # A dashboard created by rebuild() (student_home) while the bulk rebuild runs is updated, not inserted twice
+        Enrollment.objects.create(student=self.student, course=self.course)
+        StudentDashboard.objects.all().delete()
+        build_data, rebuilt = StudentDashboard.build_data, []
+        def rebuilt_meanwhile(enrollments):
+            if not rebuilt:
+                rebuilt.append(self.student.pk)
+                StudentDashboard.rebuild(self.student.pk)
+            return build_data(enrollments)
+        with mock.patch.object(StudentDashboard, 'build_data', side_effect=rebuilt_meanwhile):
+            StudentDashboard.rebuild_many([self.student.pk])
+        self.assertEqual(StudentDashboard.objects.get(student=self.student).enrolled_courses[0]['pk'], self.course.pk)
+
+    def test_rebuild_command(self):
+        # The management command recreates missing dashboards
+        Enrollment.objects.create(student=self.student, course=self.course)
+        StudentDashboard.objects.all().delete()
+        call_command('rebuild_student_dashboards', stdout=StringIO())
+        dashboard = StudentDashboard.objects.get(student=self.student)
+        self.assertEqual(dashboard.enrolled_courses[0]['pk'], self.course.pk)
+
+# Test class for the keyset paginated course catalog
+class CourseCatalogTests(TestCase):
+    def setUp(self):
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.courses = CourseFactory.create_batch(25, teacher=teacher)
+
+    def test_catalog_pages_follow_cursor(self):
+        # Walking the cursor returns every course once, in course_id order
+        response = self.client.get('/courses/catalog/')
+        first_page = response.json()
+        self.assertEqual(len(first_page['courses']), 20)
+        response = self.client.get(f"/courses/catalog/?after={first_page['next_cursor']}")
+        second_page = response.json()
+        self.assertIsNone(second_page['next_cursor'])
+        ids = [c['course_id'] for c in first_page['courses'] + second_page['courses']]
+        self.assertEqual(ids, sorted(c.course_id for c in self.courses))
+
+    def test_catalog_invalid_cursor(self):
+        response = self.client.get('/courses/catalog/?after=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+# Test class for the full-text user search
+class UserSearchTests(TestCase):
+    def test_prefix_and_multi_token_search(self):
+        john = UserFactory.create(first_name='John', last_name='Smith', email='jsmith@example.com')
+        UserFactory.create(first_name='Mary', last_name='Johnson', email='mary@example.com')
+        # Both names match the 'jo' prefix, only John matches both words
+        self.assertEqual(len(search_users('jo')), 2)
+        self.assertEqual(search_users('jo smi'), [john])
+
+    def test_index_follows_updates_and_deletes(self):
+        user = UserFactory.create(first_name='Casey', last_name='Jones')
+        user.first_name = 'April'
+        user.save()
+        self.assertEqual(search_users('casey'), [])
+        self.assertEqual(search_users('april'), [user])
+        user.delete()
+        self.assertEqual(search_users('april'), [])
+
+    def test_operators_are_not_interpreted(self):
+        # FTS5 syntax typed in the search bar does not raise errors
+        self.assertEqual(search_users('"OR* (NEAR'), [])
+
+# Test class for the enrolled_count counter of the courses
+class EnrolledCountTests(TestCase):
+    def setUp(self):
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.course = CourseFactory.create(teacher=teacher)
+        self.students = [UserFactory.create(user_type='student').student_profile for _ in range(3)]
+
+    def test_counter_follows_enrollments(self):
+        enrollments = [Enrollment.objects.create(student=s, course=self.course) for s in self.students]
+        enrollments[0].delete()
+        # Saving a stale instance does not overwrite the counter
+        self.course.course_name = 'Renamed'
+        self.course.save()
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrolled_count, 2)
+        self.assertEqual(self.course.course_name, 'Renamed')
+
+    def test_enrollment_and_counter_are_written_together(self):
+        # A failure after the insert leaves neither the row nor the counter, without an atomic block around the create
+        with mock.patch.object(StudentDashboard, 'rebuild', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Enrollment.objects.create(student=self.students[0], course=self.course)
+        self.assertFalse(Enrollment.objects.exists())
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrolled_count, 0)
+
+    def test_reconcile_command(self):
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.course)
+        Course.objects.update(enrolled_count=0)
+        call_command('reconcile_enrollment_counts', stdout=StringIO())
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrolled_count, 3)
+
+# Test class for the number of queries of the API list endpoints
+class APIQueryCountTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=UserFactory.create(user_type='teacher', is_staff=True))
+
+    # Create one feedback (with its enrollment, student, course and teacher) and a message
+    def create_rows(self):
+        student = UserFactory.create(user_type='student').student_profile
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        course = CourseFactory.create(teacher=teacher)
+        AddressFactory.create(user=student.user)
+        enrollment = Enrollment.objects.create(student=student, course=course)
+        Feedback.objects.create(enrollment=enrollment, feedback_text='Good')
+        MessageFactory.create(author=student.user)
+
+    # Return the number of queries done listing the endpoint
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        urls = ['/api/users/', '/api/addresses/', '/api/students/', '/api/teachers/',
+                '/api/courses/', '/api/enrollments/', '/api/feedbacks/', '/api/messages/']
+        self.create_rows()
+        few = {url: self.count_queries(url) for url in urls}
+        for _ in range(4):
+            self.create_rows()
+        many = {url: self.count_queries(url) for url in urls}
+        self.assertEqual(few, many)
+
+# Test class for the cursor pagination of the API
+class APIPaginationTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=UserFactory.create())
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.courses = CourseFactory.create_batch(7, teacher=teacher)
+
+    def test_cursor_walks_all_rows(self):
+        # Following the 'next' links returns every course once
+        ids = []
+        url = '/api/courses/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids += [course['course_id'] for course in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, sorted(course.course_id for course in self.courses))
+
+    def test_page_size_is_capped(self):
+        CourseFactory.create_batch(200, teacher=self.courses[0].teacher)
+        response = self.client.get('/api/courses/?page_size=100000')
+        self.assertEqual(len(response.data['results']), settings.API_MAX_PAGE_SIZE)
+
+    @override_settings(API_MAX_PAGE_SIZE=5)
+    def test_page_size_cap_follows_the_setting(self):
+        response = self.client.get('/api/courses/?page_size=100000')
+        self.assertEqual(len(response.data['results']), 5)
+
+# Test class for the ?fields= and ?expand= query parameters of the API
+class APISparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=UserFactory.create())
+        student = UserFactory.create(user_type='student').student_profile
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.course = CourseFactory.create(teacher=teacher)
+        self.enrollment = Enrollment.objects.create(student=student, course=self.course)
+
+    def test_fields_restricts_the_response(self):
+        response = self.client.get('/api/courses/?fields=course_id,course_name')
+        self.assertEqual(set(response.data['results'][0]), {'course_id', 'course_name'})
+
+    def test_expand_selects_nested_objects(self):
+        # Only the course is nested, its teacher and the student are primary keys
+        response = self.client.get('/api/enrollments/?expand=course')
+        enrollment = response.data['results'][0]
+        self.assertEqual(enrollment['student'], self.enrollment.student_id)
+        self.assertEqual(enrollment['course']['teacher'], self.course.teacher_id)
+        # Dotted paths expand deeper levels
+        response = self.client.get('/api/enrollments/?expand=course.teacher')
+        self.assertEqual(response.data['results'][0]['course']['teacher']['user'], self.course.teacher.user_id)
+
+    def test_unexpanded_relations_are_not_joined(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/enrollments/?expand=')
+        self.assertFalse(any('EduVerse_user' in query['sql'] for query in queries
+                             if 'EduVerse_enrollment' in query['sql']))
+
+# Test class for the conditional GETs of the API
+class APIConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=UserFactory.create())
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.course = CourseFactory.create(teacher=teacher)
+
+    def test_unchanged_list_returns_304(self):
+        response = self.client.get('/api/courses/')
+        etag = response['ETag']
+        # The 304 is answered with the query of the page window only
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_update_the_etag(self):
+        etag = self.client.get('/api/courses/')['ETag']
+        # A new enrollment bumps the course version stamp through the counter update
+        student = UserFactory.create(user_type='student').student_profile
+        Enrollment.objects.create(student=student, course=self.course)
+        response = self.client.get('/api/courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_etag(self):
+        url = f'/api/courses/{self.course.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.course.course_name = 'Renamed'
+        self.course.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_etag_covers_the_page_only(self):
+        courses = CourseFactory.create_batch(4, teacher=self.course.teacher)
+        etag = self.client.get('/api/courses/?page_size=2')['ETag']
+        # A change on a later page leaves the first page unchanged
+        courses[-1].course_name = 'Renamed'
+        courses[-1].save()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/courses/?page_size=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('LIMIT 3', queries[0]['sql'])
+        # A change on the page does not
+        self.course.course_name = 'Renamed'
+        self.course.save()
+        self.assertEqual(self.client.get('/api/courses/?page_size=2', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_nested_user_changes_update_the_etag(self):
+        # The courses and enrollments nest the users of their teacher and student
+        student = UserFactory.create(user_type='student').student_profile
+        Enrollment.objects.create(student=student, course=self.course)
+        etags = {url: self.client.get(url)['ETag'] for url in ('/api/courses/', '/api/enrollments/')}
+        teacher_user = self.course.teacher.user
+        teacher_user.first_name = 'Renamed'
+        teacher_user.save()
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, 'Renamed')
+
+# Test class for the bulk enrollment endpoint
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, NOTIFICATION_DISPATCH_THREAD=False)
+class BulkEnrollmentTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=UserFactory.create(is_staff=True))
+        teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.courses = CourseFactory.create_batch(2, teacher=teacher)
+        self.students = [UserFactory.create(user_type='student').student_profile for _ in range(3)]
+
+    def test_bulk_enrollment(self):
+        # One of the pairs is already enrolled and is skipped
+        Enrollment.objects.create(student=self.students[0], course=self.courses[0])
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(f'teacher_{self.courses[0].teacher_id}', channel)
+
+        pairs = [{'student': s.pk, 'course': c.pk} for s in self.students for c in self.courses]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/enrollments/bulk/', {'enrollments': pairs}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 5, 'skipped': 1})
+
+        # Counters and dashboards are up to date
+        self.assertEqual([Course.objects.get(pk=c.pk).enrolled_count for c in self.courses], [3, 3])
+        self.assertEqual(len(StudentDashboard.objects.get(student=self.students[1]).enrolled_courses), 2)
+
+        # The teacher gets one message for both courses
+        message = received_frame(channel_layer, channel)
+        self.assertEqual(message['type'], 'students_enrolled')
+        self.assertEqual(sorted(c['new_students'] for c in message['courses']), [2, 3])
+
+    def test_only_the_inserted_rows_are_counted(self):
+        # A counter that drifted from the table is not reported as new students
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.courses[0])
+        Course.objects.filter(pk=self.courses[0].pk).update(enrolled_count=1)
+        pairs = [{'student': self.students[0].pk, 'course': self.courses[0].pk}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/enrollments/bulk/', {'enrollments': pairs}, format='json')
+        self.assertEqual(response.data, {'created': 0, 'skipped': 1})
+        self.assertEqual(Course.objects.get(pk=self.courses[0].pk).enrolled_count, 1)
+        # and the teacher is not notified
+        self.assertFalse(Notification.objects.exists())
+
+    def test_unknown_ids_are_rejected(self):
+        response = self.client.post('/api/enrollments/bulk/', {'enrollments': [{'student': 999, 'course': 999}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Enrollment.objects.exists())
+
+# Test class for the import_users command
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersTests(TestCase):
+    def test_import_csv(self):
+        UserFactory.create(email='existing@example.com')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('email,password,first_name,last_name,user_type,city\n')
+            file.write('april@example.com,secret123,April,Oneil,student,New York\n')
+            file.write('splinter@example.com,secret456,Hamato,Yoshi,teacher,Tokyo\n')
+            file.write('existing@example.com,secret789,Old,User,student,London\n')
+        self.addCleanup(os.remove, file.name)
+
+        call_command('import_users', file.name, '--workers', '1', '--batch-size', '2', stdout=StringIO())
+
+        april = User.objects.get(email='april@example.com')
+        self.assertTrue(april.check_password('secret123'))
+        self.assertEqual(april.address.city, 'New York')
+        self.assertTrue(Student.objects.filter(user=april).exists())
+        self.assertTrue(Teacher.objects.filter(user__email='splinter@example.com').exists())
+        self.assertEqual(User.objects.filter(email='existing@example.com').count(), 1)
+
+# Test class for the async login view
+class LoginTests(TestCase):
+    # The sessions are stored in their own database
+    databases = {'default', 'sessions'}
+
+    def setUp(self):
+        self.student = UserFactory.create(user_type='student').student_profile
+        self.user = self.student.user
+
+    def test_login_redirects_and_rehashes(self):
+        # The factory password uses PBKDF2 and is rehashed with the preferred hasher
+        self.user.password = make_password('password123', hasher='pbkdf2_sha256')
+        self.user.save()
+        response = self.client.post('/', {'username': self.user.email, 'password': 'password123'})
+        self.assertRedirects(response, f'/student/{self.student.pk}/', fetch_redirect_response=False)
+        self.assertEqual(self.client.session['student_id'], self.student.pk)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2'))
+        self.assertTrue(self.user.check_password('password123'))
+
+    def test_wrong_password(self):
+        response = self.client.post('/', {'username': self.user.email, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_failed_logins_send_the_signal(self):
+        failed = []
+        def receiver(sender, credentials, **kwargs):
+            failed.append(credentials)
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+        for email in (self.user.email, 'unknown@example.com'):
+            self.client.post('/', {'username': email, 'password': 'wrong'})
+        self.assertEqual([credentials['email'] for credentials in failed], [self.user.email, 'unknown@example.com'])
+        self.assertNotIn('wrong', str(failed))
+
+    # The backends of the setting are used, here one that refuses every login before ModelBackend
+    @override_settings(AUTHENTICATION_BACKENDS=['EduVerse.test.LockedOutBackend', 'django.contrib.auth.backends.ModelBackend'])
+    def test_authentication_backends_are_used(self):
+        self.user.password = make_password('password123')
+        self.user.save()
+        response = self.client.post('/', {'username': self.user.email, 'password': 'password123'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+# Backend of a lockout, refusing every login
+class LockedOutBackend:
+    def authenticate(self, request, email=None, password=None):
+        raise PermissionDenied
+
+# Test class for the chunked purge of the expired sessions
+class PurgeSessionsTests(TestCase):
+    databases = {'default', 'sessions'}
+
+    def test_purge_expired_sessions(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='active', session_data='', expire_date=now + timedelta(days=1))
+        call_command('purge_sessions', '--chunk-size', '2', '--pause', '0', stdout=StringIO())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+        # The sessions are routed to their own database
+        self.assertEqual(Session.objects.db, 'sessions')
+
+# Test class for the chat history persisted by ChatConsumer
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create(user_type='student')
+        self.course = CourseFactory.create(teacher=UserFactory.create(user_type='teacher').teacher_profile)
+        # Only flush when the test asks for it
+        message_buffer.take()
+        self.addCleanup(setattr, message_buffer, 'flush_interval', message_buffer.flush_interval)
+        message_buffer.flush_interval = 60
+
+    async def chat(self, messages):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.pk}/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for message in messages:
+            await communicator.send_json_to({'message': message, 'author': 'April Oneil'})
+            # The broadcast does not wait for the database
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['message'], message)
+        await communicator.disconnect()
+
+    def test_messages_are_written_in_batches(self):
+        async_to_sync(self.chat)(['Hello', 'How are you?'])
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(len(message_buffer), 2)
+
+        message_buffer.flush_sync()
+        stored = list(Message.objects.order_by('pk'))
+        self.assertEqual([m.message for m in stored], ['Hello', 'How are you?'])
+        self.assertEqual(stored[0].room_id, self.course.pk)
+        self.assertEqual(stored[0].author, self.user)
+
+    def test_failed_batches_are_written_again(self):
+        async_to_sync(self.chat)(['Hello', 'How are you?'])
+        bulk_create, calls = Message.objects.bulk_create, []
+        def fail_once(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError('database is locked')
+            return bulk_create(*args, **kwargs)
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=fail_once):
+            async_to_sync(message_buffer.flush)()
+            # The batch is back in the buffer, and written once by the next flush
+            self.assertEqual(len(message_buffer), 2)
+            self.assertFalse(Message.objects.exists())
+            async_to_sync(message_buffer.flush)()
+        self.assertEqual(list(Message.objects.order_by('pk').values_list('message', flat=True)), ['Hello', 'How are you?'])
+        self.assertEqual(message_buffer.failures, 0)
+
+    def test_batches_failing_again_are_written_one_at_a_time(self):
+        self.addCleanup(setattr, message_buffer, 'max_attempts', message_buffer.max_attempts)
+        message_buffer.max_attempts = 2
+        async_to_sync(self.chat)(['Hello', 'How are you?'])
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=DatabaseError('database is locked')):
+            for _ in range(2):
+                async_to_sync(message_buffer.flush)()
+        self.assertEqual(len(message_buffer), 0)
+        self.assertEqual(Message.objects.count(), 2)
+
+# Test class for the chat history API of a room
+class RoomHistoryTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.client.force_authenticate(user=self.user)
+        self.course = CourseFactory.create(teacher=UserFactory.create(user_type='teacher').teacher_profile)
+        other_course = CourseFactory.create(teacher=self.course.teacher)
+        self.messages = [
+            Message.objects.create(room=self.course, message=f'message {i}', author=self.user, type=0,
+                                   extraData=json.dumps({'author_name': 'April'}))
+            for i in range(5)
+        ]
+        Message.objects.create(room=other_course, message='other room', author=self.user, type=0, extraData='')
+
+    def test_history_pages_backwards(self):
+        url = f'/api/rooms/{self.course.pk}/history/'
+        response = self.client.get(url, {'limit': 3})
+        self.assertEqual([m['message'] for m in response.data['results']], ['message 2', 'message 3', 'message 4'])
+        self.assertEqual(response.data['results'][0]['author_name'], 'April')
+        response = self.client.get(url, {'limit': 3, 'before': response.data['before']})
+        self.assertEqual([m['message'] for m in response.data['results']], ['message 0', 'message 1'])
+        self.assertIsNone(response.data['before'])
+
+# Test class for the chat events sent to the room group by ChatConsumer
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatFanoutTests(TestCase):
+    async def connect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/1/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def send_and_count(self, messages):
+        communicator = await self.connect()
+        layer = get_channel_layer()
+        events = []
+        group_send = layer.group_send
+        async def recording_group_send(group, message):
+            events.append(message['type'])
+            await group_send(group, message)
+        layer.group_send = recording_group_send
+        for message in messages:
+            await communicator.send_json_to(message)
+        frames = [await communicator.receive_json_from() for _ in messages]
+        self.assertTrue(await communicator.receive_nothing())
+        del layer.group_send
+        await communicator.disconnect()
+        return events, frames
+
+    @override_settings(CHAT_BATCH_WINDOW=0)
+    def test_one_event_per_message(self):
+        events, frames = async_to_sync(self.send_and_count)([
+            {'message': 'Hello', 'author': 'April', 'course_name': 'Maths'},
+            {'type': 'course_name', 'course_name': 'Physics'},
+        ])
+        self.assertEqual(events, ['chat_message', 'course_name'])
+        self.assertEqual(frames, [
+            {'message': 'Hello', 'author': 'April', 'course_name': 'Maths'},
+            {'course_name': 'Physics'},
+        ])
+
+    @override_settings(CHAT_BATCH_WINDOW=0.05)
+    def test_frames_are_batched(self):
+        async def chat():
+            communicator = await self.connect()
+            for message in ['Hello', 'Bye']:
+                await communicator.send_json_to({'message': message, 'author': 'April'})
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return frame
+        frame = async_to_sync(chat)()
+        self.assertEqual([item['message'] for item in frame], ['Hello', 'Bye'])
+
+# Test class for the rate limiting and the outbound queues of the consumers
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ThrottlingTests(TestCase):
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+        # Half a second earns one token
+        now[0] = 0.5
+        self.assertEqual([bucket.consume() for _ in range(2)], [True, False])
+
+    @override_settings(WEBSOCKET_RATE_LIMIT=0.001, WEBSOCKET_RATE_BURST=3)
+    def test_flooding_client_is_limited_then_closed(self):
+        async def flood():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/remove-student/course/1/')
+            await communicator.connect()
+            for student_id in range(1, 11):
+                await communicator.send_json_to({'type': 'remove_student', 'student_id': student_id, 'course_id': 1})
+            received = [(await communicator.receive_json_from())['student_id'] for _ in range(3)]
+            closing = await communicator.receive_output()
+            await communicator.disconnect()
+            return received, closing
+        received, closing = async_to_sync(flood)()
+        self.assertEqual(received, [1, 2, 3])
+        self.assertEqual(closing, {'type': 'websocket.close', 'code': CLOSE_RATE_LIMITED})
+
+    @override_settings(WEBSOCKET_OUTBOUND_LIMIT=2)
+    def test_outbound_queue_drops_and_coalesces(self):
+        consumer = NotificationConsumer()
+        consumer.open_outbox()
+        consumer.queue_frame('material 1', coalesce_key='update_material_1')
+        consumer.queue_frame('enrolled')
+        consumer.queue_frame('material 1 again', coalesce_key='update_material_1')
+        self.assertEqual([frame[1] for frame in consumer.outbox], ['material 1 again', 'enrolled'])
+        # The oldest frame is dropped for a client that falls behind
+        consumer.queue_frame('material 2', coalesce_key='update_material_2')
+        self.assertEqual([frame[1] for frame in consumer.outbox], ['enrolled', 'material 2'])
+        self.assertEqual(consumer.dropped_frames, 1)
+
+    # Consumer writing to a client whose frames pile up in the write buffer of its transport
+    @override_settings(WEBSOCKET_OUTBOUND_LIMIT=2, WEBSOCKET_WRITE_BUFFER_LIMIT=100)
+    def test_full_write_buffer_holds_the_frames_in_the_queue(self):
+        class Transport:
+            dataBuffer, offset, _tempDataLen = b'x' * 1000, 0, 0
+
+        async def run():
+            sent = []
+            async def send(message):
+                sent.append(message['text'])
+            consumer = NotificationConsumer()
+            consumer.base_send = send
+            consumer.open_outbox(Transport)
+            writer = asyncio.ensure_future(consumer.drain_outbox())
+            for frame, key in [('material 1', 'update_material_1'), ('enrolled', None), ('material 1 again', 'update_material_1'), ('removed', None)]:
+                await consumer.send(text_data=frame, coalesce_key=key)
+                await asyncio.sleep(0.02)
+            # Nothing leaves while the client is behind, the queue stays bounded and coalesced
+            held = (list(sent), [frame[1] for frame in consumer.outbox])
+            Transport.dataBuffer = b''
+            await asyncio.sleep(0.05)
+            writer.cancel()
+            return held, sent
+        held, sent = async_to_sync(run)()
+        self.assertEqual(held, ([], ['enrolled', 'removed']))
+        self.assertEqual(sent, ['enrolled', 'removed'])
+
+    @override_settings(WEBSOCKET_OUTBOUND_LIMIT=2)
+    def test_stalled_send_holds_the_frames_in_the_queue(self):
+        async def run():
+            sent, released = [], asyncio.Event()
+            async def send(message):
+                await released.wait()
+                sent.append(message['text'])
+            consumer = NotificationConsumer()
+            consumer.base_send = send
+            consumer.open_outbox()
+            writer = asyncio.ensure_future(consumer.drain_outbox())
+            for frame in ['first', 'second', 'third', 'fourth']:
+                await consumer.send(text_data=frame)
+                await asyncio.sleep(0.01)
+            released.set()
+            await asyncio.sleep(0.05)
+            writer.cancel()
+            return sent, consumer.dropped_frames
+        # 'first' is in the stalled send, 'second' is dropped for the two newest
+        self.assertEqual(async_to_sync(run)(), (['first', 'third', 'fourth'], 1))
+
+    def test_daphne_transport_is_found_under_the_middlewares(self):
+        class Protocol:
+            transport = object()
+        class SessionWrapper:
+            def __init__(self, send):
+                self.real_send = send
+            async def send(self, message):
+                pass
+        async def handle_reply(protocol, message):
+            pass
+        send = SessionWrapper(functools.partial(handle_reply, Protocol)).send
+        self.assertIs(server_transport(send), Protocol.transport)
+        self.assertIsNone(server_transport(SessionWrapper(None).send))
+
+    def test_batched_frames_keep_their_coalesce_key(self):
+        async def run():
+            consumer = ChatConsumer()
+            consumer.wire_format, consumer.batch_window = JSON, 0.01
+            consumer.pending_frames, consumer.flush_task = [], None
+            queued = []
+            async def send_encoded(data, coalesce_key=None):
+                queued.append((data, coalesce_key))
+            consumer.send_encoded = send_encoded
+            await consumer.send_frame('name 1', coalesce_key='course_name')
+            await consumer.send_frame('name 2', coalesce_key='course_name')
+            pending = list(consumer.pending_frames)
+            await asyncio.sleep(0.05)
+            return pending, queued
+        pending, queued = async_to_sync(run)()
+        self.assertEqual(pending, [('course_name', 'name 2')])
+        self.assertEqual(queued, [('name 2', 'course_name')])
+
+# Test class for the presence of the clients in the chat rooms
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, CHAT_BATCH_WINDOW=0)
+class PresenceTests(APITestCase):
+    def setUp(self):
+        self.teacher = UserFactory.create(user_type='teacher', first_name='Walter', last_name='White')
+        self.student = UserFactory.create(user_type='student', first_name='Jesse', last_name='Pinkman')
+        self.course = CourseFactory.create(teacher=self.teacher.teacher_profile)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.pk}/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        return communicator
+
+    def test_teacher_receives_join_and_leave_deltas(self):
+        async def chat():
+            teacher = await self.connect(self.teacher)
+            frames = [await teacher.receive_json_from()]
+            student = await self.connect(self.student)
+            frames.append(await teacher.receive_json_from())
+            # Students do not follow the presence
+            self.assertTrue(await student.receive_nothing())
+            online = await memory_presence.count(self.course.pk)
+            await student.disconnect()
+            frames.append(await teacher.receive_json_from())
+            await teacher.disconnect()
+            return frames, online
+        frames, online = async_to_sync(chat)()
+        self.assertEqual(frames[0], {'presence': 'members', 'members': ['Walter White'], 'online': 1})
+        self.assertEqual(frames[1], {'presence': 'join', 'name': 'Jesse Pinkman', 'online': 2})
+        self.assertEqual(frames[2], {'presence': 'leave', 'name': 'Jesse Pinkman', 'online': 1})
+        self.assertEqual(online, 2)
+        self.assertEqual(async_to_sync(memory_presence.count)(self.course.pk), 0)
+
+    def test_members_without_heartbeat_expire(self):
+        room = self.course.pk
+        async_to_sync(memory_presence.join)(room, presence_member('stale', 'Gone'))
+        # Last heartbeat older than the TTL
+        memory_presence.rooms[str(room)][presence_member('stale', 'Gone')] -= settings.PRESENCE_TTL + 1
+        self.assertEqual(async_to_sync(memory_presence.join)(room, presence_member('fresh', 'Here')), 1)
+        self.client.force_authenticate(user=self.teacher)
+        response = self.client.get(f'/api/rooms/{room}/presence/')
+        self.assertEqual(response.data, {'room': room, 'online': 1})
+        async_to_sync(memory_presence.leave)(room, presence_member('fresh', 'Here'))
+
+    def test_expired_members_leave_the_count_without_a_new_join(self):
+        room = self.course.pk
+        async_to_sync(memory_presence.join)(room, presence_member('stale', 'Gone'))
+        memory_presence.rooms[str(room)][presence_member('stale', 'Gone')] -= settings.PRESENCE_TTL + 1
+        self.assertEqual(async_to_sync(memory_presence.members)(room), [])
+        self.assertEqual(async_to_sync(memory_presence.count)(room), 0)
+        self.assertNotIn(str(room), memory_presence.rooms)
+
+# Test class for the pending-room queues of the teachers
+@override_settings(PENDING_ROOMS_REDIS_URL=None)
+class PendingRoomsTests(TestCase):
+    databases = {'default', 'sessions'}
+
+    def setUp(self):
+        self.teachers = [UserFactory.create(user_type='teacher') for _ in range(2)]
+        self.courses = [CourseFactory.create(teacher=teacher.teacher_profile) for teacher in self.teachers]
+
+    def test_each_teacher_gets_the_rooms_of_its_courses(self):
+        for course in [self.courses[0], self.courses[1]]:
+            response = self.client.post('/store_info/', json.dumps({'room_id': course.pk}), content_type='application/json')
+            self.assertEqual(response.json(), {'status': 'success', 'room_id': course.pk})
+        # The second chat did not overwrite the first one
+        for teacher, course in zip(self.teachers, self.courses):
+            self.client.force_login(teacher)
+            self.assertEqual(self.client.get('/get_info/').json(), {'room_id': str(course.pk)})
+            self.assertEqual(self.client.get('/get_info/').status_code, 404)
+
+    def test_unknown_and_expired_rooms(self):
+        response = self.client.post('/store_info/', json.dumps({'room_id': 0}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        with self.settings(PENDING_ROOMS_TTL=0):
+            self.client.post('/store_info/', json.dumps({'room_id': self.courses[0].pk}), content_type='application/json')
+        self.client.force_login(self.teachers[0])
+        self.assertEqual(self.client.get('/get_info/').status_code, 404)
+
+# Test class for the multiplexed WebSocket of the pages
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MultiplexConsumerTests(TestCase):
+    def setUp(self):
+        self.teacher = UserFactory.create(user_type='teacher').teacher_profile
+        self.courses = CourseFactory.create_batch(3, teacher=self.teacher)
+        self.student = UserFactory.create(user_type='student').student_profile
+        Enrollment.objects.create(student=self.student, course=self.courses[0])
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/multiplex/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        return communicator
+
+    def test_one_connection_receives_both_streams(self):
+        group = f'student_{self.student.pk}'
+        async def run():
+            communicator = await self.connect(self.student.user)
+            # Asked by notifications.js and remove_student.js, joined once
+            for _ in range(2):
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': 'student', 'context_id': self.student.pk})
+            await communicator.send_json_to({'type': 'subscribe', 'context_type': 'admin', 'context_id': 1})
+            subscribed = await communicator.receive_json_from()
+            self.assertEqual(subscribed['type'], 'subscribed')
+            self.assertTrue(await communicator.receive_nothing())
+            layer = get_channel_layer()
+            self.assertEqual(list(layer.groups), [group])
+            await layer.group_send(group, {'type': 'student_removed', 'student_id': 3, 'course_id': 7})
+            await layer.group_send(group, {'type': 'update_material', 'course_name': 'Maths', 'course_id': 7})
+            frames = [await communicator.receive_json_from() for _ in range(2)]
+            await communicator.send_json_to({'type': 'unsubscribe', 'context_type': 'student', 'context_id': self.student.pk})
+            self.assertTrue(await communicator.receive_nothing())
+            await layer.group_send(group, {'type': 'student_removed', 'student_id': 3, 'course_id': 8})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return frames
+        frames = async_to_sync(run)()
+        self.assertEqual(frames, [
+            {'type': 'student_removed', 'student_id': 3, 'course_id': 7},
+            {'type': 'update_material', 'course_name': 'Maths', 'course_id': 7},
+        ])
+
+    def test_anonymous_connections_are_rejected(self):
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/multiplex/')
+            connected, _ = await communicator.connect()
+            return connected
+        self.assertFalse(async_to_sync(run)())
+
+    def test_only_the_contexts_of_the_user_are_followed(self):
+        other = UserFactory.create(user_type='student').student_profile
+        contexts = [
+            ('student', other.pk), ('teacher', self.teacher.pk), ('course', self.courses[1].pk),
+            ('course', self.courses[0].pk), ('student', self.student.pk),
+        ]
+        async def run():
+            communicator = await self.connect(self.student.user)
+            for context_type, context_id in contexts:
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': context_type, 'context_id': context_id})
+            frames = [await communicator.receive_json_from() for _ in contexts]
+            await communicator.disconnect()
+            return frames
+        frames = async_to_sync(run)()
+        self.assertEqual([frame['type'] for frame in frames], ['subscribe_refused'] * 3 + ['subscribed'] * 2)
+        self.assertEqual({frame.get('reason') for frame in frames[:3]}, {'forbidden'})
+        # The teacher follows its own group and its courses
+        async def teacher():
+            communicator = await self.connect(self.teacher.user)
+            for context_type, context_id in [('teacher', self.teacher.pk), ('course', self.courses[2].pk)]:
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': context_type, 'context_id': context_id})
+            frames = [await communicator.receive_json_from() for _ in range(2)]
+            await communicator.disconnect()
+            return frames
+        self.assertEqual([frame['type'] for frame in async_to_sync(teacher)()], ['subscribed', 'subscribed'])
+
+    @override_settings(MULTIPLEX_MAX_SUBSCRIPTIONS=2)
+    def test_subscriptions_over_the_limit_are_refused(self):
+        async def run():
+            communicator = await self.connect(self.teacher.user)
+            for course in self.courses:
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': 'course', 'context_id': course.pk})
+            frames = [await communicator.receive_json_from() for _ in range(3)]
+            await communicator.disconnect()
+            return frames
+        frames = async_to_sync(run)()
+        self.assertEqual([frame['type'] for frame in frames], ['subscribed', 'subscribed', 'subscribe_refused'])
+        self.assertEqual(frames[2], {
+            'type': 'subscribe_refused', 'context_type': 'course', 'context_id': self.courses[2].pk,
+            'group': f'course_{self.courses[2].pk}', 'reason': 'limit', 'limit': 2,
+        })
+
+    @override_settings(WEBSOCKET_RATE_LIMIT=10, WEBSOCKET_RATE_BURST=20)
+    def test_subscriptions_are_not_rate_limited(self):
+        # A page subscribes to all its courses at once, more than the burst of the rate limit
+        courses = CourseFactory.create_batch(45, teacher=self.teacher)
+        async def run():
+            communicator = await self.connect(self.teacher.user)
+            for course in courses:
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': 'course', 'context_id': course.pk})
+            frames = [await communicator.receive_json_from() for _ in courses]
+            await communicator.disconnect()
+            return frames
+        frames = async_to_sync(run)()
+        self.assertEqual({frame['type'] for frame in frames}, {'subscribed'})
+        self.assertEqual(len({frame['group'] for frame in frames}), 45)
+
+    def test_client_frames_are_not_sent_to_the_group(self):
+        # The notifications come from the server only, a client cannot send one to the other subscribers
+        async def run():
+            sender, receiver = await self.connect(self.teacher.user), await self.connect(self.student.user)
+            for communicator in (sender, receiver):
+                await communicator.send_json_to({'type': 'subscribe', 'context_type': 'course', 'context_id': self.courses[0].pk})
+                await communicator.receive_json_from()
+            await sender.send_json_to({
+                'type': 'update_material', 'context_type': 'course', 'context_id': self.courses[0].pk,
+                'course_name': 'Maths', 'course_id': self.courses[0].pk,
+            })
+            nothing = await receiver.receive_nothing()
+            for communicator in (sender, receiver):
+                await communicator.disconnect()
+            return nothing
+        self.assertTrue(async_to_sync(run)())
+
+# Test class for the notification log and the replay of the missed notifications
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationLogTests(TestCase):
+    def setUp(self):
+        self.student = UserFactory.create(user_type='student').student_profile
+        self.group = f'student_{self.student.pk}'
+
+    def material(self, course_id):
+        return {'type': 'update_material', 'course_name': 'Maths', 'course_id': course_id}
+
+    async def subscribe(self, **frame):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/multiplex/')
+        communicator.scope['user'] = self.student.user
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'subscribe', 'context_type': 'student', 'context_id': self.student.pk, **frame})
+        return communicator
+
+    async def receive_all(self, communicator):
+        frames = []
+        while not await communicator.receive_nothing():
+            frames.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return frames
+
+    def test_reconnect_replays_only_missed_notifications(self):
+        publish(self.group, self.material(1))
+        publish_many([(self.group, self.material(2)), ('student_0', self.material(2))])
+        first = Notification.objects.filter(group=self.group).order_by('pk').first().pk
+
+        async def reconnect():
+            return await self.receive_all(await self.subscribe(last_seq=first))
+        frames = async_to_sync(reconnect)()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]['course_id'], 2)
+        self.assertEqual(frames[0]['group'], self.group)
+        self.assertGreater(frames[0]['seq'], first)
+
+        # A new connection only gets the current seq of the log
+        async def connect():
+            return await self.receive_all(await self.subscribe())
+        self.assertEqual(async_to_sync(connect)(), [
+            {'type': 'subscribed', 'context_type': 'student', 'context_id': self.student.pk, 'group': self.group,
+             'seq': Notification.objects.latest('pk').pk},
+        ])
+
+    def test_purged_notifications_ask_for_a_resync(self):
+        publish_many([(self.group, self.material(course_id)) for course_id in range(3)])
+        seqs = list(Notification.objects.order_by('pk').values_list('pk', flat=True))
+        Notification.objects.filter(pk=seqs[0]).update(created_at=timezone.now() - timedelta(days=30))
+        call_command('purge_notifications', pause=0, stdout=StringIO())
+        self.assertEqual(Notification.objects.count(), 2)
+
+        async def reconnect(last_seq):
+            return await self.receive_all(await self.subscribe(last_seq=last_seq))
+        # The notification after seqs[0] - 1 is gone, the ones after seqs[0] are not
+        self.assertEqual(async_to_sync(reconnect)(seqs[0] - 1)[0]['type'], 'resync')
+        self.assertEqual([frame['seq'] for frame in async_to_sync(reconnect)(seqs[0])], seqs[1:])
+
+    def test_full_purge_keeps_the_newest_notification(self):
+        publish_many([(self.group, self.material(course_id)) for course_id in range(3)])
+        seqs = list(Notification.objects.order_by('pk').values_list('pk', flat=True))
+        Notification.objects.update(created_at=timezone.now() - timedelta(days=30))
+        call_command('purge_notifications', pause=0, stdout=StringIO())
+        self.assertEqual(list(Notification.objects.values_list('pk', flat=True)), seqs[-1:])
+        self.assertEqual(missed_notifications(self.group, seqs[0]), ([], False))
+
+        # A log emptied some other way still asks a client that had notifications to resync
+        Notification.objects.all().delete()
+        self.assertEqual(missed_notifications(self.group, seqs[0]), ([], False))
+        self.assertEqual(missed_notifications(self.group, 0), ([], True))
+
+# Test class for the multicast of the material updates
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, NOTIFICATION_DISPATCH_THREAD=False)
+class MulticastTests(TestCase):
+    databases = {'default', 'sessions'}
+
+    def join(self, *groups):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        for group in groups:
+            async_to_sync(layer.group_add)(group, channel)
+        return channel
+
+    def test_a_channel_in_several_groups_gets_one_message(self):
+        layer = get_channel_layer()
+        both, student, other = self.join('course_1', 'student_2'), self.join('student_3'), self.join('student_4')
+        async_to_sync(group_send_many)(layer, ['course_1', 'student_2', 'student_3'], {'type': 'update_material'})
+        for channel in (both, student):
+            self.assertEqual(async_to_sync(layer.receive)(channel), {'type': 'update_material'})
+        # No message left (the emptied queues are dropped), none for the other group
+        for channel in (both, student, other):
+            self.assertNotIn(channel, layer.channels)
+
+    def test_material_upload_is_logged_once_and_sent_to_every_student(self):
+        teacher = UserFactory.create(user_type='teacher')
+        course = CourseFactory.create(teacher=teacher.teacher_profile)
+        students = [UserFactory.create(user_type='student').student_profile for _ in range(3)]
+        for student in students:
+            Enrollment.objects.create(student=student, course=course)
+        channels = [self.join(f'student_{student.pk}') for student in students]
+        self.client.force_login(teacher)
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/course/{course.pk}/detail/', {
+                    'course_name': course.course_name, 'course_start_date': course.course_start_date,
+                    'course_length': course.course_length, 'midterm_deadline': course.midterm_deadline,
+                    'final_deadline': course.final_deadline, 'materials': SimpleUploadedFile('notes.txt', b'notes'),
+                })
+        notification = Notification.objects.get()
+        self.assertEqual(notification.group, f'course_{course.pk}')
+        for channel in channels:
+            message = received_frame(get_channel_layer(), channel)
+            self.assertEqual((message['type'], message['group'], message['seq']), ('update_material', notification.group, notification.pk))
+
+# Test class for the notification outbox and its dispatch after the commit
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, NOTIFICATION_DISPATCH_THREAD=False)
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)('student_3', self.channel)
+
+    def removed(self, course_id):
+        return {'type': 'student_removed', 'student_id': 3, 'course_id': course_id}
+
+    def test_rollback_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    publish('student_3', self.removed(1))
+                    raise IntegrityError
+        self.assertEqual((Notification.objects.count(), callbacks), (0, []))
+        self.assertNotIn(self.channel, self.layer.channels)
+
+    def test_committed_notifications_are_sent_in_order_and_marked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                publish_many([('student_3', self.removed(course_id)) for course_id in range(3)] + [('student_4', self.removed(9))])
+                # Nothing is sent before the commit
+                self.assertNotIn(self.channel, self.layer.channels)
+        messages = [received_frame(self.layer, self.channel) for _ in range(3)]
+        self.assertEqual([message['course_id'] for message in messages], [0, 1, 2])
+        self.assertEqual([message['seq'] for message in messages], sorted(message['seq'] for message in messages))
+        self.assertFalse(Notification.objects.filter(dispatched=False).exists())
+
+    def test_sweep_sends_the_notifications_left_undispatched(self):
+        old, recent = [Notification.objects.create(group='student_3', payload=self.removed(course_id)) for course_id in (1, 2)]
+        Notification.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        # The recent one may still be in the queue of its process
+        unsent = unsent_notifications()
+        self.assertEqual([seq for seq, groups, event in unsent], [old.pk])
+        async_to_sync(send_batch)(unsent)
+        self.assertEqual(received_frame(self.layer, self.channel)['seq'], old.pk)
+        self.assertEqual(list(Notification.objects.filter(dispatched=False).values_list('pk', flat=True)), [recent.pk])
+
+# Test class for the dispatch thread, end to end: committed for real and sent by its own event loop
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   NOTIFICATION_DISPATCH_THREAD=True, NOTIFICATION_SWEEP_INTERVAL=0.2)
+class NotificationDispatcherTests(TransactionTestCase):
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)('student_3', self.channel)
+        self.addCleanup(dispatcher.stop)
+
+    def removed(self, course_id):
+        return {'type': 'student_removed', 'student_id': 3, 'course_id': course_id}
+
+    # Wait for the dispatch thread to mark every notification dispatched
+    def wait_dispatched(self):
+        deadline = time.monotonic() + 5
+        while Notification.objects.filter(dispatched=False).exists():
+            self.assertLess(time.monotonic(), deadline, 'Notifications not dispatched')
+            time.sleep(0.02)
+
+    def test_committed_notifications_are_sent_by_the_dispatch_thread(self):
+        with transaction.atomic():
+            publish_many([('student_3', self.removed(course_id)) for course_id in range(3)])
+        self.wait_dispatched()
+        messages = [received_frame(self.layer, self.channel) for _ in range(3)]
+        self.assertEqual([message['course_id'] for message in messages], [0, 1, 2])
+
+    def test_sweep_runs_at_startup_and_on_its_timer(self):
+        # Left in the outbox by a stopped process, sent without any new notification
+        left = Notification.objects.create(group='student_3', payload=self.removed(1))
+        Notification.objects.filter(pk=left.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        dispatcher.start()
+        self.wait_dispatched()
+        self.assertEqual(received_frame(self.layer, self.channel)['seq'], left.pk)
+        # Swept again on the timer while the queue keeps busy
+        left = Notification.objects.create(group='student_3', payload=self.removed(2))
+        for course_id in range(3, 8):
+            publish('student_4', self.removed(course_id))
+            time.sleep(0.1)
+        self.wait_dispatched()
+        self.assertEqual(received_frame(self.layer, self.channel)['seq'], left.pk)
+
+# Test class for the channel layer delivering in memory to the channels of its process
+@skipUnless(redis_available(), 'No Redis server at TEST_REDIS_URL')
+class HybridChannelLayerTests(TestCase):
+    def layers(self, count):
+        prefix = f'test-{uuid.uuid4().hex[:8]}'
+        return [HybridChannelLayer(hosts=[TEST_REDIS_URL], prefix=prefix) for _ in range(count)]
+
+    def test_local_members_do_not_go_through_redis(self):
+        async def run(layer):
+            channel = await layer.new_channel()
+            await layer.group_add('room', channel)
+            await layer.group_send('room', {'type': 'chat_message', 'message': 'hi'})
+            queued = await layer.connection(0).zcard(layer.prefix + layer.non_local_name(channel))
+            message = await asyncio.wait_for(layer.receive(channel), 5)
+            await layer.flush()
+            return queued, message
+        self.assertEqual(async_to_sync(run)(*self.layers(1)), (0, {'type': 'chat_message', 'message': 'hi'}))
+
+    def test_members_of_other_processes_get_the_message_through_redis(self):
+        async def run(layer, other):
+            local, remote = await layer.new_channel(), await other.new_channel()
+            await layer.group_add('room', local)
+            await other.group_add('room', remote)
+            await layer.group_send('room', {'type': 'chat_message', 'message': 'hi'})
+            received = [await asyncio.wait_for(member_layer.receive(channel), 5) for member_layer, channel in [(layer, local), (other, remote)]]
+            await layer.flush()
+            return received
+        self.assertEqual(async_to_sync(run)(*self.layers(2)), [{'type': 'chat_message', 'message': 'hi'}] * 2)
+
+    def test_send_from_another_thread(self):
+        async def run(layer):
+            channel = await layer.new_channel()
+            await layer.group_add('room', channel)
+            receiving = asyncio.create_task(layer.receive(channel))
+            await asyncio.sleep(0)
+            # As the notification dispatcher does
+            await asyncio.to_thread(async_to_sync(layer.group_send), 'room', {'type': 'update_material'})
+            message = await asyncio.wait_for(receiving, 5)
+            await layer.flush()
+            return message
+        self.assertEqual(async_to_sync(run)(*self.layers(1)), {'type': 'update_material'})
+
+# Test class for the delivery to the local channels from another thread, without Redis
+class HybridChannelLayerDeliveryTests(TestCase):
+    def test_buffer_dropped_before_the_delivery_runs(self):
+        layer = HybridChannelLayer(hosts=[TEST_REDIS_URL])
+        async def run():
+            channel = await layer.new_channel()
+            layer.receive_loop = asyncio.get_running_loop()
+            layer.receive_buffer[channel]
+            # Delivered from the dispatch thread, then the buffer is dropped by receive() before the call runs
+            thread = threading.Thread(target=layer.deliver, args=(channel, {'type': 'update_material'}))
+            thread.start()
+            thread.join()
+            del layer.receive_buffer[channel]
+            await asyncio.sleep(0)
+            return layer.receive_buffer[channel].get_nowait()
+        self.assertEqual(async_to_sync(run)(), {'type': 'update_material'})
+
+# Test class for the consistent-hash ring of the sharded channel layer
+class HashRingTests(TestCase):
+    def test_keys_are_spread_evenly(self):
+        ring = HashRing([f'redis://10.0.0.{i}:6379' for i in range(4)], ShardedChannelLayer.RING_REPLICAS)
+        counts = Counter(ring.index(f'course_{i}') for i in range(10000))
+        self.assertEqual(sorted(counts), [0, 1, 2, 3])
+        self.assertTrue(all(2000 < count < 3000 for count in counts.values()), counts)
+
+    def test_adding_a_host_only_moves_keys_to_it(self):
+        hosts = [f'redis://10.0.0.{i}:6379' for i in range(4)]
+        before, after = HashRing(hosts[:3], 160), HashRing(hosts, 160)
+        moved = [key for key in (f'student_{i}' for i in range(10000)) if before.index(key) != after.index(key)]
+        self.assertEqual({after.index(key) for key in moved}, {3})
+        self.assertLess(len(moved), 3500)
+
+# Test class for the rebalance of the sharded channel layer, two databases of the test Redis standing for two hosts
+@skipUnless(redis_available(), 'No Redis server at TEST_REDIS_URL')
+class RebalanceChannelLayerTests(TestCase):
+    def test_groups_follow_the_ring_after_adding_a_host(self):
+        prefix = f'test-{uuid.uuid4().hex[:8]}'
+        hosts = [f'{TEST_REDIS_URL}/1', f'{TEST_REDIS_URL}/2']
+        groups = [f'course_{i}' for i in range(40)]
+
+        async def join():
+            layer = ShardedChannelLayer(hosts=hosts[:1], prefix=prefix)
+            channel = await layer.new_channel()
+            for group in groups:
+                await layer.group_add(group, channel)
+            return channel
+        channel = async_to_sync(join)()
+
+        out = StringIO()
+        config = {'default': {'BACKEND': 'EduVerse.layers.ShardedChannelLayer', 'CONFIG': {'hosts': hosts, 'prefix': prefix}}}
+        with override_settings(CHANNEL_LAYERS=config):
+            call_command('rebalance_channel_layer', stdout=out)
+            layer = get_channel_layer()
+
+            async def members():
+                found = {}
+                for group in groups:
+                    connection = layer.connection(layer.consistent_hash(group))
+                    found[group] = [member.decode() for member in await connection.zrange(layer._group_key(group), 0, -1)]
+                await layer.flush()
+                return found
+            found = async_to_sync(members)()
+            owners = Counter(layer.consistent_hash(group) for group in groups)
+        self.assertEqual(found, {group: [channel] for group in groups})
+        self.assertIn(f'host 0: moved {owners[1]} keys', out.getvalue())
+        self.assertGreater(owners[1], 0)
+
+# Test class for the MessagePack subprotocol of the consumers
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WireFormatTests(TestCase):
+    def test_msgpack_subprotocol(self):
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/remove-student/course/1/', subprotocols=['msgpack'])
+            connected, subprotocol = await communicator.connect()
+            await communicator.send_to(bytes_data=msgpack.packb({'type': 'remove_student', 'student_id': 2, 'course_id': 1}))
+            frame = await communicator.receive_from()
+            await communicator.disconnect()
+            return subprotocol, frame
+        subprotocol, frame = async_to_sync(run)()
+        self.assertEqual(subprotocol, 'msgpack')
+        self.assertEqual(msgpack.unpackb(frame), {'type': 'student_removed', 'student_id': 2, 'course_id': 1})
+
+    def test_events_carry_only_the_json_frame(self):
+        event = with_encoded_frame({'type': 'update_material', 'course_name': 'Maths', 'course_id': 7, 'seq': 5, 'group': 'course_7'})
+        self.assertEqual(set(event), {'type', 'course_id', 'encoded'})
+        self.assertEqual(list(event['encoded']), [JSON])
+        # The MessagePack frame is encoded from the JSON one by the first consumer that needs it, and kept
+        consumer = NotificationConsumer()
+        consumer.wire_format = MSGPACK
+        frame = consumer.encoded_frame(event)
+        self.assertEqual(msgpack.unpackb(frame), json.loads(event['encoded'][JSON]))
+        self.assertIs(event['encoded'][MSGPACK], frame)
+
+    def test_batches_are_joined_without_decoding(self):
+        frames = [{'message': str(i)} for i in range(20)]
+        for wire_format, decode in [(JSON, json.loads), (MSGPACK, msgpack.unpackb)]:
+            for count in (2, 20):
+                batch = encode_batch([encode(frame, wire_format) for frame in frames[:count]], wire_format)
+                self.assertEqual(decode(batch), frames[:count])
@@ -0,0 +1,157 @@
+'''
+Rate limiting and backpressure for the WebSocket consumers.
+Every connection gets a token bucket refilled at WEBSOCKET_RATE_LIMIT frames per second, holding up to
+WEBSOCKET_RATE_BURST frames: the frames received while the bucket is empty are dropped, and a client
+that keeps sending after WEBSOCKET_RATE_BURST dropped frames in a row is disconnected. A consumer can leave
+its control frames out of the bucket (see exempt_from_rate_limit), when they are bounded otherwise and
+dropping one would leave the client in a wrong state.
+The frames sent to a client go through a queue of at most WEBSOCKET_OUTBOUND_LIMIT frames drained by a
+writer task, so a client that falls behind only holds that many frames: when the queue is full the oldest
+frame is dropped, and a frame sent with a coalesce key replaces the queued frame with the same key.
+Daphne's send returns as soon as the frame is handed to its transport, so the writer measures the slowness
+of the client from the write buffer of the transport: while it holds more than WEBSOCKET_WRITE_BUFFER_LIMIT
+bytes the writer waits, and the frames sent meanwhile stay in the bounded queue. Behind a server whose send
+waits for the client itself (or a transport that cannot be measured) the wait is the send.
+
+Reference: https://en.wikipedia.org/wiki/Token_bucket,
+https://channels.readthedocs.io/en/stable/topics/consumers.html#websocketconsumer,
+https://docs.twisted.org/en/stable/core/howto/producers.html
+'''
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger('EduVerse.throttling')
+
+# Close code sent to a client disconnected for flooding (policy violation)
+CLOSE_RATE_LIMITED = 1008
+# Seconds between two looks at the write buffer of a slow client
+DRAIN_POLL_INTERVAL = 0.01
+
+
+# Transport of the connection behind the ASGI send of Daphne (partial(Server.handle_reply, protocol)),
+# under the send wrappers of the Channels middlewares. None for the other servers and the tests
+def server_transport(send):
+    for _ in range(10):
+        if isinstance(send, functools.partial):
+            protocol = next((arg for arg in send.args if hasattr(arg, 'transport')), None)
+            return getattr(protocol, 'transport', None)
+        # The session middleware wraps the send in a method of its wrapper
+        send = getattr(getattr(send, '__self__', None), 'real_send', None)
+        if send is None:
+            return None
+    return None
+
+
+# Bytes written to a Twisted transport and not yet sent to the client, None if it cannot be measured
+def write_buffer_size(transport):
+    if not hasattr(transport, 'dataBuffer'):
+        return None
+    return len(transport.dataBuffer) - getattr(transport, 'offset', 0) + getattr(transport, '_tempDataLen', 0)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        # The bucket starts full
+        self.tokens = burst
+        self.updated = clock()
+
+    # Take one token if there is one, after adding the tokens earned since the last call
+    def consume(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# Mixin for the AsyncWebsocketConsumer classes, to be listed before it in the bases
+class ThrottledConsumerMixin:
+
+    # Set up the limiter and the outbound queue before the consumer connects
+    async def websocket_connect(self, message):
+        rate = getattr(settings, 'WEBSOCKET_RATE_LIMIT', 0)
+        self.bucket = TokenBucket(rate, getattr(settings, 'WEBSOCKET_RATE_BURST', rate)) if rate else None
+        self.throttled = 0
+        self.open_outbox(server_transport(self.base_send))
+        self.writer = asyncio.ensure_future(self.drain_outbox())
+        await super().websocket_connect(message)
+
+    # True for the frames the rate limit does not apply to, none by default
+    def exempt_from_rate_limit(self, message):
+        return False
+
+    # Drop the frames over the rate limit, and disconnect a client that keeps flooding
+    async def websocket_receive(self, message):
+        if self.exempt_from_rate_limit(message):
+            await super().websocket_receive(message)
+            return
+        if self.bucket is not None and not self.bucket.consume():
+            self.throttled += 1
+            if self.throttled == 1:
+                logger.warning(f"Rate limit reached by {self.channel_name}, dropping frames")
+            if self.throttled > self.bucket.burst:
+                await self.close(code=CLOSE_RATE_LIMITED)
+            return
+        self.throttled = 0
+        await super().websocket_receive(message)
+
+    # Stop the writer, the frames still queued are dropped with the connection
+    async def websocket_disconnect(self, message):
+        self.writer.cancel()
+        await super().websocket_disconnect(message)
+
+    # Create the outbound queue, in front of the transport of the connection if it can be measured
+    def open_outbox(self, transport=None):
+        self.outbox = deque()
+        self.outbox_limit = getattr(settings, 'WEBSOCKET_OUTBOUND_LIMIT', 100)
+        self.transport = transport
+        self.write_buffer_limit = getattr(settings, 'WEBSOCKET_WRITE_BUFFER_LIMIT', 65536)
+        self.outbox_ready = asyncio.Event()
+        self.dropped_frames = 0
+
+    # Queue a frame for the writer, replacing the queued frame with the same coalesce key if any
+    def queue_frame(self, text_data=None, bytes_data=None, coalesce_key=None):
+        if coalesce_key is not None:
+            for index, (key, _, _) in enumerate(self.outbox):
+                if key == coalesce_key:
+                    self.outbox[index] = (coalesce_key, text_data, bytes_data)
+                    return
+        if len(self.outbox) >= self.outbox_limit:
+            self.outbox.popleft()
+            self.dropped_frames += 1
+            if self.dropped_frames == 1:
+                logger.warning(f"Outbound queue of {getattr(self, 'channel_name', None)} is full, dropping frames")
+        self.outbox.append((coalesce_key, text_data, bytes_data))
+        self.outbox_ready.set()
+
+    # Send the queued frames to the client, one at a time, each once the transport has room for it
+    async def drain_outbox(self):
+        while True:
+            await self.outbox_ready.wait()
+            while self.outbox:
+                await self.wait_for_drain()
+                _, text_data, bytes_data = self.outbox.popleft()
+                await super().send(text_data=text_data, bytes_data=bytes_data)
+            self.outbox_ready.clear()
+
+    # Wait while the transport holds more than WEBSOCKET_WRITE_BUFFER_LIMIT bytes for a slow client
+    async def wait_for_drain(self):
+        while (write_buffer_size(self.transport) or 0) > self.write_buffer_limit:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+    # Send a frame through the outbound queue, closing frames are sent at once
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        if close:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        self.queue_frame(text_data, bytes_data, coalesce_key)
@@ -25,6 +25,7 @@ urlpatterns = [
     path('logout/', views.user_logout, name='logout'), 
     path('registration/', views.registration, name='registration'),
     path('student/<int:pk>/', views.student_home, name='student_home'),
+    path('courses/catalog/', views.course_catalog, name='course_catalog'),
     path('course/<int:pk>/', views.course_home, name='course_home'),
     path('course/<int:pk>/detail/', views.course_detail, name='course_detail'),
     path('teacher/<int:pk>/', views.teacher_home, name='teacher_home'),
@@ -32,5 +33,7 @@ urlpatterns = [
     path('chat/<str:course_name>/', views.room, name='room'),
     path('store_info/', views.store_info, name='store_info'),
     path('get_info/', views.get_info, name='get_info'),
+    path('api/rooms/<int:room_id>/history/', api_views.RoomHistoryView.as_view(), name='room_history'),
+    path('api/rooms/<int:room_id>/presence/', api_views.RoomPresenceView.as_view(), name='room_presence'),
     path('api/', include(router.urls)),
 ]
@@ -1,6 +1,7 @@
 '''
 The method 'user_login' handles the validation process of the login, where it retrieves and authenticate email and password
 and based on the user type, it redirects to the appropriate page.
+It is an async view: the password hashing runs in a bounded thread pool and the profile is fetched with the user.
 Reference: https://stackoverflow.com/questions/75401759/how-to-set-up-login-view-in-python-django,
 https://openclassrooms.com/en/courses/7107341-intermediate-django/7263317-create-a-login-page-with-a-function-based-view,
 
@@ -16,10 +17,12 @@ https://reintech.io/blog/working-with-forms-in-django-tutorial-for-software-deve
 
 The method 'student_home' displays the relevant information of the logged-in student, such as:
 the courses in which the student is enrolled, all available courses and status update. 
+The enrolled courses and status updates are read from the StudentDashboard read model, kept up to date by signals.
 Students can also update their profile information using a form provided on the page.
 
 The method 'teacher_home' displays all courses thaught by the logged-in teacher.
 it also allows them to search for users, updating them or adding new courses, and update their profile information. 
+The search uses the full-text index of the users, see search.py.
 
 Refrence (student and teacher): https://docs.djangoproject.com/en/5.1/topics/db/queries/,
 https://docs.djangoproject.com/en/5.1/topics/db/managers/,
@@ -30,6 +33,10 @@ https://books.agiliq.com/projects/django-orm-cookbook/en/latest/query_relatedtoo
 https://stackoverflow.com/questions/70001213/django-queryset-searching-for-firstname-and-lastname-with-startswith,
 https://www.fafadiatech.com/blog/summary-django-i-didnt-know-queryset-could-do-that/
 
+The method 'course_catalog' returns the courses after the 'after' cursor (a course_id) as JSON, a fixed size page at a time,
+for the 'load more' button of the student home.
+Reference: https://use-the-index-luke.com/no-offset
+
 The method 'course_home' provides an overview of a specific course when the student is logged-in, 
 including a list of enrolled students and any feedback. 
 Reference: https://stackoverflow.com/questions/51529018/django-messages-success-message-with-data-from-submitted-form,
@@ -47,8 +54,10 @@ for the logged-in user.
 Reference: https://www.geeksforgeeks.org/generating-random-ids-using-uuid-python/
 
 
-The methods 'store_info' and 'get_info' are used to store the room_id under a key in Redis and retrieve it. This has been used to
+The methods 'store_info' and 'get_info' are used to push the room_id to the pending-room queue of the teacher of the course
+and pop it from the queue of the teacher (see pending_rooms.py). This has been used to
 pass the room_id from the student initiating the chat to the teacher and create the ws/chat/roomId Websocket.
+The WebSocket notifications of course_home and course_detail are sent through the notification log (see notifications.py).
 Reference: https://redis.io/docs/latest/develop/get-started/data-store/,
 https://redis-py2.readthedocs.io/en/latest/
 '''
@@ -58,16 +67,17 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 import uuid
 import json
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import Http404, JsonResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
-import redis
 from django.urls import reverse
 from .models import *
-from django.db.models import Q
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from .forms import *
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from .search import search_users
+from .authentication import aauthenticate_with_profile
+from .pending_rooms import get_pending_rooms
+from .notifications import publish
+from asgiref.sync import sync_to_async
 
 
 # Render the homepage template
@@ -75,32 +85,39 @@ def index(request):
     return render(request, 'index.html')
 
 
-# This view handles the login to the app from an existing user
-def user_login(request):
+# Log the user in and set the session data (sync, the session is stored in the database)
+def start_session(request, user):
+    login(request, user)
+    request.session['user_id'] = user.id
+    request.session['user_type'] = user.user_type
+    request.session['reference'] = str(uuid.uuid4())
+    if user.user_type == 'student':
+        request.session['student_id'] = user.student_profile.pk
+    elif user.user_type == 'teacher':
+        request.session['teacher_id'] = user.teacher_profile.pk
+
+# This view handles the login to the app from an existing user.
+# It is asynchronous: the password is checked in a thread pool (see authentication.py)
+async def user_login(request):
     # if received the POST request, get the email and password and autheticate them
     if request.method == 'POST':
         email = request.POST['username']
         password = request.POST['password']
-        user = authenticate(request, username=email, password=password)
+        user = await aauthenticate_with_profile(request, email, password)
         # if the user exists, login in the app
         if user is not None:
-            login(request, user)
+            # the profile was fetched with the user, a missing one is a 404 as before
+            try:
+                await sync_to_async(start_session)(request, user)
+            except (Student.DoesNotExist, Teacher.DoesNotExist):
+                raise Http404('Profile not found')
 
-            # Set session data for the logged-in user
-            request.session['user_id'] = user.id
-            request.session['user_type'] = user.user_type
-            request.session['reference'] = str(uuid.uuid4())
-            
             # if the user is a student, it redirects to the student home
             if user.user_type == 'student':
-                student = get_object_or_404(Student, user=user)
-                request.session['student_id'] = student.pk
-                return redirect('student_home', pk=student.pk)
+                return redirect('student_home', pk=user.student_profile.pk)
             # if the user is a teacher, it redirects to the teacher home
             elif user.user_type == 'teacher':
-                teacher = get_object_or_404(Teacher, user=user)
-                request.session['teacher_id'] = teacher.pk
-                return redirect('teacher_home', pk=teacher.pk)
+                return redirect('teacher_home', pk=user.teacher_profile.pk)
             # otherwise it displays an error message
         else:
             messages.error(request, 'Invalid email or password.')
@@ -163,17 +180,12 @@ def registration(request):
 
 # this view handles the student home
 def student_home(request, pk):
-    # Fetch the student based on the primary key
-    student = get_object_or_404(Student, pk=pk)
-    
-    # Fetch all the courses the student is currently enrolled in
-    enrolled_courses = Course.objects.filter(students=student)
+    # Fetch the student together with the user, address and the dashboard read model
+    students = Student.objects.select_related('user__address', 'dashboard')
+    student = get_object_or_404(students, pk=pk)
 
-    # Fetch all available courses
-    available_courses = Course.objects.all()
-
-    # Fetch enrollments for the student to get the status updates
-    enrollments = Enrollment.objects.filter(student=student).order_by('-enrollment_date')
+    # Fetch the first page of the course catalog
+    available_courses, catalog_cursor = catalog_page()
 
     if request.method == 'POST':
         # Handle posting a new status update
@@ -184,6 +196,8 @@ def student_home(request, pk):
             enrollment, created = Enrollment.objects.get_or_create(student=student, course=course)
             enrollment.status_update = status_update
             enrollment.save()
+            # Reload the student so the dashboard rebuilt by the signal is picked up
+            student = students.get(pk=pk)
             # Set the form after saving the status update
             form = StudentUpdateForm(instance=student)
         else:
@@ -220,16 +234,48 @@ def student_home(request, pk):
         # Initialize the form if not a POST request
         form = StudentUpdateForm(instance=student)
 
+    # The enrolled courses and the status updates come from the dashboard,
+    # which is built here the first time if the signals have not created it yet
+    try:
+        dashboard = student.dashboard
+    except StudentDashboard.DoesNotExist:
+        dashboard = StudentDashboard.rebuild(student.pk)
+
     context = {
         'student': student,
-        'enrolled_courses': enrolled_courses,
-        'enrollments': enrollments,
+        'enrolled_courses': dashboard.enrolled_courses,
+        'enrollments': dashboard.enrollments,
         'form': form,
         'available_courses': available_courses,
+        'catalog_cursor': catalog_cursor,
     }
 
     return render(request, 'student.html', context)
 
+# Number of courses in each page of the catalog
+CATALOG_PAGE_SIZE = 20
+
+# Return one page of the course catalog ordered by course_id and the cursor of the next page.
+# The page is read with a keyset condition on the primary key, so its cost does not grow with the catalog
+def catalog_page(after=None, size=CATALOG_PAGE_SIZE):
+    courses = Course.objects.order_by('course_id')
+    if after is not None:
+        courses = courses.filter(course_id__gt=after)
+    # Read one extra row to know if there is a next page
+    page = list(courses.values('course_id', 'course_name')[:size + 1])
+    next_cursor = page[size - 1]['course_id'] if len(page) > size else None
+    return page[:size], next_cursor
+
+# this view returns the next page of the course catalog for the 'load more' button
+def course_catalog(request):
+    try:
+        after = request.GET.get('after')
+        after = int(after) if after else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    courses, next_cursor = catalog_page(after)
+    return JsonResponse({'courses': courses, 'next_cursor': next_cursor})
+
 # this view handles how the student see a course page
 def course_home(request, pk):
     # Fetch the course based on the primary key (pk)
@@ -258,21 +304,24 @@ def course_home(request, pk):
         # Handle course enrollment
         if 'enroll' in request.POST:
             if not is_enrolled:
-                # Create a new Enrollment record for the student and course
-                Enrollment.objects.create(student=student, course=course)
-
-                # Send a message to the teacher's WebSocket connection
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f"teacher_{course.teacher.id}",
-                    {
-                        'type': 'student_enrolled',
-                        'student_name': f"{student.user.first_name} {student.user.last_name}",
-                        'course_name': course.course_name,
-                        'enrolled_student_count': course.students.count() + 1,
-                        'course_id': course.pk, 
-                    }
-                )
+                # The enrollment and its notification are committed together
+                with transaction.atomic():
+                    # Create a new Enrollment record for the student and course
+                    Enrollment.objects.create(student=student, course=course)
+                    # Read the counter incremented by the enrollment signal
+                    course.refresh_from_db(fields=['enrolled_count'])
+
+                    # Notify the teacher's WebSocket connection, sent after the commit (see notifications.py)
+                    publish(
+                        f"teacher_{course.teacher.id}",
+                        {
+                            'type': 'student_enrolled',
+                            'student_name': f"{student.user.first_name} {student.user.last_name}",
+                            'course_name': course.course_name,
+                            'enrolled_student_count': course.enrolled_count,
+                            'course_id': course.pk, 
+                        }
+                    )
                 # Show a success message to the user
                 messages.success(request, 'You have been enrolled in the course.')
                 # Redirect to the same course page after enrollment
@@ -338,12 +387,7 @@ def teacher_home(request, pk):
     results = User.objects.none()
     # if there is a query in the search bar, it performs the search based on the query
     if query:
-        results = User.objects.filter(
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(email__icontains=query) |
-            Q(first_name__icontains=query.split(' ')[0]) & Q(last_name__icontains=query.split(' ')[-1])
-        )
+        results = search_users(query)
 
     # create a unique reference for the session
     reference = str(uuid.uuid4()) 
@@ -384,23 +428,24 @@ def course_detail(request, pk):
             try:
                 # Retrieve the enrollment record for the student and course
                 enrollment = Enrollment.objects.get(course_id=pk, student_id=student_pk)
-                # Delete the enrollment record
-                enrollment.delete()
 
-                # Get the channel layer for WebSocket communication
-                channel_layer = get_channel_layer()
                 # Define the group name for notifying student removal
                 student_removed_group_name = f"student_{student_pk}"
 
-                # Send a message to the student's WebSocket group about removal
-                async_to_sync(channel_layer.group_send)(
-                    student_removed_group_name,
-                    {
-                        'type': 'student_removed',
-                        'student_id': student_pk,
-                        'course_id': pk
-                    }
-                )
+                # The removal and its notification are committed together
+                with transaction.atomic():
+                    # Delete the enrollment record
+                    enrollment.delete()
+
+                    # Notify the student's WebSocket group about removal, sent after the commit
+                    publish(
+                        student_removed_group_name,
+                        {
+                            'type': 'student_removed',
+                            'student_id': student_pk,
+                            'course_id': pk
+                        }
+                    )
 
                 # Redirect back to the course detail page
                 return redirect(reverse('course_detail', args=[pk]))
@@ -421,34 +466,22 @@ def course_detail(request, pk):
             if 'materials' in request.FILES:
                 course.materials = request.FILES['materials']
 
-                # Save the updated course details
-                course.save()
-
-                # Notify the course group about the material update
-                channel_layer = get_channel_layer()
-                course_group_name = f'course_{course.pk}'
-
-                async_to_sync(channel_layer.group_send)(
-                    course_group_name,
-                    {
-                        'type': 'update_material',
-                        'course_name': course.course_name,
-                        'course_id': course.pk
-                    }
-                )
+                # The course and its notification are committed together
+                with transaction.atomic():
+                    # Save the updated course details
+                    course.save()
 
-                # Notify all enrolled students about the material update
-                for enrollment in enrolled_students:
-                    student = enrollment.student
-                    student_group_name = f'student_{student.id}'
-                    
-                    async_to_sync(channel_layer.group_send)(
-                        student_group_name,
+                    # Notify the course group and all enrolled students about the material update:
+                    # logged once in the course group and sent to every group in one multicast
+                    # by the dispatcher after the commit (see notifications.py)
+                    publish(
+                        f'course_{course.pk}',
                         {
                             'type': 'update_material',
                             'course_name': course.course_name,
                             'course_id': course.pk
-                        }
+                        },
+                        fanout=[f'student_{student_id}' for student_id in enrolled_students.values_list('student_id', flat=True)],
                     )
 
                 # Show a success message to the user
@@ -503,44 +536,46 @@ def room(request, course_name):
     }
     return render(request, 'room.html', context)
 
-# Initialize a Redis client to connect to a Redis server running on localhost
-# The Redis server is assumed to be running on the default port 6379 and using database 0
-# different than using Redis for setting the Django Channels like shown in the settings
-redis_client = redis.StrictRedis(host='127.0.0.1', port=6379, db=0)
-
 @csrf_exempt
-def store_info(request):
-    # This view function is responsible for storing data in Redis
+async def store_info(request):
+    # This view function is responsible for queuing the room for the teacher of its course
     if request.method == 'POST':
         try:
             # Parse JSON data from the request body
             data = json.loads(request.body)
             
             # Extract 'room_id' from the parsed JSON data
-            room_id = data.get('room_id')
-            
-            # Store the 'room_id' value in Redis with the key 'room_id'
-            redis_client.set('room_id', room_id)
-            
-            # Return a JSON response indicating success and echo the room_id
-            return JsonResponse({'status': 'success', 'room_id': room_id})
-        except json.JSONDecodeError:
+            room_id = int(data.get('room_id'))
+        except (json.JSONDecodeError, TypeError, ValueError):
             # Return a 400 Bad Request response if JSON decoding fails
             return HttpResponseBadRequest('Invalid JSON')
 
-def get_info(request):
-    # This view function is responsible for retrieving data from Redis
+        # The room of a course is waiting for the teacher of the course
+        teacher_id = await Course.objects.filter(pk=room_id).values_list('teacher_id', flat=True).afirst()
+        if teacher_id is None:
+            return JsonResponse({'error': 'Room not found'}, status=404)
+        await get_pending_rooms().push(teacher_id, room_id)
+
+        # Return a JSON response indicating success and echo the room_id
+        return JsonResponse({'status': 'success', 'room_id': room_id})
+
+async def get_info(request):
+    # This view function is responsible for taking the oldest room waiting for the logged-in teacher
     if request.method == 'GET':
-        # Retrieve the value associated with the key 'room_id' from Redis
-        room_id = redis_client.get('room_id')
+        user = await request.auser()
+        room_id = None
+        if user.is_authenticated:
+            teacher_id = await Teacher.objects.filter(user_id=user.pk).values_list('pk', flat=True).afirst()
+            if teacher_id is not None:
+                room_id = await get_pending_rooms().pop(teacher_id)
         
         if room_id:
-            # Return the room_id as a JSON response, decoding from bytes to a string
+            # Return the room_id as a JSON response
             return JsonResponse({
-                'room_id': room_id.decode('utf-8'),
+                'room_id': str(room_id),
             })
         else:
-            # Return a 404 Not Found response if the room_id is not found in Redis
+            # Return a 404 Not Found response if no room is waiting for the teacher
             return JsonResponse({'error': 'Room ID not found'}, status=404)
 
 
@@ -0,0 +1,160 @@
+'''
+Frames sent to the WebSocket clients and their wire format.
+A client chooses the format at connect with the WebSocket subprotocol: 'msgpack' gets binary MessagePack frames
+(and may send MessagePack frames), any other client gets the JSON text frames.
+The frames are built from the group events by the builders below. An event sent to a group can carry its frame
+already encoded (with_encoded_frame) instead of its fields, so it is encoded once per group event by the sender
+instead of once per socket by every consumer of the group. Only the JSON frame is sent through the channel layer:
+the MessagePack one is encoded from it by the first consumer of a MessagePack client that gets the event, and kept
+in the event for the other consumers of the process it is delivered to in memory.
+
+Reference: https://msgpack.org/,
+https://channels.readthedocs.io/en/stable/topics/consumers.html#websocketconsumer,
+https://developer.mozilla.org/en-US/docs/Web/API/WebSockets_API/Writing_WebSocket_servers#subprotocols
+'''
+
+import json
+import msgpack
+
+# Wire formats, the MessagePack one is also the name of its subprotocol
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+# Sequence number and group of an event sent through the notification log (see notifications.py)
+def log_position(event):
+    return {key: event[key] for key in ('seq', 'group') if key in event}
+
+
+# Builders of the frames of the group events, by event type
+def chat_message_frame(event):
+    return {
+        'message': event.get('message', ''),
+        'author': event.get('author', ''),
+        'course_name': event.get('course_name', ''),
+    }
+
+def course_name_frame(event):
+    return {'course_name': event['course_name']}
+
+def student_removed_frame(event):
+    return {
+        'type': 'student_removed',
+        'student_id': event.get('student_id'),
+        'course_id': event.get('course_id'),
+        **log_position(event),
+    }
+
+def update_material_frame(event):
+    return {
+        'type': 'update_material',
+        'course_name': event.get('course_name'),
+        'course_id': event.get('course_id'),
+        **log_position(event),
+    }
+
+def students_enrolled_frame(event):
+    return {
+        'type': 'students_enrolled',
+        'courses': event.get('courses', []),
+        **log_position(event),
+    }
+
+def student_enrolled_frame(event):
+    return {
+        'type': 'student_enrolled',
+        'student_name': event.get('student_name', 'Unknown'),
+        'course_name': event.get('course_name', 'Unknown'),
+        'enrolled_student_count': event.get('enrolled_student_count', 0),
+        'course_id': event.get('course_id', 0),
+        **log_position(event),
+    }
+
+FRAME_BUILDERS = {
+    'chat_message': chat_message_frame,
+    'course_name': course_name_frame,
+    'student_removed': student_removed_frame,
+    'update_material': update_material_frame,
+    'students_enrolled': students_enrolled_frame,
+    'student_enrolled': student_enrolled_frame,
+}
+
+
+# Encode a frame in a wire format
+def encode(frame, wire_format):
+    if wire_format == MSGPACK:
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame)
+
+
+# Data of a frame received from a client, None if it cannot be decoded
+def decode(message, wire_format):
+    try:
+        if message.get('bytes') is not None and wire_format == MSGPACK:
+            return msgpack.unpackb(message['bytes'], raw=False)
+        return json.loads(message.get('text') or 'null')
+    except (TypeError, ValueError):
+        return None
+
+
+# Join encoded frames into one array frame, without decoding them
+def encode_batch(encoded, wire_format):
+    if wire_format == MSGPACK:
+        # An array header followed by its items
+        if len(encoded) < 16:
+            header = bytes([0x90 | len(encoded)])
+        elif len(encoded) < 2 ** 16:
+            header = b'\xdc' + len(encoded).to_bytes(2, 'big')
+        else:
+            header = b'\xdd' + len(encoded).to_bytes(4, 'big')
+        return header + b''.join(encoded)
+    return '[' + ', '.join(encoded) + ']'
+
+
+# Fields of the group events read by the consumers themselves, sent with the encoded frame
+EVENT_KEYS = {
+    'update_material': ('course_id',),
+}
+
+
+# Group event carrying its JSON frame instead of its fields
+def with_encoded_frame(event):
+    frame = FRAME_BUILDERS[event['type']](event)
+    kept = {key: event[key] for key in EVENT_KEYS.get(event['type'], ()) if key in event}
+    return {'type': event['type'], **kept, 'encoded': {JSON: encode(frame, JSON)}}
+
+
+# Mixin for the AsyncWebsocketConsumer classes choosing the wire format at connect
+class WireFormatMixin:
+
+    # Accept the connection with the MessagePack subprotocol when the client asks for it
+    async def accept(self, subprotocol=None, headers=None):
+        self.wire_format = MSGPACK if MSGPACK in self.scope.get('subprotocols', []) else JSON
+        await super().accept(subprotocol=MSGPACK if self.wire_format == MSGPACK else subprotocol, headers=headers)
+
+    # The consumers parse JSON text: the MessagePack frames of a client are handed to them as JSON
+    async def websocket_receive(self, message):
+        if message.get('bytes') is not None and getattr(self, 'wire_format', JSON) == MSGPACK:
+            message = {'type': message['type'], 'text': json.dumps(decode(message, MSGPACK))}
+        await super().websocket_receive(message)
+
+    # Frame of a group event in the wire format of the client, encoded by the sender when it can be.
+    # The MessagePack frame is encoded from the JSON one once, and kept in the event
+    def encoded_frame(self, event):
+        encoded = event.get('encoded')
+        if encoded is None:
+            return encode(FRAME_BUILDERS[event['type']](event), self.wire_format)
+        if self.wire_format not in encoded:
+            encoded[self.wire_format] = encode(json.loads(encoded[JSON]), self.wire_format)
+        return encoded[self.wire_format]
+
+    # Send an encoded frame as a text or binary frame
+    async def send_encoded(self, data, coalesce_key=None):
+        if self.wire_format == MSGPACK:
+            await self.send(bytes_data=data, coalesce_key=coalesce_key)
+        else:
+            await self.send(text_data=data, coalesce_key=coalesce_key)
+
+    # Send the frame of a group event
+    async def send_event(self, event, coalesce_key=None):
+        await self.send_encoded(self.encoded_frame(event), coalesce_key=coalesce_key)
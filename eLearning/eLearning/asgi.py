@@ -8,6 +8,7 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
@@ -25,3 +26,7 @@ application = ProtocolTypeRouter({
     ),
 })
 
+# Start the notification dispatcher with the server, its first sweep sends what a stopped process left in the outbox
+from EduVerse.notifications import dispatcher
+if settings.NOTIFICATION_DISPATCH_THREAD:
+    dispatcher.start()
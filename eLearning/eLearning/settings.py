@@ -96,7 +96,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Sessions are kept in their own file, so they do not compete for the write lock of the app data
+    'sessions': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'sessions.sqlite3',
+    },
+}
+DATABASE_ROUTERS = ['EduVerse.routers.SessionRouter']
+
+# Caches, 'sessions' is the cache in front of the session database.
+# Any Django cache backend can be used, with several server processes it must be a shared one (e.g. Redis)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
 
@@ -118,12 +137,36 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashers, the first one is used for new passwords and the others are rehashed to it at login
+PASSWORD_HASHERS = [
+    'EduVerse.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Cost of the argon2 hasher: iterations, memory in KiB and lanes
+ARGON2_TIME_COST = 2
+ARGON2_MEMORY_COST = 19456
+ARGON2_PARALLELISM = 1
+# Threads hashing passwords for the async login view
+LOGIN_HASH_WORKERS = 4
+# Hasher run for a login with an unknown email: the one of the stored passwords (the existing users are PBKDF2),
+# so it takes as long as a wrong password. Set it to 'argon2' once the users are rehashed
+LOGIN_DUMMY_HASHER = 'pbkdf2_sha256'
+
 # Django REST framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    # Cursor pagination on a stable key for every endpoint
+    'DEFAULT_PAGINATION_CLASS': 'EduVerse.pagination.StableCursorPagination',
+    'PAGE_SIZE': 50,
 }
+# Maximum page size a client can ask for with ?page_size=
+API_MAX_PAGE_SIZE = 200
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -154,18 +197,63 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'EduVerse/media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Channels configuration for WebSocket
+# Channels configuration for WebSocket, the messages between the consumers of a worker stay in the process,
+# the groups and channels are sharded across the Redis hosts by consistent hashing (see layers.py).
+# After adding a host, run the rebalance_channel_layer command
+CHANNEL_LAYER_HOSTS = [('34.196.116.115', 6379)]
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'EduVerse.layers.ShardedChannelLayer',
         'CONFIG' : {
-            'hosts' : [('34.196.116.115', 6379)]
+            'hosts' : CHANNEL_LAYER_HOSTS
         },
     }
 }
 
-# Session settings
-SESSION_ENGINE = 'django.contrib.sessions.backends.db' 
+# Chat history write-behind buffer: messages written per INSERT and seconds between flushes
+CHAT_HISTORY_BATCH_SIZE = 100
+CHAT_HISTORY_FLUSH_INTERVAL = 0.5
+# Failed writes of the buffer in a row before its messages are written one at a time and the failing ones dropped
+CHAT_HISTORY_MAX_ATTEMPTS = 3
+# Seconds the chat frames sent to a client are collected and sent as one JSON array, 0 sends each frame at once
+CHAT_BATCH_WINDOW = 0.005
+
+# WebSocket limits per connection: frames/sec received (0 disables the limit), burst of frames
+# received at once, frames queued for a client that falls behind before the oldest are dropped,
+# and bytes in the write buffer of its transport above which the client is behind
+WEBSOCKET_RATE_LIMIT = 10
+WEBSOCKET_RATE_BURST = 20
+WEBSOCKET_OUTBOUND_LIMIT = 200
+WEBSOCKET_WRITE_BUFFER_LIMIT = 65536
+# Groups one multiplexed connection (ws/multiplex/) can subscribe to: a student page subscribes to its student
+# group and to one group per enrolled course, the subscriptions over the limit are refused with subscribe_refused
+MULTIPLEX_MAX_SUBSCRIPTIONS = 200
+
+# Chat room presence: seconds between the heartbeats of a connection, seconds before a member without heartbeat expires
+PRESENCE_HEARTBEAT = 15
+PRESENCE_TTL = 45
+
+# Chat rooms waiting for a teacher (see pending_rooms.py): Redis URL (None keeps them in the process),
+# seconds before a room not taken is dropped, and connections of the pool of each event loop
+PENDING_ROOMS_REDIS_URL = 'redis://127.0.0.1:6379/0'
+PENDING_ROOMS_TTL = 300
+PENDING_ROOMS_POOL_SIZE = 50
+
+# Notification log (see notifications.py): days the notifications are kept (purge_notifications command),
+# and most notifications replayed to a client that reconnects before it is told to reload
+NOTIFICATION_RETENTION_DAYS = 7
+NOTIFICATION_REPLAY_LIMIT = 200
+# Send the notifications from the dispatcher of the process after the commit, so the requests do not
+# wait for the channel layer; False sends them in the request thread (tests).
+# Most notifications sent by a sweep, and seconds between the sweeps of the undispatched notifications
+NOTIFICATION_DISPATCH_THREAD = True
+NOTIFICATION_DISPATCH_BATCH = 500
+NOTIFICATION_SWEEP_INTERVAL = 30
+
+# Session settings, sessions are read from the cache and written through to the session database.
+# Expired sessions are deleted by the purge_sessions command
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_AGE = 1209600 
 SESSION_COOKIE_SECURE = False 